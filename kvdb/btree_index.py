@@ -1,6 +1,5 @@
-from kv_index import KVIndex
-
-import pickle
+from kv_index import KVIndex, ValuePointer
+from value_record import ValueRecord
 
 
 class BTreeIndex(KVIndex):
@@ -15,10 +14,50 @@ class BTreeIndex(KVIndex):
         self._root = BTreeNode()
         self._btree_rank = btree_rank
         self._memory_manager = memory_manager
+        # shared value log block, values are appended until it is full
+        self._current_block = None
+        self._configure()
+
+    def _configure(self):
+        """read settings from conf"""
+        # every time we need to allocate a new block, scale * target_memory would be allocated
+        self._memory_allocate_scale = (
+            int(
+                self._memory_manager.conf.get(
+                    "BTREE_INDEX", "MEMORY_ALLOCATE_SCALE", fallback=0
+                )
+            )
+            or 10
+        )
+        # layout and compression of persisted values
+        self._value_record = ValueRecord(self._memory_manager, "BTREE_INDEX")
 
     def set(self, key, value):
         # turn object into persistence storage
-        value = TreeValue.from_value(value, self._memory_manager)
+        value = self._persist_value(key, value)
+        self._set_value(key, value, release=True)
+        return value
+
+    def restore(self, key, location):
+        if location is None:
+            self._remove_key(key, release=False)
+            return
+        # restore order is log order on replay but key order on rebuild, block ids
+        # grow with allocation, so keep appending to newest block seen
+        # block is freed once every value in it is overwritten, later in log
+        block = self._memory_manager.block_dict.get(location[0])
+        if (
+            block is not None
+            and not self._memory_manager.is_sealed(block.block_id)
+            and (
+                self._current_block is None
+                or block.block_id > self._current_block.block_id
+            )
+        ):
+            self._current_block = block
+        self._set_value(key, TreeValue(*location), release=False)
+
+    def _set_value(self, key, value, release):
         current, current_list_node = self._root, None
         # current BTree node
         while current:
@@ -31,6 +70,8 @@ class BTreeIndex(KVIndex):
                 prev_list_node = prev_list_node.next.next
                 key_node = key_node.next.next
             if key_node and key_node.key == key:
+                if release:
+                    self._release_value(key_node.value)
                 key_node.value = value
                 return
             else:
@@ -96,7 +137,7 @@ class BTreeIndex(KVIndex):
             head, prev_list_node = current.list_head.next.next, current.list_head.next
             while head:
                 if head.key == key:
-                    return head.value.load_value(self._memory_manager)
+                    return self._load_value(head.value)
                 elif head.key > key:
                     break
                 head = head.next.next
@@ -105,9 +146,17 @@ class BTreeIndex(KVIndex):
         return default
 
     def remove(self, key):
+        result = self._remove_key(key, release=True)
+        if result and self._value_record.keyed:
+            self._write_marker(self._value_record.encode_tombstone(key))
+        return result
+
+    def _remove_key(self, key, release):
         btree_node = self._find_btree_node_with_given_key(key)
         if btree_node:
             key_node = btree_node.find_key_node(key)
+            if release:
+                self._release_value(key_node.value)
             # use predecessor first
             predecessor_key_node = self._find_predecessor_key_node(key_node)
             if predecessor_key_node:
@@ -222,6 +271,33 @@ class BTreeIndex(KVIndex):
         return map(lambda pair: pair[0], self.key_value_pairs())
 
     def key_value_pairs(self):
+        for node in self._key_nodes():
+            yield node.key, self._load_value(node.value)
+
+    def clear(self):
+        for node in self._key_nodes():
+            self._release_value(node.value)
+        self._root = BTreeNode()
+        if self._value_record.keyed:
+            self._write_marker(self._value_record.encode_clear())
+
+    def entries(self):
+        for node in self._key_nodes():
+            yield node.key, node.value
+
+    def load_value(self, location):
+        return self._load_value(TreeValue(*location))
+
+    def live_values(self):
+        return [
+            (node.value, self._record_length(node.value)) for node in self._key_nodes()
+        ]
+
+    def seal_blocks(self):
+        self._current_block = None
+
+    def _key_nodes(self):
+        """iterate all key nodes in key order"""
         stack = []
         node = self._root.list_head.next
         while node:
@@ -241,10 +317,50 @@ class BTreeIndex(KVIndex):
                     next_layer.reverse()
                     stack.extend(next_layer)
             else:
-                yield node.key, node.value.load_value(self._memory_manager)
+                yield node
+
+    def _persist_value(self, key, value):
+        """value -> TreeValue, append it to the shared value log block"""
+        return TreeValue(*self._write_record(self._value_record.encode(key, value)))
+
+    def _write_record(self, parts):
+        """append record parts to shared value log block, return (block id, address)"""
+        record_length = self._value_record.length(parts)
+        # current block's capacity is not enough
+        if (
+            self._current_block is None
+            or record_length > self._current_block.free_memory
+        ):
+            if self._current_block is not None:
+                self._memory_manager.seal_block(self._current_block.block_id)
+            self._current_block = self._memory_manager.allocate_block(
+                record_length * self._memory_allocate_scale
+            )
 
-    def clear(self):
-        self._root = BTreeNode()
+        block_id, address = (
+            self._current_block.block_id,
+            self._current_block.current_offset,
+        )
+        for part in parts:
+            self._current_block.write(part)
+        return block_id, address
+
+    def _load_value(self, tree_value):
+        """TreeValue -> original object"""
+        assert isinstance(tree_value, TreeValue)
+        block_id, address = tree_value.location
+        block = self._memory_manager.block_dict[block_id]
+        return self._value_record.load(block, address)
+
+    def _record_length(self, tree_value):
+        block_id, address = tree_value.location
+        block = self._memory_manager.block_dict[block_id]
+        return self._value_record.record_length(block, address)
+
+    def _release_value(self, tree_value):
+        """give space of an overwritten or removed value back to memory manager"""
+        block_id, address = tree_value.location
+        self._memory_manager.release(block_id, address, self._record_length(tree_value))
 
     def _split(self, btree_node):
         # split btree node into `left_btree_root_node`, `(key, value)`, `right_btree_root_node`
@@ -325,6 +441,20 @@ class BTreeIndex(KVIndex):
         # current.next will return legal key_node or None
         return current.next
 
+    def __setstate__(self, state):
+        # settings missing from indexes pickled by older versions are read from
+        # conf, pickled ones take precedence
+        self._memory_manager = state["_memory_manager"]
+        # first version kept a block per value, new values go to a new value log
+        self._current_block = None
+        self._configure()
+        self.__dict__.update(state)
+        # block may be sealed after index is pickled
+        if self._current_block is not None and self._memory_manager.is_sealed(
+            self._current_block.block_id
+        ):
+            self._current_block = None
+
 
 class BTreeNode(object):
     def __init__(self, list_head=None, parent_tree_list_node=None, size=0):
@@ -491,34 +621,7 @@ class KeyListNode(ListNode):
         return "(key: {}, value: {})".format(self.key, self.value)
 
 
-class TreeValue(object):
-    def __init__(self, block_id, address):
-        self.block_id = block_id
-        self.address = address
-
-    @staticmethod
-    def from_value(value, memory_manager):
-        value_string = pickle.dumps(value)
-        length = len(value_string)
-        value_header_length = int(
-            memory_manager.conf.get("BTREE_INDEX", "VALUE_HEADER_LENGTH")
-        )
-        output_string = ("%0{}d".format(value_header_length) % length).encode(
-            "utf-8"
-        ) + value_string
-        block = memory_manager.allocate_block(len(output_string))
-        block.write(output_string)
-        return TreeValue(block.block_id, 0)
-
-    def load_value(self, memory_manager):
-        value_header_length = int(
-            memory_manager.conf.get("BTREE_INDEX", "VALUE_HEADER_LENGTH")
-        )
-        block = memory_manager.block_dict[self.block_id]
-        length = int(block.read(self.address, value_header_length))
-        byte_string = block.read(self.address + value_header_length, length)
-        return pickle.loads(byte_string)
-
+class TreeValue(ValuePointer):
     def __str__(self):
         return "(block_id: {}, address: {})".format(self.block_id, self.address)
 
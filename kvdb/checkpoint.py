@@ -0,0 +1,161 @@
+import os
+import pickle
+from contextlib import contextmanager
+
+from memory_block import MemoryBlock
+from memory_manager import MemoryManager
+from write_ahead_log import WAL_SET, WAL_SET_VALUE
+
+
+class CheckpointPickler(pickle.Pickler):
+    """
+    Pickle index without its memory manager, manager and blocks are stored as
+    references, they are resolved against the manager opened from storage files
+    """
+
+    def persistent_id(self, obj):
+        if isinstance(obj, MemoryManager):
+            return ("memory_manager",)
+        if isinstance(obj, MemoryBlock):
+            return ("block", obj.block_id)
+        return None
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, file, memory_manager):
+        super().__init__(file)
+        self._memory_manager = memory_manager
+
+    def persistent_load(self, pid):
+        if pid[0] == "memory_manager":
+            return self._memory_manager
+        if pid[0] == "block":
+            # a block freed after checkpoint is no longer appended to
+            return self._memory_manager.block_dict.get(pid[1])
+        raise pickle.UnpicklingError("unknown persistent id {}".format(pid))
+
+
+class Checkpoint(object):
+    """
+    Index snapshot plus deltas of entries changed after it
+
+    Snapshot is the whole pickled index. A delta keeps the latest entry of every
+    key changed since previous checkpoint, so writing it costs as much as changed
+    keys, not as the index. When there are more than `max_deltas` deltas they are
+    merged into one. Files are replaced atomically, a crash leaves either the
+    previous or the new checkpoint.
+    """
+
+    def __init__(self, filepath, max_deltas=8):
+        self._filepath = filepath
+        self._max_deltas = max_deltas
+        # deltas numbered below it are already covered by snapshot
+        self._base_sequence = 0
+        if self.exists():
+            with open(self._filepath, "rb") as checkpoint_f:
+                self._base_sequence = pickle.load(checkpoint_f)
+        self._delta_sequences = []
+        folder, prefix = os.path.split(self._delta_filepath(""))
+        for filename in os.listdir(folder or "."):
+            if filename.startswith(prefix) and filename[len(prefix) :].isdigit():
+                sequence = int(filename[len(prefix) :])
+                if sequence < self._base_sequence:
+                    # left by a crash right after snapshot is written
+                    os.remove(self._delta_filepath(sequence))
+                else:
+                    self._delta_sequences.append(sequence)
+        self._delta_sequences.sort()
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def delta_count(self):
+        return len(self._delta_sequences)
+
+    def exists(self):
+        """whether a snapshot exists, deltas could exist without it"""
+        return os.path.exists(self._filepath)
+
+    def dump(self, index):
+        """write a snapshot of index, all deltas are covered by it"""
+        sequence = self._next_sequence()
+        with self._atomic_file(self._filepath) as checkpoint_f:
+            pickle.dump(sequence, checkpoint_f)
+            CheckpointPickler(checkpoint_f).dump(index)
+        for delta_sequence in self._delta_sequences:
+            os.remove(self._delta_filepath(delta_sequence))
+        self._base_sequence, self._delta_sequences = sequence, []
+
+    def dump_delta(self, cleared, entries):
+        """
+        write entries changed since previous checkpoint, `entries` maps key to
+        (operation, argument) of its latest logged write, `cleared` means index is
+        cleared before them
+        """
+        sequence = self._next_sequence()
+        self._write_delta(sequence, cleared, entries)
+        self._delta_sequences.append(sequence)
+        if len(self._delta_sequences) > self._max_deltas:
+            self._merge_deltas()
+
+    def load(self, memory_manager):
+        """load snapshot and bind it to given memory manager"""
+        with open(self._filepath, "rb") as checkpoint_f:
+            pickle.load(checkpoint_f)
+            return CheckpointUnpickler(checkpoint_f, memory_manager).load()
+
+    def apply_deltas(self, index):
+        """replay deltas on top of snapshot, or on an empty index without it"""
+        for sequence in self._delta_sequences:
+            cleared, entries = self._read_delta(sequence)
+            if cleared:
+                for key in [key for key, _ in index.entries()]:
+                    index.restore(key, None)
+            for key, (operation, argument) in entries.items():
+                if operation == WAL_SET:
+                    index.restore(key, argument)
+                elif operation == WAL_SET_VALUE:
+                    index.set(key, argument)
+                else:
+                    index.restore(key, None)
+
+    def _merge_deltas(self):
+        merged_cleared, merged_entries = False, {}
+        for sequence in self._delta_sequences:
+            cleared, entries = self._read_delta(sequence)
+            if cleared:
+                merged_cleared, merged_entries = True, {}
+            merged_entries.update(entries)
+        # merged delta replaces the last one, so replaying older deltas left by a
+        # crash before they are removed gives the same index
+        last_sequence = self._delta_sequences[-1]
+        self._write_delta(last_sequence, merged_cleared, merged_entries)
+        for sequence in self._delta_sequences[:-1]:
+            os.remove(self._delta_filepath(sequence))
+        self._delta_sequences = [last_sequence]
+
+    def _next_sequence(self):
+        return max([self._base_sequence - 1] + self._delta_sequences) + 1
+
+    def _delta_filepath(self, sequence):
+        return "{}.delta.{}".format(self._filepath, sequence)
+
+    def _write_delta(self, sequence, cleared, entries):
+        with self._atomic_file(self._delta_filepath(sequence)) as delta_f:
+            pickle.dump((cleared, entries), delta_f)
+
+    def _read_delta(self, sequence):
+        with open(self._delta_filepath(sequence), "rb") as delta_f:
+            return pickle.load(delta_f)
+
+    @contextmanager
+    def _atomic_file(self, filepath):
+        """file is written to a temporary path, it replaces target once durable"""
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, "wb") as tmp_f:
+            yield tmp_f
+            tmp_f.flush()
+            os.fsync(tmp_f.fileno())
+        os.replace(tmp_filepath, filepath)
@@ -1,8 +1,13 @@
 from tree_index import TreeIndex
 from kv_index import KVIndex
 from memory_manager import MemoryManager
+from checkpoint import Checkpoint
+from mapped_index import MappedIndex
+from serializer import Serializer, REGISTERED_TAG_START, PICKLE_TAG
+from write_ahead_log import WriteAheadLog, WAL_SET, WAL_SET_VALUE, WAL_REMOVE
 
 import pickle
+import threading
 
 
 class Client(object):
@@ -13,14 +18,67 @@ class Client(object):
         conf_path=None,
         pool_folder=None,
         block_file=None,
+        durability=None,
+        wal_file=None,
+        checkpoint_file=None,
     ):
+        self._wal = None
+        # latest logged entry of every key changed since last checkpoint
+        self._dirty_entries, self._dirty_cleared = {}, False
+        # with a write ahead log, index is loaded from last checkpoint and logged
+        # writes after it are replayed
+        if wal_file:
+            memory_manager = MemoryManager(conf_path, pool_folder, block_file)
+            self._checkpoint = Checkpoint(
+                checkpoint_file or wal_file + ".checkpoint",
+                int(memory_manager.conf.get("CHECKPOINT", "MAX_DELTAS", fallback=8)),
+            )
+            # log size which starts a background checkpoint, 0 means never
+            self._wal_size_limit = int(
+                memory_manager.conf.get("CHECKPOINT", "WAL_SIZE_LIMIT", fallback=0)
+            )
+            self._index = (
+                self._checkpoint.load(memory_manager)
+                if self._checkpoint.exists()
+                else index_type(memory_manager)
+            )
+            self._checkpoint.apply_deltas(self._index)
+            self._wal = WriteAheadLog(wal_file)
+            self._replay()
+            # log is made durable together with storage, space of a replaced value
+            # is reused only once the record replacing it is durable
+            memory_manager.register_sync(self._wal.sync)
+            memory_manager.hold_releases()
         # If index_file is given
-        if index_file:
-            self._index = pickle.loads(open(index_file, "rb").read())
+        elif index_file:
+            self.load_index_from_file(index_file)
         else:
             # Create a new index
             self._index = index_type(MemoryManager(conf_path, pool_folder, block_file))
         assert isinstance(self._index, KVIndex)
+        # index mutations are serialized, commits wait outside of the lock, so
+        # concurrent writers could share one sync
+        self._write_lock = threading.Lock()
+        # checkpoints run one at a time, lock is taken before write lock
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_thread = None
+        # `none`, `periodic` or `group_commit`, default is taken from conf
+        if durability:
+            self._index.memory_manager.set_durability(durability)
+
+    @staticmethod
+    def register_serializer(tag, value_type, dumps, loads):
+        """
+        serialize values of `value_type` with given functions, see `Serializer`, tag
+        should be in [0x40, 0x80), lower tags belong to built-in serializers
+        """
+        if not REGISTERED_TAG_START <= tag < PICKLE_TAG:
+            raise ValueError(
+                "serializer tag should be in [{:#x}, {:#x}), got {:#x}".format(
+                    REGISTERED_TAG_START, PICKLE_TAG, tag
+                )
+            )
+        Serializer.register(tag, value_type, dumps, loads)
 
     @property
     def index(self):
@@ -28,8 +86,12 @@ class Client(object):
         return self._index
 
     def load_index_from_file(self, filepath):
-        with open(filepath, "rb") as f:
-            self._index = pickle.load(f, encoding="utf-8")
+        # mapped index file is queried in place instead of being unpickled
+        if MappedIndex.is_mapped_file(filepath):
+            self._index = MappedIndex(filepath)
+        else:
+            with open(filepath, "rb") as f:
+                self._index = pickle.load(f, encoding="utf-8")
         # in case we load some weird things...
         assert isinstance(self._index, KVIndex)
 
@@ -42,17 +104,47 @@ class Client(object):
         with open(filepath, "wb") as f:
             pickle.dump(self._index, f)
 
+    def dump_index_to_mapped_file(self, filepath):
+        """write index as sorted keys and value pointers, see `MappedIndex`"""
+        MappedIndex.dump(self._index, filepath)
+
     def dump_index_to_pickle_string(self):
         return pickle.dumps(self._index)
 
     def set(self, key, value):
-        self._index.set(key, value)
+        with self._write_lock:
+            value_pointer = self._index.set(key, value)
+            if self._wal is not None:
+                if value_pointer is None:
+                    self._wal.append_set_value(key, value)
+                    self._dirty_entries[key] = (WAL_SET_VALUE, value)
+                else:
+                    block_id, address = value_pointer.location
+                    # value is just appended, so block cursor is where it ends
+                    self._wal.append_set(
+                        key,
+                        block_id,
+                        address,
+                        self._index.memory_manager.block_dict[block_id].current_offset,
+                    )
+                    self._dirty_entries[key] = (WAL_SET, (block_id, address))
+                self._index.memory_manager.stage_releases()
+                self._checkpoint_if_needed()
+        self._index.memory_manager.commit()
 
     def get(self, key, default=None):
         return self._index.get(key, default)
 
     def remove(self, key):
-        return self._index.remove(key)
+        with self._write_lock:
+            removed = self._index.remove(key)
+            if self._wal is not None and removed:
+                self._wal.append_remove(key, self._index.marker_end)
+                self._dirty_entries[key] = (WAL_REMOVE, None)
+                self._index.memory_manager.stage_releases()
+                self._checkpoint_if_needed()
+        self._index.memory_manager.commit()
+        return removed
 
     def keys(self):
         return self._index.keys()
@@ -61,4 +153,128 @@ class Client(object):
         return self._index.key_value_pairs()
 
     def clear(self):
-        self._index.clear()
+        with self._write_lock:
+            self._index.clear()
+            if self._wal is not None:
+                self._wal.append_clear(self._index.marker_end)
+                self._dirty_entries, self._dirty_cleared = {}, True
+                self._index.memory_manager.stage_releases()
+        self._index.memory_manager.commit()
+
+    def checkpoint(self, background=False):
+        """
+        write entries changed since last checkpoint, then logged writes covered by
+        them are dropped, in background writers are blocked only while changed
+        entries are taken over
+        """
+        assert self._wal is not None, "client is not opened with a write ahead log"
+        if background:
+            with self._write_lock:
+                self._start_checkpoint()
+        else:
+            self._checkpoint_delta()
+
+    def wait_checkpoint(self):
+        """wait until background checkpoint finishes"""
+        checkpoint_thread = self._checkpoint_thread
+        if checkpoint_thread is not None:
+            checkpoint_thread.join()
+
+    def compact(self, bytes_per_second=None):
+        """
+        move live values into fresh pools, return (bytes copied, pools retired),
+        logged pointers are stale afterwards, so a full checkpoint is written
+        before old pools are retired, writers are blocked only while pools are
+        sealed and while copied values are swapped in
+        """
+        with self._checkpoint_lock:
+            return self._index.memory_manager.compact(
+                [self._index],
+                bytes_per_second,
+                self._checkpoint_index if self._wal is not None else None,
+                self._write_lock,
+            )
+
+    def rebuild_index(self, index_type=None, processes=None):
+        """
+        replace index by one rebuilt from keyed value records, in case index dump is
+        lost or stale, index type is kept by default
+        """
+        if index_type is None:
+            index_type = (
+                self._index.index_type
+                if isinstance(self._index, MappedIndex)
+                else type(self._index)
+            )
+        with self._checkpoint_lock, self._write_lock:
+            self._index = self._index.memory_manager.rebuild_index(
+                index_type, processes
+            )
+            if self._wal is not None:
+                self._checkpoint_index()
+
+    def close(self):
+        """make writes durable according to durability and release storage"""
+        self.wait_checkpoint()
+        self._index.memory_manager.close()
+        if self._wal is not None:
+            self._wal.close()
+
+    def _checkpoint_if_needed(self):
+        """caller holds write lock"""
+        if 0 < self._wal_size_limit <= self._wal.size:
+            self._start_checkpoint()
+
+    def _start_checkpoint(self):
+        """caller holds write lock"""
+        if self._checkpoint_thread is None or not self._checkpoint_thread.is_alive():
+            self._checkpoint_thread = threading.Thread(
+                target=self._checkpoint_delta, daemon=True
+            )
+            self._checkpoint_thread.start()
+
+    def _checkpoint_delta(self):
+        with self._checkpoint_lock:
+            with self._write_lock:
+                entries, cleared = self._dirty_entries, self._dirty_cleared
+                self._dirty_entries, self._dirty_cleared = {}, False
+                # logged writes after it are not covered by this checkpoint
+                wal_offset = self._wal.size
+            # values and block cursors referenced by delta should be durable first
+            self._index.memory_manager.sync()
+            if entries or cleared:
+                self._checkpoint.dump_delta(cleared, entries)
+            self._wal.discard(wal_offset)
+
+    def _checkpoint_index(self):
+        """write whole index, caller holds checkpoint lock and write lock"""
+        # values and block cursors referenced by checkpoint should be durable first
+        self._index.memory_manager.sync()
+        self._checkpoint.dump(self._index)
+        self._dirty_entries, self._dirty_cleared = {}, False
+        self._wal.truncate()
+
+    def _replay(self):
+        """apply logged writes on top of checkpoint"""
+        memory_manager = self._index.memory_manager
+        for operation, key, argument in self._wal.records():
+            if operation == WAL_SET:
+                block_id, address, end_offset = argument
+                memory_manager.advance_block(block_id, end_offset)
+                self._index.restore(key, (block_id, address))
+                self._dirty_entries[key] = (WAL_SET, (block_id, address))
+            elif operation == WAL_SET_VALUE:
+                self._index.set(key, argument)
+                self._dirty_entries[key] = (WAL_SET_VALUE, argument)
+            elif operation == WAL_REMOVE:
+                if argument is not None:
+                    memory_manager.advance_block(*argument)
+                self._index.restore(key, None)
+                self._dirty_entries[key] = (WAL_REMOVE, None)
+            else:
+                if argument is not None:
+                    memory_manager.advance_block(*argument)
+                # values are not read, space of a replaced one may be reused
+                for key in [key for key, _ in self._index.entries()]:
+                    self._index.restore(key, None)
+                self._dirty_entries, self._dirty_cleared = {}, True
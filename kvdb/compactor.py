@@ -0,0 +1,143 @@
+import time
+from contextlib import nullcontext
+
+
+class Compactor(object):
+    """
+    Store-wide online compaction
+
+    Pools are sealed first, so foreground writes keep going into fresh pools. Live
+    values reported by every index are copied into new blocks and their pointers
+    are swapped, then the sealed pools are retired, they are deleted by next
+    compaction, see `MemoryManager.retire_pools`. All indexes which keep values
+    in memory manager should be given, values of other indexes would be lost.
+
+    `before_retire` is called once values are moved while sealed pools are still
+    there, e.g. to persist new locations, so nothing durable points into deleted
+    pools if the process dies meanwhile.
+
+    `lock` serializes index changes, e.g. writers' lock of a client. It is held
+    while pools are sealed and while copied values are swapped in, together with
+    `before_retire`, but not while values are copied. Values written or removed
+    meanwhile are caught up before the swap.
+    """
+
+    def __init__(
+        self,
+        memory_manager,
+        indexes,
+        bytes_per_second=None,
+        before_retire=None,
+        lock=None,
+    ):
+        self._memory_manager = memory_manager
+        self._indexes = indexes
+        self._before_retire = before_retire
+        self._lock = lock if lock is not None else nullcontext()
+        # throughput cap of copying, 0 means unlimited
+        self._bytes_per_second = (
+            bytes_per_second
+            if bytes_per_second is not None
+            else int(
+                memory_manager.conf.get(
+                    "MEMORY_MANAGER", "COMPACT_BYTES_PER_SECOND", fallback=0
+                )
+            )
+        )
+
+    def run(self):
+        """return (bytes copied, pools retired)"""
+        with self._lock:
+            for index in self._indexes:
+                index.seal_blocks()
+            sealed_pool_ids = set(self._memory_manager.seal_pools())
+            sealed_values = [
+                self._sealed_values(index, sealed_pool_ids) for index in self._indexes
+            ]
+
+        # sealed pools are never written or reused, so values are copied while
+        # writers go on, value -> (old location, length, new block, new address)
+        copies = {}
+        self._start_time, self._throttled_bytes = time.monotonic(), 0
+        for values in sealed_values:
+            self._copy(values, copies, throttled=True)
+
+        with self._lock:
+            copied_bytes = 0
+            for index in self._indexes:
+                new_blocks, caught_up_values = [], []
+                for value, length, block, address in self._sealed_values(
+                    index, sealed_pool_ids
+                ):
+                    copy = copies.get(value)
+                    if copy is None or copy[0] != value.location:
+                        # written while values are copied
+                        caught_up_values.append((value, length, block, address))
+                        continue
+                    del copies[value]
+                    # readers see either old or new location, both are valid until
+                    # retired
+                    value.location = (copy[2].block_id, copy[3])
+                    copied_bytes += length
+                    if copy[2] not in new_blocks:
+                        new_blocks.append(copy[2])
+                caught_up_copies = {}
+                caught_up_block = self._copy(caught_up_values, caught_up_copies)
+                for value, (_, length, block, address) in caught_up_copies.items():
+                    value.location = (block.block_id, address)
+                    copied_bytes += length
+                if caught_up_block is not None:
+                    new_blocks.append(caught_up_block)
+                index.adopt_blocks(new_blocks)
+            # copies of values overwritten, removed or moved while copying are
+            # dropped
+            for _, length, block, address in copies.values():
+                self._memory_manager.release(block.block_id, address, length)
+            if self._before_retire is not None:
+                self._before_retire()
+        self._memory_manager.retire_pools(sealed_pool_ids)
+        return copied_bytes, len(sealed_pool_ids)
+
+    def _sealed_values(self, index, pool_ids):
+        """(value, length, block, address) of live values of index in given pools"""
+        sealed_values, seen = [], set()
+        for value, length in index.live_values():
+            block_id, address = value.location
+            block = self._memory_manager.block_dict[block_id]
+            # versions of an index may share values
+            if id(value) in seen or not any(
+                segment.pool.pool_id in pool_ids for segment in block.memory_segments
+            ):
+                continue
+            seen.add(id(value))
+            sealed_values.append((value, length, block, address))
+        return sealed_values
+
+    def _copy(self, values, copies, throttled=False):
+        """copy values into a new block, add them to `copies`, return the block"""
+        if not values:
+            return None
+        new_block = self._memory_manager.allocate_block(
+            sum(length for _, length, _, _ in values)
+        )
+        for value, length, block, address in values:
+            copies[value] = (
+                (block.block_id, address),
+                length,
+                new_block,
+                new_block.current_offset,
+            )
+            new_block.write(block.read(address, length))
+            if throttled:
+                self._throttled_bytes += length
+                self._throttle(self._throttled_bytes, self._start_time)
+        self._memory_manager.sync_block(new_block)
+        return new_block
+
+    def _throttle(self, copied_bytes, start_time):
+        if self._bytes_per_second <= 0:
+            return
+        expected_time = copied_bytes / self._bytes_per_second
+        elapsed_time = time.monotonic() - start_time
+        if expected_time > elapsed_time:
+            time.sleep(expected_time - elapsed_time)
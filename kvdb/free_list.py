@@ -0,0 +1,138 @@
+import bisect
+
+
+class FreeList(object):
+    """
+    Free extents of pools, extents are coalesced with their neighbours and indexed
+    by power-of-two size classes for allocation
+
+    size class n holds extents whose length is in range [2 ** (n - 1), 2 ** n)
+    """
+
+    def __init__(self):
+        # pool id -> sorted start offsets of free extents
+        self._starts = {}
+        # (pool id, start offset) -> end offset
+        self._extents = {}
+        # size class -> set of (pool id, start offset)
+        self._size_classes = {}
+        self._free_bytes = 0
+
+    @property
+    def free_bytes(self):
+        return self._free_bytes
+
+    def extents(self):
+        """return all free extents as (pool id, start offset, end offset)"""
+        return [
+            (pool_id, start, self._extents[(pool_id, start)])
+            for pool_id in sorted(self._starts)
+            for start in self._starts[pool_id]
+        ]
+
+    def add(self, pool_id, start, end):
+        """mark range as free, merge it with adjacent free extents"""
+        assert start < end, "free extent should not be empty"
+        starts = self._starts.setdefault(pool_id, [])
+        index = bisect.bisect_left(starts, start)
+        # previous extent
+        if index > 0:
+            prev_start = starts[index - 1]
+            prev_end = self._extents[(pool_id, prev_start)]
+            assert prev_end <= start, "range {} -> {} in pool {} is freed twice".format(
+                start, end, pool_id
+            )
+            if prev_end == start:
+                self._remove_extent(pool_id, prev_start)
+                start = prev_start
+                index -= 1
+        # next extent
+        if index < len(starts):
+            next_start = starts[index]
+            assert end <= next_start, "range {} -> {} in pool {} is freed twice".format(
+                start, end, pool_id
+            )
+            if end == next_start:
+                end = self._extents[(pool_id, next_start)]
+                self._remove_extent(pool_id, next_start)
+        self._add_extent(pool_id, start, end)
+
+    def take(self, size):
+        """
+        take `size` bytes from the smallest size class which could hold it,
+        return (pool id, start offset, end offset) or None
+        """
+        assert size > 0, "memory allocated should be greater than zero"
+        if size > self._free_bytes:
+            return None
+        size_class = size.bit_length()
+        # extents in the same size class may be smaller than size, use best fit
+        best = None
+        for pool_id, start in self._size_classes.get(size_class, ()):
+            length = self._extents[(pool_id, start)] - start
+            if length >= size and (best is None or length < best[2]):
+                best = (pool_id, start, length)
+        # any extent in a larger size class is big enough
+        if best is None:
+            larger_classes = [
+                candidate_class
+                for candidate_class in self._size_classes
+                if candidate_class > size_class
+            ]
+            if not larger_classes:
+                return None
+            pool_id, start = next(iter(self._size_classes[min(larger_classes)]))
+            best = (pool_id, start, self._extents[(pool_id, start)] - start)
+        pool_id, start, _ = best
+        self.remove(pool_id, start, start + size)
+        return pool_id, start, start + size
+
+    def remove(self, pool_id, start, end):
+        """remove range, which should be inside one free extent, from free list"""
+        starts = self._starts.get(pool_id, [])
+        index = bisect.bisect_right(starts, start) - 1
+        assert index >= 0, "range {} -> {} in pool {} is not free".format(
+            start, end, pool_id
+        )
+        extent_start = starts[index]
+        extent_end = self._extents[(pool_id, extent_start)]
+        assert end <= extent_end, "range {} -> {} in pool {} is not free".format(
+            start, end, pool_id
+        )
+        self._remove_extent(pool_id, extent_start)
+        if extent_start < start:
+            self._add_extent(pool_id, extent_start, start)
+        if end < extent_end:
+            self._add_extent(pool_id, end, extent_end)
+
+    def remove_pool(self, pool_id):
+        """drop all free extents of pool"""
+        for start in list(self._starts.get(pool_id, [])):
+            self._remove_extent(pool_id, start)
+        self._starts.pop(pool_id, None)
+
+    def _add_extent(self, pool_id, start, end):
+        bisect.insort(self._starts.setdefault(pool_id, []), start)
+        self._extents[(pool_id, start)] = end
+        self._size_classes.setdefault((end - start).bit_length(), set()).add(
+            (pool_id, start)
+        )
+        self._free_bytes += end - start
+
+    def _remove_extent(self, pool_id, start):
+        end = self._extents.pop((pool_id, start))
+        starts = self._starts[pool_id]
+        starts.pop(bisect.bisect_left(starts, start))
+        size_class = (end - start).bit_length()
+        self._size_classes[size_class].discard((pool_id, start))
+        if not self._size_classes[size_class]:
+            del self._size_classes[size_class]
+        self._free_bytes -= end - start
+
+    def __str__(self):
+        return "free extents: {}, free bytes: {}".format(
+            len(self._extents), self._free_bytes
+        )
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,128 @@
+import concurrent.futures
+import os
+from collections import deque
+
+from value_record import (
+    KEYED_RECORD_HEADER,
+    ValueRecord,
+    RECORD_TOMBSTONE,
+    RECORD_CLEAR,
+)
+
+
+class IndexRebuilder(object):
+    """
+    Rebuild an index from keyed value records
+
+    Blocks are scanned by a pool of processes which read pool files directly, so
+    scanning scales with cores. Latest record of every key wins, tombstones and
+    clear records remove keys, values are not read. Only keyed records are found,
+    and all blocks are assumed to belong to the rebuilt index.
+
+    Write cursor of a block is persisted only on flush, so after a crash records
+    could lie past it. Whole blocks are scanned, bytes which are not a record are
+    skipped by magic and crc, and cursors are moved past last record found.
+    """
+
+    def __init__(self, memory_manager, processes=None):
+        self._memory_manager = memory_manager
+        # 0 means one process per core
+        self._processes = (
+            processes
+            if processes is not None
+            else int(
+                memory_manager.conf.get(
+                    "MEMORY_MANAGER", "REBUILD_PROCESSES", fallback=0
+                )
+            )
+        ) or os.cpu_count()
+
+    def run(self, index_type):
+        tasks = [
+            (block_id, self._block_extents(block))
+            for block_id, block in sorted(self._memory_manager.block_dict.items())
+        ]
+        if self._processes > 1 and len(tasks) > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                min(self._processes, len(tasks))
+            ) as executor:
+                latest, cleared_sequence, written_ends = self._merge(
+                    executor.map(
+                        IndexRebuilder._scan_block,
+                        tasks,
+                        chunksize=len(tasks) // (self._processes * 4) + 1,
+                    )
+                )
+        else:
+            latest, cleared_sequence, written_ends = self._merge(
+                map(IndexRebuilder._scan_block, tasks)
+            )
+
+        for block_id, written_end in written_ends.items():
+            self._memory_manager.advance_block(block_id, written_end)
+        keys = sorted(
+            key
+            for key, (sequence, _, _, flags) in latest.items()
+            if sequence > cleared_sequence and not flags & RECORD_TOMBSTONE
+        )
+        index = index_type(self._memory_manager)
+        # middle keys go first, sorted inserts would build unbalanced trees
+        ranges = deque([(0, len(keys))])
+        while ranges:
+            low, high = ranges.popleft()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            _, block_id, address, _ = latest[keys[middle]]
+            index.restore(keys[middle], (block_id, address))
+            ranges.append((low, middle))
+            ranges.append((middle + 1, high))
+        return index
+
+    def _block_extents(self, block):
+        """(file path, file offset, length) of whole block"""
+        return [
+            (pool.data_filepath, pool.base_offset + start, end - start)
+            for pool, start, end in block.extents(0, block.block_size)
+        ]
+
+    def _merge(self, results):
+        """
+        return key -> (sequence, block id, address, flags), last clear sequence and
+        block id -> end offset of its last record
+        """
+        latest, cleared_sequence, written_ends = {}, 0, {}
+        for block_id, records, written_end in results:
+            written_ends[block_id] = written_end
+            for address, flags, sequence, key in records:
+                if flags & RECORD_CLEAR:
+                    cleared_sequence = max(cleared_sequence, sequence)
+                    continue
+                # when released space is reused, a block could still see records
+                # of the newer block which owns the space now
+                current = latest.get(key)
+                if current is None or (sequence, block_id) > current[:2]:
+                    latest[key] = (sequence, block_id, address, flags)
+        return latest, cleared_sequence, written_ends
+
+    @staticmethod
+    def _scan_block(task):
+        """
+        run in worker processes, return (block id, records of block, end offset of
+        last record)
+        """
+        block_id, extents = task
+        data = bytearray()
+        for filepath, offset, length in extents:
+            with open(filepath, "rb") as pool_f:
+                pool_f.seek(offset)
+                data += pool_f.read(length)
+        data = bytes(data)
+        records, written_end = list(ValueRecord.scan(data)), 0
+        if records:
+            address = records[-1][0]
+            _, _, _, key_length, value_length, _ = KEYED_RECORD_HEADER.unpack_from(
+                data, address
+            )
+            written_end = address + KEYED_RECORD_HEADER.size + key_length + value_length
+        return block_id, records, written_end
@@ -1,6 +1,30 @@
 class KVIndex(object):
+    # (block id, end offset) of last tombstone or clear record written
+    _marker_end = None
+
+    @property
+    def memory_manager(self):
+        """memory manager which keeps persisted values"""
+        return self._memory_manager
+
+    @property
+    def marker_end(self):
+        """
+        (block id, end offset) of record written by last `remove` or `clear`, None
+        if index writes no such records
+        """
+        return self._marker_end
+
+    def _write_marker(self, parts):
+        """write tombstone or clear record, see `marker_end`"""
+        block_id, address = self._write_record(parts)
+        self._marker_end = (block_id, address + self._value_record.length(parts))
+
     def set(self, key, value):
-        """add key-value pair to index"""
+        """
+        add key-value pair to index, return pointer of persisted value, or None
+        if value is kept in memory
+        """
         pass
 
     def get(self, key, default=None):
@@ -22,3 +46,65 @@ class KVIndex(object):
     def clear(self):
         """clear index"""
         pass
+
+    def restore(self, key, location):
+        """
+        replay a logged write without writing or releasing any value, `location`
+        is (block id, address) of persisted value, None means key is removed
+        """
+        pass
+
+    def entries(self):
+        """
+        return (key, value pointer) pairs in key order, value itself is returned if
+        it is kept in memory
+        """
+        return []
+
+    def load_value(self, location):
+        """read persisted value at `location`, which is (block id, address)"""
+        pass
+
+    def live_values(self):
+        """return (value pointer, record length) of all reachable persisted values"""
+        return []
+
+    def seal_blocks(self):
+        """stop appending to current blocks, new values go to newly allocated blocks"""
+        pass
+
+    def adopt_blocks(self, blocks):
+        """take ownership of blocks which compaction moved live values into"""
+        pass
+
+
+class ValuePointer(object):
+    """
+    Location of a persisted value. Block id and address are kept in one tuple, so
+    relocation swaps both at once and readers never see a half moved pointer
+    """
+
+    def __init__(self, block_id, address):
+        self.location = (block_id, address)
+
+    @property
+    def block_id(self):
+        return self.location[0]
+
+    @block_id.setter
+    def block_id(self, block_id):
+        self.location = (block_id, self.location[1])
+
+    @property
+    def address(self):
+        return self.location[1]
+
+    @address.setter
+    def address(self, address):
+        self.location = (self.location[0], address)
+
+    def __setstate__(self, state):
+        # pointers pickled before relocation support keep two attributes
+        if "location" not in state:
+            state["location"] = (state.pop("block_id"), state.pop("address"))
+        self.__dict__.update(state)
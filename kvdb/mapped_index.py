@@ -0,0 +1,232 @@
+import copyreg
+import io
+import mmap
+import os
+import pickle
+import struct
+from collections import deque
+
+from kv_index import KVIndex, ValuePointer
+
+MAPPED_INDEX_MAGIC = b"KVIDX001"
+# header: magic, entry count, offset of pickled index type and memory manager
+MAPPED_INDEX_HEADER = struct.Struct("<8sQQ")
+# entry: key offset, key length, value kind, then (block id, address) of a
+# persisted value or (offset, length) of a value kept in index file
+MAPPED_INDEX_ENTRY = struct.Struct("<QIBQQ")
+POINTER_VALUE = 0
+INLINE_VALUE = 1
+
+
+class MappedIndex(KVIndex):
+    """
+    Index file queried in place
+
+    Keys are pickled one by one in key order and every key has a fixed size entry,
+    so a lookup is a binary search over mmap which unpickles probed keys only, and
+    opening index reads header and metadata only. Index of the dumped type is
+    built on first mutation, all operations are delegated to it afterwards.
+    """
+
+    def __init__(self, filepath, memory_manager=None):
+        self._filepath = filepath
+        self._index = None
+        with open(filepath, "rb") as index_f:
+            self._mmap_object = mmap.mmap(index_f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, metadata_offset = MAPPED_INDEX_HEADER.unpack_from(
+            self._mmap_object
+        )
+        assert magic == MAPPED_INDEX_MAGIC, "{} is not a mapped index".format(filepath)
+        metadata_f = io.BytesIO(self._mmap_object[metadata_offset:])
+        self._index_type = pickle.load(metadata_f)
+        # dumped memory manager is loaded only if none is given
+        self._memory_manager = memory_manager or pickle.load(metadata_f)
+        # empty index of dumped type reads values, it is filled on first mutation
+        self._reader = self._index_type(self._memory_manager)
+
+    @staticmethod
+    def dump(index, filepath):
+        """write index into a file which could be opened by `MappedIndex`"""
+        index_type = index.index_type if isinstance(index, MappedIndex) else type(index)
+        entries = [(pickle.dumps(key), value) for key, value in index.entries()]
+        data_offset = MAPPED_INDEX_HEADER.size + MAPPED_INDEX_ENTRY.size * len(entries)
+        table, data = bytearray(), bytearray()
+        for key_string, value in entries:
+            key_offset = data_offset + len(data)
+            data += key_string
+            if isinstance(value, ValuePointer):
+                table += MAPPED_INDEX_ENTRY.pack(
+                    key_offset, len(key_string), POINTER_VALUE, *value.location
+                )
+            else:
+                value_string = pickle.dumps(value)
+                table += MAPPED_INDEX_ENTRY.pack(
+                    key_offset,
+                    len(key_string),
+                    INLINE_VALUE,
+                    data_offset + len(data),
+                    len(value_string),
+                )
+                data += value_string
+
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, "wb") as index_f:
+            index_f.write(
+                MAPPED_INDEX_HEADER.pack(
+                    MAPPED_INDEX_MAGIC, len(entries), data_offset + len(data)
+                )
+            )
+            index_f.write(table)
+            index_f.write(data)
+            pickle.dump(index_type, index_f)
+            pickle.dump(index.memory_manager, index_f)
+            index_f.flush()
+            os.fsync(index_f.fileno())
+        os.replace(tmp_filepath, filepath)
+
+    @staticmethod
+    def is_mapped_file(filepath):
+        with open(filepath, "rb") as index_f:
+            return index_f.read(len(MAPPED_INDEX_MAGIC)) == MAPPED_INDEX_MAGIC
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def index_type(self):
+        return self._index_type
+
+    @property
+    def materialized(self):
+        return self._index is not None
+
+    @property
+    def marker_end(self):
+        return self._index.marker_end if self._index is not None else None
+
+    def set(self, key, value):
+        return self._materialize().set(key, value)
+
+    def get(self, key, default=None):
+        if self._index is not None:
+            return self._index.get(key, default)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            middle_key = self._key(entry)
+            if middle_key == key:
+                return self._value(entry)
+            if middle_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return default
+
+    def remove(self, key):
+        return self._materialize().remove(key)
+
+    def keys(self):
+        if self._index is not None:
+            return self._index.keys()
+        return (self._key(self._entry(position)) for position in range(self._count))
+
+    def key_value_pairs(self):
+        if self._index is not None:
+            return self._index.key_value_pairs()
+        return (
+            (self._key(entry), self._value(entry))
+            for entry in map(self._entry, range(self._count))
+        )
+
+    def clear(self):
+        self._materialize().clear()
+
+    def restore(self, key, location):
+        self._materialize().restore(key, location)
+
+    def entries(self):
+        if self._index is not None:
+            return self._index.entries()
+        return (
+            (
+                self._key(entry),
+                (
+                    ValuePointer(entry[3], entry[4])
+                    if entry[2] == POINTER_VALUE
+                    else self._value(entry)
+                ),
+            )
+            for entry in map(self._entry, range(self._count))
+        )
+
+    def load_value(self, location):
+        return self._reader.load_value(location)
+
+    def live_values(self):
+        # compaction swaps value pointers, so they should be objects of an index
+        return self._materialize().live_values()
+
+    def seal_blocks(self):
+        self._materialize().seal_blocks()
+
+    def adopt_blocks(self, blocks):
+        self._materialize().adopt_blocks(blocks)
+
+    def _entry(self, position):
+        return MAPPED_INDEX_ENTRY.unpack_from(
+            self._mmap_object,
+            MAPPED_INDEX_HEADER.size + position * MAPPED_INDEX_ENTRY.size,
+        )
+
+    def _key(self, entry):
+        key_offset, key_length = entry[0], entry[1]
+        return pickle.loads(self._mmap_object[key_offset : key_offset + key_length])
+
+    def _value(self, entry):
+        _, _, kind, first, second = entry
+        if kind == POINTER_VALUE:
+            return self._reader.load_value((first, second))
+        return pickle.loads(self._mmap_object[first : first + second])
+
+    def _materialize(self):
+        if self._index is None:
+            # middle keys go first, sorted inserts would build unbalanced trees
+            ranges = deque([(0, self._count)])
+            while ranges:
+                low, high = ranges.popleft()
+                if low >= high:
+                    continue
+                middle = (low + high) // 2
+                entry = self._entry(middle)
+                if entry[2] == POINTER_VALUE:
+                    self._reader.restore(self._key(entry), (entry[3], entry[4]))
+                else:
+                    self._reader.set(self._key(entry), self._value(entry))
+                ranges.append((low, middle))
+                ranges.append((middle + 1, high))
+            self._index = self._reader
+        return self._index
+
+    def __getattr__(self, name):
+        # index specific operations, like `persist` of TreeIndex, need the index
+        if name.startswith("__") or "_reader" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self._materialize(), name)
+
+    def __reduce_ex__(self, protocol):
+        # mmap could not be pickled, index of dumped type is pickled instead, pickle
+        # rejects `__newobj__` of another class, so index is created by `__new__`
+        reduced = self._materialize().__reduce_ex__(protocol)
+        if reduced[0] is copyreg.__newobj__:
+            reduced = (self._index_type.__new__,) + reduced[1:]
+        return reduced
+
+    def __str__(self):
+        return "filepath is: {}, keys: {}, materialized: {}".format(
+            self._filepath, self._count, self.materialized
+        )
+
+    def __repr__(self):
+        return self.__str__()
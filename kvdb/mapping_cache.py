@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+
+class MappingCache(object):
+    """
+    LRU of mapped pools, when more than `limit` pools are mapped, least recently
+    used pools are unmapped, and they are mapped again on next access
+
+    `touch` is called on every pool access, a hit only moves pool to the end
+    without locking.
+    """
+
+    def __init__(self, limit):
+        assert limit > 0, "at least one pool should be mapped"
+        self._limit = limit
+        # pool id -> pool, least recently used first
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._unmapped_count = 0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def unmapped_count(self):
+        return self._unmapped_count
+
+    def mapped_pool_ids(self):
+        return list(self._pools)
+
+    def touch(self, pool):
+        try:
+            self._pools.move_to_end(pool.pool_id)
+            return
+        except KeyError:
+            pass
+        with self._lock:
+            self._pools[pool.pool_id] = pool
+            cold_pools = []
+            while len(self._pools) > self._limit:
+                cold_pools.append(self._pools.popitem(last=False)[1])
+        # unmap outside of cache lock, it takes lock of each pool
+        for cold_pool in cold_pools:
+            if cold_pool.unmap():
+                self._unmapped_count += 1
+
+    def discard(self, pool):
+        with self._lock:
+            self._pools.pop(pool.pool_id, None)
+
+    def __str__(self):
+        return "mapped pools: {}, limit: {}, unmapped: {}".format(
+            len(self._pools), self._limit, self._unmapped_count
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __getstate__(self):
+        # pools are mapped again after unpickle
+        return {"_limit": self._limit}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._unmapped_count = 0
@@ -3,7 +3,11 @@ class MemoryBlock(object):
     Append only memory block
     """
 
-    def __init__(self, block_id, block_size, memory_segments):
+    # set of manager which collects blocks whose write pointer moved, see
+    # `track_dirty`, blocks pickled by older versions have none
+    __dirty_blocks = None
+
+    def __init__(self, block_id, block_size, memory_segments, current_offset=0):
         self.__block_id = block_id
         self.__memory_segments = memory_segments
         # segment we are working on
@@ -21,6 +25,9 @@ class MemoryBlock(object):
                     -1
                 ] += self.__segment_length_prefix_sum[-2]
         self.__block_size = block_size
+        # restore write pointer, a full block points to the end of its last segment
+        if current_offset > 0:
+            self.rewind(current_offset)
 
     @property
     def block_id(self):
@@ -70,10 +77,11 @@ class MemoryBlock(object):
         all result will be appended to the tail
         """
 
-        # accept byte data only
+        # accept byte data only, bytes-like data is sliced by a view without copy
         if isinstance(byte_data, str):
             byte_data = byte_data.encode("utf-8")
-        assert isinstance(byte_data, bytes)
+        if not isinstance(byte_data, bytes):
+            byte_data = memoryview(byte_data).cast("B")
 
         write_offset, total_length = 0, len(byte_data)
         assert (
@@ -115,10 +123,72 @@ class MemoryBlock(object):
                 else:
                     self.__current_segment_offset = 0
 
+        if self.__dirty_blocks is not None:
+            self.__dirty_blocks.add(self)
         return write_offset
 
     def read(self, offset, length):
+        with self.read_view(offset, length) as view:
+            return bytes(view)
+
+    def read_view(self, offset, length):
+        """
+        return a memoryview of block data, it is a zero-copy slice of pool's mmap
+        if data is in one segment, otherwise data is gathered into a new buffer
+        """
         assert offset >= 0 and length >= 0, "offset and length should be positive"
+        length = min(length, self.__block_size - offset)
+        if length <= 0:
+            return memoryview(b"")
+        index, segment_offset = self.__locate(offset)
+        segment = self.__memory_segments[index]
+        if segment_offset + length <= segment.end_offset:
+            return segment.pool.read_view(segment_offset, length, skip_header=False)
+        buffer = bytearray(length)
+        self.read_into(buffer, offset)
+        return memoryview(buffer)
+
+    def read_into(self, buffer, offset):
+        """fill writable buffer with block data starting at offset, return bytes read"""
+        assert offset >= 0, "offset should be positive"
+        length = min(len(buffer), self.__block_size - offset)
+        index, segment_offset = self.__locate(offset)
+        read_bytes = 0
+        with memoryview(buffer) as target:
+            while index < len(self.__memory_segments) and read_bytes < length:
+                segment = self.__memory_segments[index]
+                size = min(length - read_bytes, segment.end_offset - segment_offset)
+                with segment.pool.read_view(
+                    segment_offset, size, skip_header=False
+                ) as view:
+                    target[read_bytes : read_bytes + len(view)] = view
+                    read_bytes += len(view)
+                index += 1
+                # read from segment start besides first segment
+                if index < len(self.__memory_segments):
+                    segment_offset = self.__memory_segments[index].start_offset
+        return read_bytes
+
+    def extents(self, offset, length):
+        """block range -> list of (pool, start offset, end offset) in pools"""
+        assert offset >= 0 and offset + length <= self.__block_size
+        extents = []
+        if length <= 0:
+            return extents
+        index, segment_offset = self.__locate(offset)
+        while length > 0:
+            segment = self.__memory_segments[index]
+            size = min(length, segment.end_offset - segment_offset)
+            if size > 0:
+                extents.append((segment.pool, segment_offset, segment_offset + size))
+            length -= size
+            index += 1
+            if index < len(self.__memory_segments):
+                segment_offset = self.__memory_segments[index].start_offset
+        return extents
+
+    def __locate(self, offset):
+        """block offset -> (segment index, absolute offset in segment's pool)"""
         # binary search the starting segment
         low, high = 0, len(self.__segment_length_prefix_sum)
         while low < high:
@@ -127,28 +197,26 @@ class MemoryBlock(object):
                 low = mid + 1
             else:
                 high = mid
-        # delegate read operations to underlying pools
+        # offset is at the end of block
+        if low == len(self.__memory_segments):
+            return low - 1, self.__memory_segments[-1].end_offset
         offset -= self.__segment_length_prefix_sum[low - 1] if low - 1 >= 0 else 0
-        offset += self.__memory_segments[low].start_offset
-        # turn absolute offset into headless offset
-        offset -= self.__memory_segments[low].pool.pool_allocate_offset_header
-        read_data = bytearray()
-        while low < len(self.__memory_segments) and length > 0:
-            data = self.__memory_segments[low].pool.read(offset, length)
-            read_data.extend(data)
-            low += 1
-            # offset will always be zero besides first pool
-            offset = 0
-            length -= len(data)
-        return bytes(read_data)
+        return low, self.__memory_segments[low].start_offset + offset
 
     def rewind(self, offset):
         """
-        rewind write pointer to offset position
+        rewind write pointer to offset position, offset of block size marks block
+        as full
         """
         assert (
-            offset >= 0 and offset < self.__block_size
-        ), "offset should be in range(%d -> %d)".format(0, self.__block_size - 1)
+            offset >= 0 and offset <= self.__block_size
+        ), "offset should be in range({} -> {})".format(0, self.__block_size)
+        if self.__dirty_blocks is not None:
+            self.__dirty_blocks.add(self)
+        if offset == self.__block_size:
+            self.__current_segment_index = len(self.__memory_segments) - 1
+            self.__current_segment_offset = self.__memory_segments[-1].end_offset
+            return
         low, high = 0, len(self.__memory_segments)
         while low < high:
             mid = low + (high - low) // 2
@@ -162,6 +230,16 @@ class MemoryBlock(object):
             self.__memory_segments[self.__current_segment_index].start_offset + offset
         )
 
+    def track_dirty(self, dirty_blocks):
+        """block adds itself to `dirty_blocks` whenever its write pointer moves"""
+        self.__dirty_blocks = dirty_blocks
+
+    def __getstate__(self):
+        current_state = self.__dict__.copy()
+        # manager's dirty set is wired again once manager is loaded
+        current_state.pop("_MemoryBlock__dirty_blocks", None)
+        return current_state
+
     def __str__(self):
         return "block id is: {}, used memory is: {}, free memory is: {}, block size is: {}".format(
             self.__block_id, self.used_memory, self.free_memory, self.__block_size
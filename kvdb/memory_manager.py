@@ -1,28 +1,104 @@
+import bisect
 import os
 import re
 import configparser
 import pickle
+import struct
+import threading
+import time
 
 
 from memory_pool import MemoryPool
+from pool_container import PoolContainer
 from memory_block import MemoryBlock
+from memory_segment import MemorySegment
+from free_list import FreeList
+from mapping_cache import MappingCache
+from compactor import Compactor
+from index_rebuilder import IndexRebuilder
+from value_cache import ValueCache
+
+# block table starts with a magic, legacy block files are pickled blocks
+BLOCK_TABLE_MAGIC = b"KVBLKTB1"
+# block record: block id, block size, write cursor, segment count
+BLOCK_RECORD = struct.Struct("<QQQI")
+# segment record follows its block record: pool id, start offset, end offset
+SEGMENT_RECORD = struct.Struct("<QQQ")
+# write cursor position inside a block record
+BLOCK_RECORD_CURSOR = struct.Struct("<Q")
+BLOCK_RECORD_CURSOR_OFFSET = 16
+# free map record: operation, pool id, start offset, end offset
+FREE_MAP_RECORD = struct.Struct("<BQQQ")
+FREE_MAP_ADD = 1
+FREE_MAP_TAKE = 2
+# block table and free map are rewritten with live records only once they are
+# twice as big as after last rewrite, and at least this big
+METADATA_COMPACT_SIZE = 16384
+DURABILITY_MODES = ("none", "periodic", "group_commit")
 
 
 class MemoryManager(object):
     """
-    manage all memory storage
+    manage all memory storage, allocation and block table updates are serialized
+    by manager lock
+
+    `pool_folder` could be a list of folders, or folders separated by comma, new
+    pools are striped across them by pool id, weighted by `POOL_FOLDER_WEIGHTS`.
+    Manager's own files are kept in the first folder.
+
+    With a `cold_pool_folder`, pool folders above are the hot tier, pools which
+    are not accessed for `COLD_POOL_AFTER_SECONDS` are moved to the cold tier.
+
+    Durability is one of `none` (left to kernel), `periodic` (`sync` every
+    `FLUSH_INTERVAL` seconds in background) or `group_commit` (`commit` returns
+    once writes before it are durable, concurrent commits share one `sync`).
     """
 
-    def __init__(self, conf_path=None, pool_folder=None, block_file=None):
+    def __init__(
+        self,
+        conf_path=None,
+        pool_folder=None,
+        block_file=None,
+        cold_pool_folder=None,
+        durability=None,
+    ):
         self._conf = configparser.ConfigParser()
         conf_path = conf_path or os.path.join(
             os.path.dirname(__file__), "conf", "storage_conf.ini"
         )
         self._conf.read(conf_path)
-        self._pool_folder = pool_folder or os.path.abspath(
-            os.path.join(
-                os.path.dirname(__file__), self._conf["MEMORY_MANAGER"]["POOL_FOLDER"]
-            )
+        self._configure(pool_folder, block_file, cold_pool_folder, durability)
+        self._lock = threading.RLock()
+        # spare pools are provisioned once a pool is allocated
+        self._provision_thread = None
+        # initialize memory manager
+        self._bootstrap()
+        if self._cold_pool_folder and self._cold_pool_check_interval > 0:
+            self._start_tier_migrator()
+        self._start_committer()
+
+    def _configure(self, pool_folder, block_file, cold_pool_folder, durability):
+        """read settings from conf, given arguments take precedence"""
+        if pool_folder:
+            if isinstance(pool_folder, str):
+                pool_folder = pool_folder.split(",")
+            self._pool_folders = [
+                os.path.abspath(folder.strip()) for folder in pool_folder
+            ]
+        else:
+            # folders in conf are relative to package
+            self._pool_folders = [
+                os.path.abspath(os.path.join(os.path.dirname(__file__), folder.strip()))
+                for folder in self._conf["MEMORY_MANAGER"]["POOL_FOLDER"].split(",")
+            ]
+        self._pool_folder = self._pool_folders[0]
+        # one slot per weight unit, slots of a folder are spread over the cycle
+        weights = self._conf.get(
+            "MEMORY_MANAGER", "POOL_FOLDER_WEIGHTS", fallback=""
+        ).split(",")
+        self._pool_folder_cycle = self._weighted_cycle(
+            self._pool_folders,
+            [int(weight) for weight in weights] if weights != [""] else [],
         )
         self._block_file = block_file or os.path.abspath(
             os.path.join(
@@ -33,8 +109,86 @@ class MemoryManager(object):
             int(self._conf.get("MEMORY_MANAGER", "BLOCK_HEADER_LENGTH", fallback=0))
             or 10
         )
-        # initialize memory manager
-        self._bootstrap()
+        # `folder` keeps one file per pool, `container` keeps all pools as extents
+        # of a single data file
+        self._pool_layout = self._conf.get(
+            "MEMORY_MANAGER", "POOL_LAYOUT", fallback="folder"
+        )
+        # provision next pool file in background, so a new pool is ready before
+        # current pool is full, container grows by itself
+        self._pool_provision_ahead = self._pool_layout == "folder" and (
+            self._conf.getboolean(
+                "MEMORY_MANAGER", "POOL_PROVISION_AHEAD", fallback=False
+            )
+        )
+        # `spill` fills pool tails and spans blocks across pools, `contiguous` keeps
+        # a block inside one pool and gives oversized blocks a dedicated pool
+        self._block_placement = self._conf.get(
+            "MEMORY_MANAGER", "BLOCK_PLACEMENT", fallback="spill"
+        )
+        self._pool_header_length = int(
+            self._conf["MEMORY_POOL"]["POOL_ALLOCATE_OFFSET_HEADER"]
+        )
+        # pool files grow up to max size, so it bounds what one pool could hold
+        self._pool_capacity = (
+            max(
+                (
+                    int(self._conf.get("MEMORY_POOL", "POOL_MAX_SIZE", fallback=0))
+                    if self._pool_layout == "folder"
+                    else 0
+                ),
+                int(self._conf["MEMORY_POOL"]["POOL_SIZE"]),
+            )
+            - self._pool_header_length
+        )
+        # at most this many pool files are mapped at once, 0 means unlimited,
+        # pools of a container share one mapping
+        max_mapped_pools = int(
+            self._conf.get("MEMORY_MANAGER", "MAX_MAPPED_POOLS", fallback=0)
+        )
+        self._mapping_cache = (
+            MappingCache(max_mapped_pools)
+            if max_mapped_pools and self._pool_layout == "folder"
+            else None
+        )
+        # decoded values cached by all indexes, in bytes of serialized values, 0
+        # means no cache, a hit returns the same object, so it is opt in for
+        # callers which do not mutate loaded values
+        value_cache_size = int(
+            self._conf.get("MEMORY_MANAGER", "VALUE_CACHE_SIZE", fallback=0)
+        )
+        self._value_cache = ValueCache(value_cache_size) if value_cache_size else None
+        # cold tier folder, new pools are always created in hot tier
+        if cold_pool_folder:
+            cold_pool_folder = os.path.abspath(cold_pool_folder)
+        else:
+            # folder in conf is relative to package, like pool folders
+            cold_pool_folder = self._conf.get(
+                "MEMORY_MANAGER", "COLD_POOL_FOLDER", fallback=None
+            )
+            if cold_pool_folder:
+                cold_pool_folder = os.path.abspath(
+                    os.path.join(os.path.dirname(__file__), cold_pool_folder)
+                )
+        self._cold_pool_folder = (
+            cold_pool_folder if self._pool_layout == "folder" else None
+        )
+        self._cold_pool_after_seconds = float(
+            self._conf.get("MEMORY_MANAGER", "COLD_POOL_AFTER_SECONDS", fallback=3600)
+        )
+        # how often cold pools are looked for in background, 0 means never
+        self._cold_pool_check_interval = float(
+            self._conf.get("MEMORY_MANAGER", "COLD_POOL_CHECK_INTERVAL", fallback=60)
+        )
+        self._durability = durability or self._conf.get(
+            "MEMORY_MANAGER", "DURABILITY", fallback="none"
+        )
+        assert self._durability in DURABILITY_MODES, "unknown durability {}".format(
+            self._durability
+        )
+        self._flush_interval = float(
+            self._conf.get("MEMORY_MANAGER", "FLUSH_INTERVAL", fallback=1)
+        )
 
     @property
     def pools(self):
@@ -56,7 +210,651 @@ class MemoryManager(object):
     def conf(self):
         return self._conf
 
+    @property
+    def durability(self):
+        return self._durability
+
+    @property
+    def sync_count(self):
+        """number of `sync` calls, commits per sync shows batching of group commit"""
+        return self._sync_count
+
+    @property
+    def mapping_cache(self):
+        return self._mapping_cache
+
+    @property
+    def value_cache(self):
+        return self._value_cache
+
+    @property
+    def free_list(self):
+        return self._free_list
+
     def allocate_block(self, block_size):
+        with self._lock:
+            memory_segments = []
+            # reuse released space first, if one free extent is big enough
+            extent = self._free_list.take(block_size)
+            if extent:
+                pool_id, start_offset, end_offset = extent
+                self._append_free_map_record(
+                    FREE_MAP_TAKE, pool_id, start_offset, end_offset
+                )
+                memory_segments.append(
+                    MemorySegment(
+                        self._pool_dict[pool_id], start_offset, end_offset, block_size
+                    )
+                )
+            elif self._block_placement == "contiguous":
+                memory_segments.append(self._allocate_contiguous_segment(block_size))
+            else:
+                memory_segments.extend(self._allocate_spilled_segments(block_size))
+
+            # construct memory block and persist to disk
+            block = MemoryBlock(self._next_block_id, block_size, memory_segments)
+            self._register_block(block)
+            self._append_block_record(block)
+
+            return block
+
+    def release(self, block_id, offset, length):
+        """release a range of block, its space could be reused by new blocks"""
+        with self._lock:
+            block = self._block_dict[block_id]
+            # validate before any state changes, a range is released only once
+            assert (
+                offset >= 0 and offset + length <= block.block_size
+            ), "range {} -> {} is out of block {}".format(
+                offset, offset + length, block_id
+            )
+            released_ranges = self._merge_range(
+                self._released_ranges.get(block_id, []), offset, offset + length
+            )
+            self._released_ranges[block_id] = released_ranges
+            self.discard_values(block_id, offset, offset + length)
+            if self._held_releases is not None:
+                self._held_releases.append((block, offset, length))
+            else:
+                self._free_released(block, offset, length)
+
+    def seal_block(self, block_id):
+        """
+        nothing is appended to block any more, its unwritten tail is released, so
+        block is freed once all its values are released too
+        """
+        with self._lock:
+            # a block which is filled up is freed as soon as its values are released
+            if not self.is_sealed(block_id):
+                block = self._block_dict[block_id]
+                self.release(block_id, block.current_offset, block.free_memory)
+
+    def is_sealed(self, block_id):
+        """whether unwritten tail of block is released by `seal_block`"""
+        with self._lock:
+            block = self._block_dict.get(block_id)
+            released_ranges = self._released_ranges.get(block_id)
+            return (
+                block is None
+                or not block.free_memory
+                or bool(released_ranges)
+                and released_ranges[-1][0] <= block.current_offset
+                and released_ranges[-1][1] == block.block_size
+            )
+
+    def hold_releases(self):
+        """
+        keep released ranges out of reuse until `stage_releases`, for a write ahead
+        log whose replay could still point at released values
+        """
+        with self._lock:
+            if self._held_releases is None:
+                self._held_releases = []
+
+    def stage_releases(self):
+        """
+        log records which replace held released values are written, ranges are
+        reused once next `sync` makes log durable, or right away without durability
+        """
+        with self._lock:
+            if not self._held_releases:
+                return
+            held_releases, self._held_releases = self._held_releases, []
+            if self._durability == "none":
+                for block, offset, length in held_releases:
+                    self._free_released(block, offset, length)
+            else:
+                self._staged_releases.extend(held_releases)
+
+    def free_block(self, block_id):
+        """drop block from block table and release all its space"""
+        with self._lock:
+            block = self._block_dict[block_id]
+            # ranges released before are free already or taken by newer blocks
+            live_ranges, position = [], 0
+            for start, end in self._released_ranges.get(block_id, ()):
+                if position < start:
+                    live_ranges.append((position, start))
+                position = end
+            if position < block.block_size:
+                live_ranges.append((position, block.block_size))
+            del self._block_dict[block_id]
+            self._block_list.remove(block)
+            self._dirty_blocks.discard(block)
+            self._released_ranges.pop(block_id, None)
+            self.discard_values(block_id)
+            del self._block_records[block_id]
+            # tombstone goes first, so a crash never leaves a live block on free space
+            with open(self._block_file, "ab") as block_f:
+                block_f.write(BLOCK_RECORD.pack(block_id, 0, 0, 0))
+            self._metadata_dirty = True
+            self._block_table_size += BLOCK_RECORD.size
+            for start, end in live_ranges:
+                self._free_range(block, start, end - start)
+            if self._block_table_size > self._block_table_limit:
+                self._rewrite_block_table()
+
+    def _free_released(self, block, offset, length):
+        """caller should hold the lock"""
+        self._free_range(block, offset, length)
+        # every byte is released, an index releases unwritten tail only once it
+        # appends to another block, so block is dropped, its space is free already
+        if block.block_id in self._block_dict and self._released_ranges.get(
+            block.block_id
+        ) == [(0, block.block_size)]:
+            self.free_block(block.block_id)
+
+    def _free_range(self, block, offset, length):
+        """caller should hold the lock"""
+        for pool, start_offset, end_offset in block.extents(offset, length):
+            # retiring pool will be deleted, its space is never reused, a staged
+            # release could outlive its pool
+            if (
+                pool.pool_id in self._retiring_pools
+                or pool.pool_id not in self._pool_dict
+            ):
+                continue
+            self._free_list.add(pool.pool_id, start_offset, end_offset)
+            self._append_free_map_record(
+                FREE_MAP_ADD, pool.pool_id, start_offset, end_offset
+            )
+
+    @staticmethod
+    def _merge_range(ranges, start, end):
+        """add [start, end) to sorted disjoint ranges, return coalesced new list"""
+        if start >= end:
+            return ranges
+        index = bisect.bisect_left(ranges, (start, end))
+        assert (index == 0 or ranges[index - 1][1] <= start) and (
+            index == len(ranges) or end <= ranges[index][0]
+        ), "range {} -> {} of block is released twice".format(start, end)
+        if index > 0 and ranges[index - 1][1] == start:
+            index -= 1
+            start = ranges[index][0]
+            ranges = ranges[:index] + ranges[index + 1 :]
+        if index < len(ranges) and ranges[index][0] == end:
+            end = ranges[index][1]
+            ranges = ranges[:index] + ranges[index + 1 :]
+        return ranges[:index] + [(start, end)] + ranges[index:]
+
+    def seal_pools(self):
+        """
+        stop allocating from all current pools, new blocks go to a fresh pool,
+        return ids of sealed pools, which are retiring from now on
+        """
+        with self._lock:
+            pool_ids = [
+                pool.pool_id
+                for pool in self._pool_list
+                if pool.pool_id not in self._retiring_pools
+            ]
+            self._retiring_pools.update(pool_ids)
+            for pool_id in pool_ids:
+                self._free_list.remove_pool(pool_id)
+            self._allocate_new_pool()
+            return pool_ids
+
+    def retire_pools(self, pool_ids):
+        """
+        delete given pools at next retirement or close, pools given last time are
+        deleted now, caller should have moved everything still needed out of them,
+        lock-free readers which took a location before it was moved go on reading
+        old pools meanwhile
+        """
+        with self._lock:
+            retired_pool_ids = self._deferred_pools
+            self._deferred_pools = set(pool_ids)
+            self._drop_pools(retired_pool_ids)
+
+    def _drop_pools(self, pool_ids):
+        """
+        drop all blocks which live in given pools, then delete pool files, caller
+        should hold the lock
+        """
+        if not pool_ids:
+            return
+        dead_blocks = [
+            block
+            for block in self._block_list
+            if any(
+                segment.pool.pool_id in pool_ids for segment in block.memory_segments
+            )
+        ]
+        self._metadata_dirty = True
+        with open(self._block_file, "ab") as block_f:
+            for block in dead_blocks:
+                self.discard_values(block.block_id)
+                block_f.write(BLOCK_RECORD.pack(block.block_id, 0, 0, 0))
+                self._block_table_size += BLOCK_RECORD.size
+                del self._block_dict[block.block_id]
+                del self._block_records[block.block_id]
+                self._released_ranges.pop(block.block_id, None)
+                self._dirty_blocks.discard(block)
+            # tombstones are durable before pool files go away
+            block_f.flush()
+            os.fsync(block_f.fileno())
+        self._block_list = [
+            block for block in self._block_list if block.block_id in self._block_dict
+        ]
+        for pool_id in pool_ids:
+            pool = self._pool_dict.pop(pool_id)
+            self._pool_list.remove(pool)
+            self._dirty_pools.discard(pool)
+            self._free_list.remove_pool(pool_id)
+            self._retiring_pools.discard(pool_id)
+            if self._mapping_cache is not None:
+                self._mapping_cache.discard(pool)
+            if self._pool_container is not None:
+                self._pool_container.delete_extent(pool_id)
+            else:
+                os.remove(pool.filepath)
+            try:
+                pool.close()
+            except BufferError:
+                # a reader still holds a view, mapping goes away with it
+                pass
+        self._current_pool_index = len(self._pool_list) - 1
+        if self._current_pool is not None and self._current_pool.pool_id in pool_ids:
+            self._current_pool = None
+
+    def discard_values(self, block_id, start_offset=0, end_offset=None):
+        """drop cached values of a block range before it is reused or rewritten"""
+        if self._value_cache is not None:
+            self._value_cache.discard(block_id, start_offset, end_offset)
+
+    def compact(self, indexes, bytes_per_second=None, before_retire=None, lock=None):
+        """
+        move live values of all indexes using this manager into fresh pools, then
+        retire old pools, `before_retire` is called in between, `lock` guards index
+        changes, see `Compactor`, return (bytes copied, pools retired)
+        """
+        return Compactor(self, indexes, bytes_per_second, before_retire, lock).run()
+
+    def rebuild_index(self, index_type, processes=None):
+        """build an index of `index_type` from keyed value records of all blocks"""
+        return IndexRebuilder(self, processes).run(index_type)
+
+    def next_sequence(self):
+        """
+        sequence number of a persisted record, it starts from wall clock time, so
+        it keeps increasing after restart
+        """
+        with self._lock:
+            self._sequence = max(self._sequence + 1, time.time_ns())
+            return self._sequence
+
+    def sync_block(self, block):
+        """persist block's write cursor into block table in place"""
+        with self._lock:
+            record_offset, cursor = self._block_records[block.block_id]
+            current_offset = block.current_offset
+            if cursor == current_offset:
+                return
+            with open(self._block_file, "r+b") as block_f:
+                block_f.seek(record_offset + BLOCK_RECORD_CURSOR_OFFSET)
+                block_f.write(BLOCK_RECORD_CURSOR.pack(current_offset))
+            self._metadata_dirty = True
+            self._block_records[block.block_id] = (record_offset, current_offset)
+
+    def flush(self):
+        """persist deferred pool headers and block cursors into page cache"""
+        with self._lock:
+            # pools stay dirty until `sync`
+            for pool in list(self._dirty_pools):
+                pool.flush_header()
+            for block in self._drain(self._dirty_blocks):
+                self.sync_block(block)
+
+    @staticmethod
+    def _drain(items):
+        """
+        pop all items of a set which pools or blocks keep adding to, caller should
+        hold the lock, so nobody else pops meanwhile
+        """
+        drained = []
+        while items:
+            drained.append(items.pop())
+        return drained
+
+    def advance_block(self, block_id, offset):
+        """
+        recovery hook, move write cursor of block forward to at least offset, so
+        logged values written after cursor was persisted are not overwritten
+        """
+        with self._lock:
+            # block is freed once all its logged values are overwritten
+            block = self._block_dict.get(block_id)
+            if block is not None and block.current_offset < offset:
+                block.rewind(offset)
+
+    def register_sync(self, callback):
+        """`callback` is called at the end of every `sync`, e.g. to fsync a log"""
+        self._sync_callbacks.append(callback)
+
+    def sync(self):
+        """
+        make all writes so far durable, pools are synced before block table, so
+        durable block records never point to lost data
+        """
+        with self._lock:
+            # releases staged so far are logged, log is synced below
+            staged_releases, self._staged_releases = self._staged_releases, []
+            # a pool written after it is taken adds itself again for next sync
+            pools = self._drain(self._dirty_pools)
+            for pool in pools:
+                pool.flush_header()
+            for block in self._drain(self._dirty_blocks):
+                self.sync_block(block)
+            metadata_dirty, self._metadata_dirty = self._metadata_dirty, False
+            self._sync_count += 1
+        for pool in pools:
+            pool.sync()
+        if metadata_dirty:
+            for path in (self._block_file, self._free_map_file):
+                if os.path.exists(path):
+                    with open(path, "rb") as metadata_f:
+                        os.fsync(metadata_f.fileno())
+        for callback in self._sync_callbacks:
+            callback()
+        if staged_releases:
+            with self._lock:
+                for block, offset, length in staged_releases:
+                    self._free_released(block, offset, length)
+
+    def commit(self):
+        """
+        durability point of a write, in `group_commit` mode it waits until all
+        writes before it are durable, callers arriving while a sync runs are
+        covered by the next one together
+        """
+        if self._durability != "group_commit":
+            return
+        with self._commit_condition:
+            self._commit_requested += 1
+            ticket = self._commit_requested
+            while self._commit_done < ticket:
+                if self._commit_running:
+                    self._commit_condition.wait()
+                    continue
+                # become leader, sync on behalf of every waiting caller
+                self._commit_running = True
+                target = self._commit_requested
+                self._commit_condition.release()
+                try:
+                    self.sync()
+                finally:
+                    self._commit_condition.acquire()
+                    self._commit_running = False
+                    self._commit_condition.notify_all()
+                self._commit_done = max(self._commit_done, target)
+
+    def set_durability(self, durability):
+        assert durability in DURABILITY_MODES, "unknown durability {}".format(
+            durability
+        )
+        self._stop_committer()
+        self._durability = durability
+        self._start_committer()
+
+    def migrate_cold_pools(self):
+        """
+        move pools which are not accessed for a while from hot tier to cold tier,
+        block ids are not changed, return ids of moved pools
+        """
+        if self._cold_pool_folder is None:
+            return []
+        deadline = time.monotonic() - self._cold_pool_after_seconds
+        with self._lock:
+            # pools with space which is allocated but not written yet are skipped,
+            # they are about to be written
+            writable_pool_ids = {
+                pool.pool_id
+                for block in self._block_list
+                for pool, _, _ in block.extents(
+                    block.current_offset, block.block_size - block.current_offset
+                )
+            }
+            cold_pools = [
+                pool
+                for pool in self._pool_list
+                if not (
+                    pool is self._current_pool
+                    or pool.pool_id in writable_pool_ids
+                    or pool.pool_id in self._retiring_pools
+                    or os.path.dirname(pool.filepath) == self._cold_pool_folder
+                    or pool.last_access_time > deadline
+                )
+            ]
+        migrated_pool_ids = []
+        for pool in cold_pools:
+            cold_filepath = os.path.join(
+                self._cold_pool_folder, os.path.basename(pool.filepath)
+            )
+            # whole pool is copied without manager lock, pool which is written,
+            # allocated from or retired meanwhile is left in hot tier
+            token = pool.copy_to(cold_filepath)
+            if token is None:
+                continue
+            with self._lock:
+                if (
+                    self._pool_dict.get(pool.pool_id) is not pool
+                    or pool.pool_id in self._retiring_pools
+                ):
+                    token = None
+                if pool.move_to(cold_filepath, token):
+                    migrated_pool_ids.append(pool.pool_id)
+        return migrated_pool_ids
+
+    def close(self):
+        """persist block cursors and close all pool resources"""
+        if self._provision_thread is not None:
+            self._stop_provisioner()
+        if self._cold_pool_folder and self._cold_pool_check_interval > 0:
+            self._stop_tier_migrator()
+        self._stop_committer()
+        # no reader is left, retired pools go now
+        with self._lock:
+            self._drop_pools(self._deferred_pools)
+            self._deferred_pools = set()
+        self.flush()
+        for pool in self._pool_list:
+            pool.close()
+        if self._pool_container is not None:
+            self._pool_container.close()
+
+    def __getstate__(self):
+        current_state = self.__dict__.copy()
+        # exclude lock and background threads in pickle
+        del current_state["_lock"]
+        for name in (
+            "_provision_condition",
+            "_provision_thread",
+            "_provision_stopped",
+            "_spare_pool_path",
+            "_spare_pool_ready",
+            "_tier_stopped",
+            "_tier_thread",
+            "_commit_condition",
+            "_flush_stopped",
+            "_flush_thread",
+            "_sync_callbacks",
+            "_dirty_pools",
+            "_dirty_blocks",
+            "_held_releases",
+            "_staged_releases",
+        ):
+            current_state.pop(name, None)
+        return current_state
+
+    def __setstate__(self, state):
+        # managers pickled by older versions lack attributes added since, settings
+        # are read from pickled conf first, then pickled attributes override them
+        self._conf = state["_conf"]
+        self._configure([state["_pool_folder"]], state["_block_file"], None, None)
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._sync_callbacks = []
+        self._provision_thread = None
+        # releases are held only for a write ahead log of a live client
+        self._held_releases, self._staged_releases = None, []
+        self._upgrade_state()
+        # pickled cursors may be ahead of block table, every block is synced once
+        self._dirty_pools, self._dirty_blocks = set(), set()
+        for pool in self._pool_list:
+            pool.track_dirty(self._dirty_pools)
+        for block in self._block_list:
+            block.track_dirty(self._dirty_blocks)
+            self._dirty_blocks.add(block)
+        if self._cold_pool_folder and self._cold_pool_check_interval > 0:
+            self._start_tier_migrator()
+        self._start_committer()
+
+    def _upgrade_state(self):
+        """fill bootstrap state which managers pickled by older versions miss"""
+        self.__dict__.setdefault("_pool_container", None)
+        self.__dict__.setdefault(
+            "_current_pool", self._pool_list[-1] if self._pool_list else None
+        )
+        self.__dict__.setdefault("_retiring_pools", set())
+        self.__dict__.setdefault("_deferred_pools", set())
+        self.__dict__.setdefault("_metadata_dirty", True)
+        self.__dict__.setdefault("_sync_count", 0)
+        self.__dict__.setdefault("_sequence", 0)
+        if "_free_list" not in self.__dict__:
+            self._free_map_file = os.path.join(self._pool_folder, "free_map")
+            self._load_free_map()
+        if "_block_records" not in self.__dict__:
+            # block file still keeps pickled blocks, pickled block list replaces it
+            self._block_records = {}
+            self._rewrite_block_table()
+        if "_released_ranges" not in self.__dict__:
+            self._load_released_ranges()
+        if "_free_map_limit" not in self.__dict__:
+            self._init_free_map_size()
+        self.__dict__.setdefault(
+            "_block_table_limit",
+            max(2 * self._block_table_size, METADATA_COMPACT_SIZE),
+        )
+
+    def _start_committer(self):
+        self._commit_condition = threading.Condition()
+        self._commit_requested = self._commit_done = 0
+        self._commit_running = False
+        if self._durability == "periodic":
+            self._flush_stopped = threading.Event()
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def _stop_committer(self):
+        if self._durability == "periodic":
+            self._flush_stopped.set()
+            self._flush_thread.join()
+        # writes after last background flush
+        if self._durability != "none":
+            self.sync()
+
+    def _flush_loop(self):
+        while not self._flush_stopped.wait(self._flush_interval):
+            self.sync()
+
+    def _start_tier_migrator(self):
+        self._tier_stopped = threading.Event()
+        self._tier_thread = threading.Thread(target=self._tier_loop, daemon=True)
+        self._tier_thread.start()
+
+    def _stop_tier_migrator(self):
+        self._tier_stopped.set()
+        self._tier_thread.join()
+
+    def _tier_loop(self):
+        while not self._tier_stopped.wait(self._cold_pool_check_interval):
+            self.migrate_cold_pools()
+
+    def _start_provisioner(self):
+        # spare pools of other managers are left alone, a spare pool of an exited
+        # process is left by a crash, it may be created with another conf
+        for pool_folder in self._pool_folders:
+            for path in os.listdir(pool_folder):
+                match_result = re.fullmatch(r"\.pool_spare\.(\d+)\.\d+(\.tmp)?", path)
+                if match_result and not self._process_alive(int(match_result.group(1))):
+                    os.remove(os.path.join(pool_folder, path))
+        # spare pool is named after this manager
+        self._spare_pool_name = ".pool_spare.{}.{}".format(os.getpid(), id(self))
+        self._spare_pool_path = None
+        self._spare_pool_ready = False
+        self._provision_stopped = False
+        self._provision_condition = threading.Condition()
+        self._provision_thread = threading.Thread(
+            target=self._provision_loop, daemon=True
+        )
+        self._provision_thread.start()
+
+    def _stop_provisioner(self):
+        with self._provision_condition:
+            self._provision_stopped = True
+            self._provision_condition.notify_all()
+        self._provision_thread.join()
+        self._provision_thread = None
+        if self._spare_pool_ready:
+            os.remove(self._spare_pool_path)
+            self._spare_pool_ready = False
+
+    @staticmethod
+    def _process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # process of another user
+            pass
+        return True
+
+    def _provision_loop(self):
+        """
+        keep one formatted spare pool file in folder of next pool, so allocation
+        only renames it
+        """
+        while True:
+            with self._provision_condition:
+                while self._spare_pool_ready and not self._provision_stopped:
+                    self._provision_condition.wait()
+                if self._provision_stopped:
+                    return
+            spare_pool_path = os.path.join(
+                self._pool_folder_of(self._next_pool_id), self._spare_pool_name
+            )
+            spare_tmp_path = spare_pool_path + ".tmp"
+            if os.path.exists(spare_tmp_path):
+                os.remove(spare_tmp_path)
+            MemoryPool(spare_tmp_path, self._conf, lazy=True)
+            os.rename(spare_tmp_path, spare_pool_path)
+            with self._provision_condition:
+                self._spare_pool_path = spare_pool_path
+                self._spare_pool_ready = True
+
+    def _allocate_spilled_segments(self, block_size):
+        """fill tail of last pool, spill the rest of block into new pools"""
         total_size = block_size
         memory_segments = []
         while total_size > 0:
@@ -72,72 +870,142 @@ class MemoryManager(object):
                 memory_segments.append(self._pool_list[-1].allocate(allocate_size))
                 self._allocate_new_pool()
                 total_size -= allocate_size
+        return memory_segments
 
-        # construct memory block and persist to disk
-        block_f = open(self._block_file, "ab")
-        block = MemoryBlock(self._next_block_id, block_size, memory_segments)
-        self._block_list.append(block)
-        self._block_dict[block.block_id] = block
-        self._next_block_id += 1
+    def _allocate_contiguous_segment(self, block_size):
+        """keep block inside one pool, oversized block gets a dedicated pool"""
+        if block_size > self._pool_capacity:
+            pool = self._allocate_new_pool(
+                pool_size=self._pool_header_length + block_size, current=False
+            )
+            return pool.allocate(block_size)
+        pool = self._current_pool
+        if pool is None or pool.pool_allocate_limit < block_size:
+            # tail gap of current pool is recorded for reuse, only the part which
+            # is already backed by file, pool should not grow just to be freed
+            tail_size = (
+                pool.pool_size - pool.pool_allocate_offset if pool is not None else 0
+            )
+            if tail_size > 0:
+                tail = pool.allocate(tail_size)
+                self._free_list.add(pool.pool_id, tail.start_offset, tail.end_offset)
+                self._append_free_map_record(
+                    FREE_MAP_ADD, pool.pool_id, tail.start_offset, tail.end_offset
+                )
+            pool = self._allocate_new_pool()
+        return pool.allocate(block_size)
 
-        string = pickle.dumps(block)
-        # TODO without compression now
-        output_bytearray = bytearray()
-        output_bytearray.extend(
-            (("%0{}d".format(self._block_header_length)) % len(string)).encode("utf-8")
+    def _allocate_new_pool(self, pool_size=None, current=True):
+        if self._pool_container is not None:
+            pool = MemoryPool(
+                None,
+                self._conf,
+                pool_size=pool_size,
+                container=self._pool_container,
+                pool_id=self._next_pool_id,
+            )
+            return self._add_new_pool(pool, current)
+        pool_folder = self._pool_folder_of(self._next_pool_id)
+        pool_path = os.path.join(pool_folder, "pool_{}".format(self._next_pool_id))
+        # spare pool is formatted with default pool size
+        if self._pool_provision_ahead and self._provision_thread is None:
+            self._start_provisioner()
+        elif self._pool_provision_ahead and pool_size is None:
+            with self._provision_condition:
+                if self._spare_pool_ready:
+                    # dedicated pools take pool ids too, so spare could be made
+                    # for another folder
+                    if os.path.dirname(self._spare_pool_path) == pool_folder:
+                        os.rename(self._spare_pool_path, pool_path)
+                    else:
+                        os.remove(self._spare_pool_path)
+                    self._spare_pool_ready = False
+                    self._provision_condition.notify_all()
+        pool = MemoryPool(
+            pool_path,
+            self._conf,
+            pool_size=pool_size,
+            mapping_cache=self._mapping_cache,
         )
-        output_bytearray.extend(string)
-        block_f.write(bytes(output_bytearray))
-        block_f.close()
-
-        return block
-
-    def close(self):
-        """close all pool resources"""
-        for pool in self._pool_list:
-            pool.close()
+        return self._add_new_pool(pool, current)
 
-    def _allocate_new_pool(self):
-        pool_path = os.path.abspath(
-            os.path.join(self._pool_folder, "pool_{}".format(self._next_pool_id))
-        )
-        pool = MemoryPool(pool_path, self._conf)
+    def _add_new_pool(self, pool, current):
+        pool.track_dirty(self._dirty_pools)
         self._pool_list.append(pool)
         self._pool_dict[pool.pool_id] = pool
         self._next_pool_id += 1
-        self._current_pool_index = len(self._pool_list) - 1
+        if current:
+            self._current_pool = pool
+            self._current_pool_index = len(self._pool_list) - 1
+        return pool
 
     def _bootstrap(self):
-        # check if `pools` folder exists
-        if not os.path.exists(self._pool_folder):
-            os.mkdir(self._pool_folder)
-
-        # load all pools
-        self._pool_list = []
-        self._pool_dict = {}
-        max_pool_id = -1
-        not_full_pool = None
-        for path in os.listdir(self._pool_folder):
-            absolute_path = os.path.abspath(os.path.join(self._pool_folder, path))
-            match_result = re.search("pool_(\d+)", path)
-            if match_result:
-                pool_id = int(match_result.group(1))
-                pool = MemoryPool(absolute_path, self._conf)
-                # if current pool could be used to allocate memory
-                if pool.pool_allocate_limit > 0:
-                    assert not_full_pool is None
-                    not_full_pool = pool
-                else:
-                    self._pool_list.append(pool)
-                max_pool_id = max(max_pool_id, pool_id)
-        # update next available pool id
-        self._next_pool_id = max_pool_id + 1
-        # if one of the pool is not full
-        if not_full_pool:
-            self._pool_list.append(not_full_pool)
-            self._current_pool_index = len(self._pool_list) - 1
+        # pools and blocks which have something to flush add themselves, so a
+        # sync touches only them
+        self._dirty_pools = set()
+        self._dirty_blocks = set()
+        # check if `pools` folders exist
+        for pool_folder in self._pool_folders:
+            os.makedirs(pool_folder, exist_ok=True)
+        if self._cold_pool_folder:
+            os.makedirs(self._cold_pool_folder, exist_ok=True)
+
+        # register all pools, their mmaps are opened lazily on first access, pools
+        # are filled in id order, so only the last one could be not full
+        if self._pool_layout == "container":
+            self._pool_container = PoolContainer(
+                os.path.join(
+                    self._pool_folder,
+                    self._conf.get(
+                        "MEMORY_MANAGER", "POOL_CONTAINER_FILE", fallback="pools"
+                    ),
+                )
+            )
+            self._pool_list = [
+                MemoryPool(
+                    None,
+                    self._conf,
+                    lazy=True,
+                    container=self._pool_container,
+                    pool_id=pool_id,
+                )
+                for pool_id in self._pool_container.pool_ids()
+            ]
+        else:
+            self._pool_container = None
+            pool_paths = {}
+            for pool_folder in self._pool_folders + (
+                [self._cold_pool_folder] if self._cold_pool_folder else []
+            ):
+                for path in os.listdir(pool_folder):
+                    match_result = re.fullmatch(r"pool_(\d+)", path)
+                    if not match_result:
+                        continue
+                    pool_id = int(match_result.group(1))
+                    if pool_id in pool_paths and pool_folder == self._cold_pool_folder:
+                        # migration is interrupted after cold copy is complete
+                        os.remove(pool_paths[pool_id])
+                    else:
+                        assert (
+                            pool_id not in pool_paths
+                        ), "pool {} is found in more than one folder".format(pool_id)
+                    pool_paths[pool_id] = os.path.join(pool_folder, path)
+            self._pool_list = [
+                MemoryPool(
+                    pool_paths[pool_id],
+                    self._conf,
+                    lazy=True,
+                    mapping_cache=self._mapping_cache,
+                )
+                for pool_id in sorted(pool_paths)
+            ]
+        self._pool_dict = {pool.pool_id: pool for pool in self._pool_list}
         for pool in self._pool_list:
-            self._pool_dict[pool.pool_id] = pool
+            pool.track_dirty(self._dirty_pools)
+        # update next available pool id
+        self._next_pool_id = self._pool_list[-1].pool_id + 1 if self._pool_list else 0
+        self._current_pool_index = len(self._pool_list) - 1
+        self._current_pool = self._pool_list[-1] if self._pool_list else None
 
         # check if `block file` exists
         if not os.path.exists(self._block_file):
@@ -145,21 +1013,326 @@ class MemoryManager(object):
 
         self._block_list = []
         self._block_dict = {}
+        # block id -> (record offset in block table, persisted write cursor)
+        self._block_records = {}
         self._next_block_id = 0
-        block_f = open(self._block_file, "rb")
-        bytes = block_f.read()
-        index, length = 0, len(bytes)
-        while index < length:
-            data_length = int(bytes[index : index + self._block_header_length])
-            data = bytes[
-                index
-                + self._block_header_length : index
-                + self._block_header_length
-                + data_length
+        with open(self._block_file, "rb") as block_f:
+            data = block_f.read()
+        if not data:
+            with open(self._block_file, "wb") as block_f:
+                block_f.write(BLOCK_TABLE_MAGIC)
+            self._block_table_size = len(BLOCK_TABLE_MAGIC)
+        elif data.startswith(BLOCK_TABLE_MAGIC):
+            self._load_block_table(data)
+        else:
+            self._migrate_legacy_block_file(data)
+        self._block_table_limit = max(2 * self._block_table_size, METADATA_COMPACT_SIZE)
+
+        self._free_map_file = os.path.join(self._pool_folder, "free_map")
+        self._load_free_map()
+        self._load_released_ranges()
+        # pools sealed by compaction, they will be deleted once it finishes
+        self._retiring_pools = set()
+        # retired pools, they are deleted at next retirement or close
+        self._deferred_pools = set()
+        # block table or free map is written since last sync
+        self._metadata_dirty = True
+        self._sync_count = 0
+        self._sync_callbacks = []
+        # releases are held only for a write ahead log of a live client
+        self._held_releases, self._staged_releases = None, []
+        self._sequence = 0
+
+    def _pool_folder_of(self, pool_id):
+        return self._pool_folder_cycle[pool_id % len(self._pool_folder_cycle)]
+
+    @staticmethod
+    def _weighted_cycle(items, weights):
+        """
+        smooth weighted round robin, every item appears `weight` times in the cycle
+        and is spread evenly, all weights are 1 if not given
+        """
+        weights = weights or [1] * len(items)
+        assert len(weights) == len(items) and all(
+            weight > 0 for weight in weights
+        ), "every item should have a positive weight"
+        current_weights = [0] * len(items)
+        cycle = []
+        for _ in range(sum(weights)):
+            for index, weight in enumerate(weights):
+                current_weights[index] += weight
+            selected = current_weights.index(max(current_weights))
+            current_weights[selected] -= sum(weights)
+            cycle.append(items[selected])
+        return cycle
+
+    def _append_free_map_record(self, operation, pool_id, start_offset, end_offset):
+        self._metadata_dirty = True
+        with open(self._free_map_file, "ab") as free_map_f:
+            free_map_f.write(
+                FREE_MAP_RECORD.pack(operation, pool_id, start_offset, end_offset)
+            )
+        self._free_map_size += FREE_MAP_RECORD.size
+        if self._free_map_size > self._free_map_limit:
+            self._rewrite_free_map()
+
+    def _init_free_map_size(self):
+        self._free_map_size = (
+            os.path.getsize(self._free_map_file)
+            if os.path.exists(self._free_map_file)
+            else 0
+        )
+        self._free_map_limit = max(2 * self._free_map_size, METADATA_COMPACT_SIZE)
+
+    def _load_free_map(self):
+        """replay free map log, then rewrite it as a snapshot of free extents"""
+        self._free_list = FreeList()
+        if not os.path.exists(self._free_map_file):
+            self._init_free_map_size()
+            return
+        with open(self._free_map_file, "rb") as free_map_f:
+            data = free_map_f.read()
+        for index in range(
+            0, len(data) - FREE_MAP_RECORD.size + 1, FREE_MAP_RECORD.size
+        ):
+            operation, pool_id, start_offset, end_offset = FREE_MAP_RECORD.unpack_from(
+                data, index
+            )
+            if pool_id not in self._pool_dict:
+                continue
+            if operation == FREE_MAP_ADD:
+                self._free_list.add(pool_id, start_offset, end_offset)
+            else:
+                self._free_list.remove(pool_id, start_offset, end_offset)
+        # free tail of a pool has no block record, header may be deferred or torn
+        for pool_id, start_offset, end_offset in self._free_list.extents():
+            self._pool_dict[pool_id].set_allocate_offset_floor(end_offset)
+        self._rewrite_free_map()
+
+    def _rewrite_free_map(self):
+        """write free extents as a new free map, then swap it in"""
+        snapshot_file = self._free_map_file + ".tmp"
+        self._free_map_size = 0
+        with open(snapshot_file, "wb") as free_map_f:
+            for pool_id, start_offset, end_offset in self._free_list.extents():
+                free_map_f.write(
+                    FREE_MAP_RECORD.pack(
+                        FREE_MAP_ADD, pool_id, start_offset, end_offset
+                    )
+                )
+                self._free_map_size += FREE_MAP_RECORD.size
+            free_map_f.flush()
+            os.fsync(free_map_f.fileno())
+        os.replace(snapshot_file, self._free_map_file)
+        self._free_map_limit = max(2 * self._free_map_size, METADATA_COMPACT_SIZE)
+
+    def _load_released_ranges(self):
+        """
+        block id -> sorted ranges of block which are released, a released range is
+        free or taken by a newer block, live blocks never overlap otherwise
+        """
+        self._released_ranges = {}
+        # pool id -> (start offset, end offset, owner, offset in block), free
+        # extents are owned by an id newer than any block
+        pool_extents = {}
+        for block in self._block_list:
+            block_offset = 0
+            for segment in block.memory_segments:
+                pool_extents.setdefault(segment.pool.pool_id, []).append(
+                    (
+                        segment.start_offset,
+                        segment.end_offset,
+                        block.block_id,
+                        block_offset,
+                    )
+                )
+                block_offset += segment.length
+        for pool_id, start_offset, end_offset in self._free_list.extents():
+            pool_extents.setdefault(pool_id, []).append(
+                (start_offset, end_offset, self._next_block_id, 0)
+            )
+        for extents in pool_extents.values():
+            extents.sort()
+            boundaries = sorted({offset for extent in extents for offset in extent[:2]})
+            active, index = [], 0
+            # newest owner of every piece between adjacent boundaries keeps it
+            for low, high in zip(boundaries, boundaries[1:]):
+                while index < len(extents) and extents[index][0] <= low:
+                    active.append(extents[index])
+                    index += 1
+                active = [extent for extent in active if extent[1] > low]
+                if len(active) < 2:
+                    continue
+                newest = max(extent[2] for extent in active)
+                for start_offset, _, owner, block_offset in active:
+                    if owner != newest:
+                        self._released_ranges[owner] = self._merge_range(
+                            self._released_ranges.get(owner, []),
+                            block_offset + low - start_offset,
+                            block_offset + high - start_offset,
+                        )
+
+    def _register_block(self, block):
+        block.track_dirty(self._dirty_blocks)
+        self._block_list.append(block)
+        self._block_dict[block.block_id] = block
+        self._next_block_id = max(block.block_id + 1, self._next_block_id)
+
+    def _encode_block_record(self, block, cursor):
+        segments = block.memory_segments
+        record = bytearray(
+            BLOCK_RECORD.pack(block.block_id, block.block_size, cursor, len(segments))
+        )
+        for segment in segments:
+            record.extend(
+                SEGMENT_RECORD.pack(
+                    segment.pool.pool_id, segment.start_offset, segment.end_offset
+                )
+            )
+        return bytes(record)
+
+    def _append_block_record(self, block):
+        record = self._encode_block_record(block, block.current_offset)
+        with open(self._block_file, "ab") as block_f:
+            block_f.write(record)
+        self._metadata_dirty = True
+        self._block_records[block.block_id] = (
+            self._block_table_size,
+            block.current_offset,
+        )
+        self._block_table_size += len(record)
+        if self._block_table_size > self._block_table_limit:
+            self._rewrite_block_table()
+
+    def _load_block_table(self, data):
+        """decode fixed width block records, no unpickling involved"""
+        index, length = len(BLOCK_TABLE_MAGIC), len(data)
+        # block id -> (record offset, block size, cursor, segment tuples)
+        records, tombstones = {}, 0
+        while index + BLOCK_RECORD.size <= length:
+            block_id, block_size, cursor, segment_count = BLOCK_RECORD.unpack_from(
+                data, index
+            )
+            record_end = index + BLOCK_RECORD.size + segment_count * SEGMENT_RECORD.size
+            # ignore torn record at the tail
+            if record_end > length:
+                break
+            # tombstone of a freed block
+            if block_size == 0:
+                records.pop(block_id, None)
+                tombstones += 1
+            else:
+                records[block_id] = (
+                    index,
+                    block_size,
+                    cursor,
+                    [
+                        SEGMENT_RECORD.unpack_from(data, offset)
+                        for offset in range(
+                            index + BLOCK_RECORD.size, record_end, SEGMENT_RECORD.size
+                        )
+                    ],
+                )
+            self._next_block_id = max(block_id + 1, self._next_block_id)
+            index = record_end
+        self._block_table_size = index
+
+        for block_id, (record_offset, block_size, cursor, segments) in records.items():
+            memory_segments = [
+                MemorySegment(
+                    self._pool_dict[pool_id],
+                    start_offset,
+                    end_offset,
+                    end_offset - start_offset,
+                )
+                for pool_id, start_offset, end_offset in segments
             ]
-            block = pickle.loads(data)
-            self._block_list.append(block)
-            self._block_dict[block.block_id] = block
+            self._register_block(
+                MemoryBlock(block_id, block_size, memory_segments, cursor)
+            )
+            self._block_records[block_id] = (record_offset, cursor)
+        self._raise_pool_floors()
+        # drop freed blocks from block table
+        if tombstones:
+            self._rewrite_block_table()
+
+    def _rewrite_block_table(self):
+        """write live blocks into a new block table, then swap it in"""
+        block_table_tmp = self._block_file + ".tmp"
+        self._block_table_size = len(BLOCK_TABLE_MAGIC)
+        with open(block_table_tmp, "wb") as block_f:
+            block_f.write(BLOCK_TABLE_MAGIC)
+            for block in self._block_list:
+                # cursor is persisted by `sync_block`, never ahead of synced values
+                cursor = self._block_records.get(
+                    block.block_id, (None, block.current_offset)
+                )[1]
+                record = self._encode_block_record(block, cursor)
+                block_f.write(record)
+                self._block_records[block.block_id] = (self._block_table_size, cursor)
+                self._block_table_size += len(record)
+            # keep block ids monotonic, ids of freed blocks are never reused
+            if self._next_block_id - 1 not in self._block_dict:
+                block_f.write(BLOCK_RECORD.pack(self._next_block_id - 1, 0, 0, 0))
+                self._block_table_size += BLOCK_RECORD.size
+            block_f.flush()
+            os.fsync(block_f.fileno())
+        os.replace(block_table_tmp, self._block_file)
+        self._block_table_limit = max(2 * self._block_table_size, METADATA_COMPACT_SIZE)
+
+    def _migrate_legacy_block_file(self, data):
+        """
+        load pickled blocks, then rewrite them as a binary block table, legacy file
+        is replaced only once the new table is durable
+        """
+        index, length = 0, len(data)
+        legacy_blocks = []
+        while index < length:
+            data_length = int(data[index : index + self._block_header_length])
+            block = pickle.loads(
+                data[
+                    index
+                    + self._block_header_length : index
+                    + self._block_header_length
+                    + data_length
+                ]
+            )
+            legacy_blocks.append(block)
             index += self._block_header_length + data_length
-            self._next_block_id = max(block.block_id + 1, self._next_block_id)
-        block_f.close()
+
+        for legacy_block in legacy_blocks:
+            memory_segments = [
+                MemorySegment(
+                    self._pool_dict[segment.pool.pool_id],
+                    segment.start_offset,
+                    segment.end_offset,
+                    segment.length,
+                )
+                for segment in legacy_block.memory_segments
+            ]
+            block = MemoryBlock(
+                legacy_block.block_id,
+                legacy_block.block_size,
+                memory_segments,
+                legacy_block.current_offset,
+            )
+            self._register_block(block)
+        self._raise_pool_floors()
+        # pool copies pickled with legacy blocks are never mapped, they are
+        # just dropped
+        self._rewrite_block_table()
+
+    def _raise_pool_floors(self):
+        """
+        reconcile pool headers, which may be deferred, with highest allocated
+        offset of every pool according to loaded blocks
+        """
+        pool_high_water = {}
+        for block in self._block_list:
+            for segment in block.memory_segments:
+                pool_id = segment.pool.pool_id
+                pool_high_water[pool_id] = max(
+                    pool_high_water.get(pool_id, 0), segment.end_offset
+                )
+        for pool_id, high_water in pool_high_water.items():
+            self._pool_dict[pool_id].set_allocate_offset_floor(high_water)
@@ -1,17 +1,62 @@
 import mmap
 import os
 import re
+import struct
+import threading
+import time
+import zlib
 import configparser
 
 from memory_segment import MemorySegment
 
+# binary allocation header: allocate offset, crc32 of allocate offset
+BINARY_HEADER = struct.Struct("<QI")
+# `MMAP_ADVICE` -> madvise flag, None if mapping is not advised, flags are
+# missing on platforms without madvise
+MMAP_ADVICES = {
+    "normal": None,
+    "random": getattr(mmap, "MADV_RANDOM", None),
+    "sequential": getattr(mmap, "MADV_SEQUENTIAL", None),
+}
+# reads in a row which continue each other before they are taken as a scan, a
+# random get reads a record header, then its value, which is only two
+READAHEAD_STREAK = 3
+
 
 class MemoryPool(object):
     """
     Map a real file to a memory pool, use mmap
+
+    An existing pool file could be opened lazily, then its header and mmap are
+    loaded on first access. All I/O is positional on mmap slices, there is no
+    shared file cursor, so concurrent reads are safe without locking. Allocation
+    is serialized by a per-pool lock. A pool starts at `POOL_SIZE` and grows on
+    demand up to `POOL_MAX_SIZE`.
+
+    A pool could also live in a fixed size extent of a `PoolContainer` file, then
+    it shares container's mmap and is addressed by its pool id.
+
+    When a `MappingCache` is given, every access is reported to it, and it could
+    unmap the pool, which would be mapped again on next access.
+
+    Mapping is advised by `MMAP_ADVICE`, the kernel reads ahead of faults by it.
+    With `READAHEAD_SIZE`, `READAHEAD_STREAK` reads in a row which continue each
+    other are taken as a scan, range ahead of them is advised `MADV_WILLNEED` so it
+    is paged in before it is read, window doubles while scan goes on, up to
+    `READAHEAD_SIZE`. Hints are
+    best effort, concurrent readers could only make them less accurate.
     """
 
-    def __init__(self, filepath, conf):
+    def __init__(
+        self,
+        filepath,
+        conf,
+        lazy=False,
+        pool_size=None,
+        container=None,
+        pool_id=None,
+        mapping_cache=None,
+    ):
         # load pool common const values
         self.__conf = conf
         if not conf:
@@ -23,32 +68,342 @@ class MemoryPool(object):
         self.__pool_allocate_offset_header = int(
             self.__conf["MEMORY_POOL"]["POOL_ALLOCATE_OFFSET_HEADER"]
         )
-        self.__pool_size = int(self.__conf["MEMORY_POOL"]["POOL_SIZE"])
+        # new pool could be created with a dedicated size, existing pool's size
+        # is taken from its file when loaded
+        self.__pool_size = pool_size or int(self.__conf["MEMORY_POOL"]["POOL_SIZE"])
         assert (
             self.__pool_size > self.__pool_allocate_offset_header
         ), "pool size should be greater than pool header size"
+        # pool grows on demand up to max size, dedicated sized pool or pool inside
+        # container never grows
+        self.__pool_max_size = (
+            self.__pool_size
+            if pool_size or container is not None
+            else max(
+                int(self.__conf.get("MEMORY_POOL", "POOL_MAX_SIZE", fallback=0)),
+                self.__pool_size,
+            )
+        )
         # pool metadata
-        self.__filepath = filepath
-        self.__id = self.__extract_pool_id_from_filepath()
+        self.__container = container
+        self.__filepath = container.filepath if container is not None else filepath
+        self.__id = (
+            pool_id if container is not None else self.__extract_pool_id_from_filepath()
+        )
+        # pool starts at `base offset` of its mapping, always 0 for a pool file
+        self.__base_offset = 0
+        self.__mapping_cache = mapping_cache
+        # set of manager which collects pools having something to flush
+        self.__dirty_pools = None
+        # access statistics, they drive migration of cold pools
+        self.__access_count = 0
+        # lowest legal allocate offset, known from block table on recovery
+        self.__allocate_offset_floor = self.__pool_allocate_offset_header
+        self.__configure()
+        self.__reset_runtime_state()
+        if container is not None:
+            if not container.has_extent(self.__id):
+                self.__create_extent()
         # if file is not exists or it is empty
-        if not os.path.exists(filepath) or os.stat(filepath).st_size == 0:
-            # initialize memory pool file with 0 as placeholder
-            with open(filepath, "wb") as f:
-                place_holder = (
-                    "%0{}d".format(self.__pool_allocate_offset_header)
-                    % self.__pool_allocate_offset_header
-                )
-                place_holder += "0" * (
-                    self.__pool_size - self.__pool_allocate_offset_header
-                )
-                f.write(place_holder.encode("utf-8"))
-            self.__pool_allocate_offset = self.__pool_allocate_offset_header
+        elif not os.path.exists(filepath) or os.stat(filepath).st_size == 0:
+            self.__create_file()
+        if not lazy:
+            self.__load()
+
+    def __configure(self):
+        """read settings from conf"""
+        # header is `ascii` zero-padded digits or `binary` offset with checksum
+        self.__pool_header_format = self.__conf.get(
+            "MEMORY_POOL", "POOL_HEADER_FORMAT", fallback="ascii"
+        )
+        assert (
+            self.__pool_header_format != "binary"
+            or self.__pool_allocate_offset_header >= BINARY_HEADER.size
+        ), "binary pool header needs at least {} bytes".format(BINARY_HEADER.size)
+        # `deferred` only updates header in memory until `flush_header` is called
+        self.__pool_header_deferred = (
+            self.__conf.get("MEMORY_POOL", "POOL_HEADER_FLUSH", fallback="immediate")
+            == "deferred"
+        )
+        # `sparse` leaves holes in file, `fallocate` reserves disk blocks upfront
+        self.__pool_preallocate = self.__conf.get(
+            "MEMORY_POOL", "POOL_PREALLOCATE", fallback="sparse"
+        )
+        mmap_advice = self.__conf.get("MEMORY_POOL", "MMAP_ADVICE", fallback="normal")
+        assert mmap_advice in MMAP_ADVICES, "unknown mmap advice {}".format(mmap_advice)
+        self.__mmap_advice = MMAP_ADVICES[mmap_advice]
+        # max bytes advised ahead of a scan, 0 means no readahead
+        self.__readahead_size = int(
+            self.__conf.get("MEMORY_POOL", "READAHEAD_SIZE", fallback=0)
+        )
+
+    def __reset_runtime_state(self):
+        self.__mmap_object = None
+        self.__loaded = False
+        # (start, end) written since last `sync`, None if nothing is written
+        self.__dirty_range = None
+        self.__header_dirty = False
+        # writes started and finished, pool is moved only while they are equal
+        self.__write_count = 0
+        self.__written_count = 0
+        self.__last_access_time = time.monotonic()
+        self.__lock = threading.Lock()
+        # (start, end) of last read, reads in a row which continue each other, end
+        # of advised range and size of next advice
+        self.__last_read = None
+        self.__readahead_streak = 0
+        self.__readahead_end = 0
+        self.__readahead_window = 0
+        self.__readahead_count = 0
+
+    def __create_file(self):
+        """write header only, file is extended by kernel and filled with zero"""
+        fd = os.open(self.__filepath, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, self.__encode_header(self.__pool_allocate_offset_header))
+            if self.__pool_preallocate == "fallocate" and hasattr(
+                os, "posix_fallocate"
+            ):
+                os.posix_fallocate(fd, 0, self.__pool_size)
+            else:
+                os.ftruncate(fd, self.__pool_size)
+        finally:
+            os.close(fd)
+
+    def __create_extent(self):
+        """reserve extent in container and write header only"""
+        base_offset = self.__container.create_extent(self.__id, self.__pool_size)
+        self.__container.mmap_object[
+            base_offset : base_offset + self.__pool_allocate_offset_header
+        ] = self.__encode_header(self.__pool_allocate_offset_header)
+
+    def __load(self):
+        """
+        read allocate offset from header and open mmap if pool is not mapped,
+        return mapping, callers keep it alive even if pool is unmapped meanwhile
+        """
+        mapping = self.__mapping()
+        if not (self.__loaded and mapping is not None):
+            with self.__lock:
+                if not self.__loaded:
+                    self.__map()
+                mapping = self.__mapping()
+        self.__access_count += 1
+        self.__last_access_time = time.monotonic()
+        if self.__mapping_cache is not None:
+            self.__mapping_cache.touch(self)
+        return mapping
+
+    def __map(self):
+        """caller should hold the lock"""
+        if self.__container is not None:
+            self.__base_offset, self.__pool_size = self.__container.extent(self.__id)
+            self.__pool_max_size = self.__pool_size
+        else:
+            # mmap keeps its own reference of file, so descriptor could be closed
+            fd = os.open(self.__filepath, os.O_RDWR)
+            try:
+                self.__mmap_object = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            self.__pool_size = len(self.__mmap_object)
+            self.__pool_max_size = max(self.__pool_max_size, self.__pool_size)
+        self.__advise_mapping()
+        header = self.__mapping()[
+            self.__base_offset : self.__base_offset + self.__pool_allocate_offset_header
+        ]
+        self.__pool_allocate_offset = self.__decode_header(header)
+        if self.__pool_allocate_offset < self.__allocate_offset_floor:
+            # stale header is rewritten on next flush
+            self.__pool_allocate_offset = self.__allocate_offset_floor
+            self.__mark_header_dirty()
+        # publish last, it marks pool as loaded
+        self.__loaded = True
+
+    def __mapping(self):
+        """container's mmap could be replaced when container grows"""
+        if self.__container is not None:
+            return self.__container.mmap_object
+        return self.__mmap_object
+
+    def __grow(self, required_size):
+        """
+        extend file and mmap, size is doubled at least to amortize remapping,
+        caller should hold the lock
+        """
+        new_size = min(self.__pool_max_size, max(required_size, self.__pool_size * 2))
+        fd = os.open(self.__filepath, os.O_RDWR)
+        try:
+            if self.__pool_preallocate == "fallocate" and hasattr(
+                os, "posix_fallocate"
+            ):
+                os.posix_fallocate(fd, self.__pool_size, new_size - self.__pool_size)
+            else:
+                os.ftruncate(fd, new_size)
+            try:
+                self.__mmap_object.resize(new_size)
+            except (BufferError, SystemError):
+                # readers still hold views of old mapping, it can not be moved, so
+                # map file again and leave old mapping to be freed with its views
+                self.__mmap_object = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self.__pool_size = new_size
+        self.__advise_mapping()
+
+    def __advise_mapping(self):
+        if self.__mmap_advice is not None:
+            self.__advise(self.__mapping(), self.__mmap_advice, 0, self.__pool_size)
+
+    def __advise(self, mapping, advice, offset, length):
+        """madvise pool range, offset is absolute in pool"""
+        start = self.__base_offset + offset
+        aligned_start = start - start % mmap.PAGESIZE
+        try:
+            mapping.madvise(advice, aligned_start, length + start - aligned_start)
+        except (OSError, ValueError):
+            # mapping could be shorter, e.g. replaced meanwhile, hints are optional
+            pass
+
+    def __readahead(self, mapping, offset, end_offset):
+        """
+        advise range ahead of a scan, a read which starts inside last read or at
+        most a page after it continues it
+        """
+        last_read, self.__last_read = self.__last_read, (offset, end_offset)
+        if last_read is None or not (
+            last_read[0] <= offset <= last_read[1] + mmap.PAGESIZE
+        ):
+            self.__readahead_streak = 1
+            self.__readahead_window = 0
+            return
+        self.__readahead_streak += 1
+        if self.__readahead_streak < READAHEAD_STREAK:
+            return
+        if self.__readahead_window == 0:
+            self.__readahead_window = max(mmap.PAGESIZE, self.__readahead_size // 8)
+            self.__readahead_end = end_offset
+        # advise next window when scan reaches half of advised range
+        if end_offset + self.__readahead_window // 2 < self.__readahead_end:
+            return
+        start = max(end_offset, self.__readahead_end)
+        end = min(start + self.__readahead_window, self.__pool_allocate_offset)
+        if start < end:
+            self.__advise(mapping, mmap.MADV_WILLNEED, start, end - start)
+            self.__readahead_count += 1
+            self.__readahead_end = end
+        self.__readahead_window = min(
+            self.__readahead_window * 2, self.__readahead_size
+        )
+
+    def __encode_header(self, offset):
+        if self.__pool_header_format == "binary":
+            offset_bytes = struct.pack("<Q", offset)
+            return BINARY_HEADER.pack(offset, zlib.crc32(offset_bytes)).ljust(
+                self.__pool_allocate_offset_header, b"\x00"
+            )
+        return ("%0{}d".format(self.__pool_allocate_offset_header) % offset).encode(
+            "utf-8"
+        )
+
+    def __decode_header(self, header):
+        # data starts after header, so a pool whose header is not readable with
+        # this conf is rejected rather than guessed, a stale header is still
+        # valid and it is raised to floor from block table
+        if self.__pool_header_format == "binary":
+            offset, checksum = BINARY_HEADER.unpack_from(header)
+            valid = zlib.crc32(header[:8]) == checksum and offset <= self.__pool_size
         else:
-            with open(filepath, "rb") as f:
-                bytes = int(f.read(self.__pool_allocate_offset_header))
-                self.__pool_allocate_offset = bytes
-        # open mmap
-        self.__mmap_object = mmap.mmap(os.open(filepath, os.O_RDWR), 0)
+            valid = bytes(header).isdigit()
+            offset = int(header) if valid else 0
+        assert valid, (
+            "{} has no valid {} header of {} bytes, it may be created with another "
+            "POOL_HEADER_FORMAT or POOL_ALLOCATE_OFFSET_HEADER".format(
+                self.__filepath,
+                self.__pool_header_format,
+                self.__pool_allocate_offset_header,
+            )
+        )
+        return offset
+
+    def set_allocate_offset_floor(self, offset):
+        """
+        recovery hook, allocated ranges recorded in block table should never be
+        handed out again even if header is stale
+        """
+        with self.__lock:
+            self.__allocate_offset_floor = max(self.__allocate_offset_floor, offset)
+            if self.__loaded and (
+                self.__pool_allocate_offset < self.__allocate_offset_floor
+            ):
+                self.__pool_allocate_offset = self.__allocate_offset_floor
+                self.__write_header()
+
+    def flush_header(self):
+        """write deferred allocate offset into header"""
+        with self.__lock:
+            if self.__header_dirty and self.__loaded:
+                self.__write_header()
+
+    def __write_header(self):
+        self.__mapping()[
+            self.__base_offset : self.__base_offset + self.__pool_allocate_offset_header
+        ] = self.__encode_header(self.__pool_allocate_offset)
+        self.__header_dirty = False
+        self.__mark_dirty(0, self.__pool_allocate_offset_header)
+
+    def __mark_dirty(self, start, end):
+        """caller should hold the lock"""
+        if self.__dirty_range is not None:
+            start = min(start, self.__dirty_range[0])
+            end = max(end, self.__dirty_range[1])
+        self.__dirty_range = (start, end)
+        if self.__dirty_pools is not None:
+            self.__dirty_pools.add(self)
+
+    def __mark_header_dirty(self):
+        """caller should hold the lock"""
+        self.__header_dirty = True
+        if self.__dirty_pools is not None:
+            self.__dirty_pools.add(self)
+
+    def track_dirty(self, dirty_pools):
+        """
+        pool adds itself to `dirty_pools` whenever its header or a written range
+        should be flushed, so `flush_header` and `sync` are called on it
+        """
+        with self.__lock:
+            self.__dirty_pools = dirty_pools
+            if self.__header_dirty or self.__dirty_range is not None:
+                dirty_pools.add(self)
+
+    def sync(self):
+        """
+        write deferred header and msync range written since last sync, pool which
+        is unmapped meanwhile is flushed by fsync
+        """
+        with self.__lock:
+            if self.__header_dirty and self.__loaded:
+                self.__write_header()
+            dirty_range, self.__dirty_range = self.__dirty_range, None
+            mapping = self.__mapping() if self.__loaded else None
+        if dirty_range is None:
+            return
+        if mapping is None:
+            fd = os.open(self.__filepath, os.O_RDWR)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            return
+        # msync range should start at a page boundary
+        start = self.__base_offset + dirty_range[0]
+        start -= start % mmap.ALLOCATIONGRANULARITY
+        mapping.flush(start, self.__base_offset + dirty_range[1] - start)
+
+    @property
+    def loaded(self):
+        return self.__loaded
 
     @property
     def pool_id(self):
@@ -60,60 +415,209 @@ class MemoryPool(object):
 
     @property
     def pool_allocate_offset(self):
+        self.__load()
         return self.__pool_allocate_offset
 
     @property
     def pool_allocate_limit(self):
-        return self.__pool_size - self.__pool_allocate_offset
+        self.__load()
+        return self.__pool_max_size - self.__pool_allocate_offset
+
+    @property
+    def pool_size(self):
+        self.__load()
+        return self.__pool_size
+
+    @property
+    def pool_max_size(self):
+        self.__load()
+        return self.__pool_max_size
+
+    @property
+    def data_filepath(self):
+        """file holding pool bytes, pools in a container live in container file"""
+        if self.__container is not None:
+            return self.__container.filepath
+        return self.__filepath
+
+    @property
+    def base_offset(self):
+        """offset of pool inside its file, it is not 0 for pools in a container"""
+        self.__load()
+        return self.__base_offset
 
     @property
     def pool_allocate_offset_header(self):
         return self.__pool_allocate_offset_header
 
+    @property
+    def readahead_count(self):
+        """number of ranges advised ahead of scans"""
+        return self.__readahead_count
+
+    @property
+    def access_count(self):
+        return self.__access_count
+
+    @property
+    def last_access_time(self):
+        """`time.monotonic` of last access, or of creation if it is never accessed"""
+        return self.__last_access_time
+
     def allocate(self, size):
         assert size > 0, "memory allocated should be greater than zero"
-        assert self.__pool_allocate_offset + size <= self.__pool_size
-        segment = MemorySegment(
-            self, self.__pool_allocate_offset, self.__pool_allocate_offset + size, size
-        )
-        self.__pool_allocate_offset += size
-        self.__mmap_object.seek(0)
-        self.__mmap_object.write(
-            (
-                "%0{}d".format(self.__pool_allocate_offset_header)
-                % self.__pool_allocate_offset
-            ).encode("utf-8")
-        )
+        self.__load()
+        with self.__lock:
+            # pool could be unmapped after it is loaded
+            if not self.__loaded:
+                self.__map()
+            assert self.__pool_allocate_offset + size <= self.__pool_max_size
+            if self.__pool_allocate_offset + size > self.__pool_size:
+                self.__grow(self.__pool_allocate_offset + size)
+            segment = MemorySegment(
+                self,
+                self.__pool_allocate_offset,
+                self.__pool_allocate_offset + size,
+                size,
+            )
+            self.__pool_allocate_offset += size
+            if self.__pool_header_deferred:
+                self.__mark_header_dirty()
+            else:
+                self.__write_header()
         return segment
 
     def write(self, offset, byte_data):
-        assert isinstance(byte_data, bytes)
+        assert isinstance(byte_data, (bytes, memoryview))
+        # counted before mapping is taken, so a write never goes into a mapping
+        # which is moved meanwhile, see `move_to`
+        with self.__lock:
+            self.__write_count += 1
+        try:
+            mapping = self.__load()
+            assert (
+                offset >= self.__pool_allocate_offset_header
+                and offset + len(byte_data) <= self.__pool_allocate_offset
+            )
+            start = self.__base_offset + offset
+            mapping[start : start + len(byte_data)] = byte_data
+        except BaseException:
+            with self.__lock:
+                self.__written_count += 1
+            raise
+        # data goes first, so a concurrent `sync` never drops an unwritten range
+        with self.__lock:
+            self.__mark_dirty(offset, offset + len(byte_data))
+            self.__written_count += 1
+
+    def read(self, offset, length, skip_header=True):
+        mapping = self.__load()
+        if skip_header:
+            offset += self.__pool_allocate_offset_header
         assert (
             offset >= self.__pool_allocate_offset_header
-            and offset + len(byte_data) <= self.__pool_allocate_offset
+            and offset < self.__pool_allocate_offset
+        ), "Legal read offset range is (%d -> %d), given offset is %d".format(
+            self.__pool_allocate_offset_header, self.__pool_allocate_offset - 1, offset
         )
+        limit = self.__pool_allocate_offset - offset
+        offset += self.__base_offset
+        return mapping[offset : offset + min(length, limit)]
 
-        self.__mmap_object.seek(offset)
-        self.__mmap_object.write(byte_data)
-
-    def read(self, offset, length, skip_header=True):
+    def read_view(self, offset, length, skip_header=True):
+        """
+        same as `read`, but return a memoryview slice of mmap instead of a copy,
+        view should be released before pool is closed
+        """
+        mapping = self.__load()
         if skip_header:
             offset += self.__pool_allocate_offset_header
         assert (
             offset >= self.__pool_allocate_offset_header
             and offset < self.__pool_allocate_offset
-        ), "Legal read offset range is (%d -> %d), given offset is %d".format(
+        ), "Legal read offset range is ({} -> {}), given offset is {}".format(
             self.__pool_allocate_offset_header, self.__pool_allocate_offset - 1, offset
         )
-        self.__mmap_object.seek(offset)
         limit = self.__pool_allocate_offset - offset
-        return self.__mmap_object.read(min(length, limit))
+        if self.__readahead_size and hasattr(mmap, "MADV_WILLNEED"):
+            self.__readahead(mapping, offset, offset + min(length, limit))
+        offset += self.__base_offset
+        return memoryview(mapping)[offset : offset + min(length, limit)]
+
+    def unmap(self):
+        """
+        drop mmap after header is flushed, mapping goes away once no reader holds
+        it, pool would be mapped again on next access, return if it is unmapped
+        """
+        with self.__lock:
+            if not self.__loaded or self.__container is not None:
+                return False
+            if self.__header_dirty:
+                self.__write_header()
+            # loaded flag goes first, see `__load`
+            self.__loaded = False
+            self.__mmap_object = None
+        return True
+
+    def copy_to(self, filepath):
+        """
+        copy allocated bytes into a new file next to `filepath` and leave rest of
+        it sparse, writers are not blocked meanwhile, return token for `move_to`,
+        or None if a write is in progress
+        """
+        assert self.__container is None, "pool inside container could not be moved"
+        mapping = self.__load()
+        with self.__lock:
+            if self.__write_count != self.__written_count:
+                return None
+            if self.__header_dirty:
+                self.__write_header()
+            token = (self.__write_count, self.__pool_allocate_offset)
+            pool_size = self.__pool_size
+        with open(filepath + ".tmp", "wb") as pool_f, memoryview(mapping) as view:
+            pool_f.write(view[: token[1]])
+            pool_f.truncate(pool_size)
+            pool_f.flush()
+            os.fsync(pool_f.fileno())
+        return token
+
+    def move_to(self, filepath, token):
+        """
+        swap in copy made by `copy_to` if pool is neither written nor allocated
+        from since, pool is mapped from new file on next access, readers holding
+        old mapping keep working, return if pool is moved, otherwise copy is
+        removed, a None token just removes it
+        """
+        tmp_filepath = filepath + ".tmp"
+        with self.__lock:
+            moved = token is not None and token == (
+                self.__write_count,
+                self.__pool_allocate_offset,
+            )
+            if moved:
+                os.rename(tmp_filepath, filepath)
+                old_filepath = self.__filepath
+                self.__filepath = filepath
+                # loaded flag goes first, see `__load`
+                self.__loaded = False
+                self.__mmap_object = None
+        os.remove(old_filepath if moved else tmp_filepath)
+        return moved
 
     def close(self):
         """
-        close mmap object
+        close mmap object, pool would be loaded again on next access, mmap of
+        container is shared and left to container
         """
-        self.__mmap_object.close()
+        self.flush_header()
+        if self.__mmap_object is not None:
+            try:
+                self.__mmap_object.close()
+            except BufferError:
+                # a value loaded out of band views mapping, it goes away with value
+                pass
+            self.__mmap_object = None
+        self.__loaded = False
 
     def __extract_pool_id_from_filepath(self):
         match_result = re.search("pool_(\d+)", self.__filepath)
@@ -124,7 +628,7 @@ class MemoryPool(object):
 
     def __str__(self):
         return "filepath is: {}, pool allocate offset: {}, pool size: {}".format(
-            self.__filepath, self.__pool_allocate_offset, self.__pool_size
+            self.__filepath, self.pool_allocate_offset, self.__pool_size
         )
 
     def __repr__(self):
@@ -132,13 +636,33 @@ class MemoryPool(object):
 
     def __getstate__(self):
         current_state = self.__dict__.copy()
-        # exclude mmap in pickle
+        # exclude mmap, lock and manager's dirty set in pickle
         del current_state["_MemoryPool__mmap_object"]
+        del current_state["_MemoryPool__lock"]
+        del current_state["_MemoryPool__dirty_pools"]
         return current_state
 
     def __setstate__(self, state):
+        # pools pickled by older versions miss newer attributes, settings are
+        # read from their conf and the rest starts from defaults
+        self.__conf = state["_MemoryPool__conf"]
+        self.__pool_allocate_offset_header = state[
+            "_MemoryPool__pool_allocate_offset_header"
+        ]
+        self.__pool_max_size = state["_MemoryPool__pool_size"]
+        self.__container = None
+        self.__base_offset = 0
+        self.__mapping_cache = None
+        self.__dirty_pools = None
+        self.__access_count = 0
+        self.__allocate_offset_floor = self.__pool_allocate_offset_header
+        self.__configure()
         self.__dict__.update(state)
-        # construct mmap again
-        self.__dict__["_MemoryPool__mmap_object"] = mmap.mmap(
-            os.open(state["_MemoryPool__filepath"], os.O_RDWR), 0
+        # mmap and allocate offset will be loaded from file on first access
+        self.__reset_runtime_state()
+        # a deferred header could be older than pickled allocate offset, which
+        # is kept as floor so allocated ranges are never handed out again
+        self.__allocate_offset_floor = max(
+            self.__allocate_offset_floor,
+            state.get("_MemoryPool__pool_allocate_offset", 0),
         )
@@ -0,0 +1,150 @@
+import mmap
+import os
+import struct
+import threading
+
+# container header: magic, end offset of last extent
+CONTAINER_MAGIC = b"KVPOOLC1"
+CONTAINER_HEADER = struct.Struct("<8sQ")
+# extent header precedes pool bytes: pool id, pool size
+EXTENT_HEADER = struct.Struct("<QQ")
+# pool id of an extent whose pool is deleted
+FREE_EXTENT = 2**64 - 1
+
+
+class PoolContainer(object):
+    """
+    Keep all pools as extents of one data file, mapped by a single mmap
+
+    Extents are appended in pool creation order, so opening container is one open,
+    one mmap and a walk over extent headers. Extent of a deleted pool is reused by
+    a new pool of the same size after container is opened again, readers could
+    still hold views of it until then. File is extended by doubling, mmap is
+    resized, or mapped again if views of it are still exported, so pools should
+    always access it through `mmap_object`.
+    """
+
+    def __init__(self, filepath):
+        self._filepath = filepath
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        fd = os.open(self._filepath, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.write(
+                    fd, CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_HEADER.size)
+                )
+            self._mmap_object = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, self._end_offset = CONTAINER_HEADER.unpack_from(self._mmap_object)
+        assert magic == CONTAINER_MAGIC, "{} is not a pool container".format(
+            self._filepath
+        )
+        # pool id -> (pool offset, pool size)
+        self._extents = {}
+        # (extent header offset, pool size) of deleted pools
+        self._free_extents = []
+        offset = CONTAINER_HEADER.size
+        while offset < self._end_offset:
+            pool_id, pool_size = EXTENT_HEADER.unpack_from(self._mmap_object, offset)
+            if pool_id == FREE_EXTENT:
+                self._free_extents.append((offset, pool_size))
+            else:
+                self._extents[pool_id] = (offset + EXTENT_HEADER.size, pool_size)
+            offset += EXTENT_HEADER.size + pool_size
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def mmap_object(self):
+        return self._mmap_object
+
+    def pool_ids(self):
+        return sorted(self._extents)
+
+    def has_extent(self, pool_id):
+        return pool_id in self._extents
+
+    def extent(self, pool_id):
+        """return (pool offset, pool size)"""
+        return self._extents[pool_id]
+
+    def create_extent(self, pool_id, pool_size):
+        """reserve an extent for pool, return offset of pool inside container"""
+        with self._lock:
+            assert pool_id not in self._extents, "pool {} already exists".format(
+                pool_id
+            )
+            for index, (offset, free_size) in enumerate(self._free_extents):
+                if free_size == pool_size:
+                    del self._free_extents[index]
+                    break
+            else:
+                offset = self._end_offset
+                self._reserve(offset + EXTENT_HEADER.size + pool_size)
+            EXTENT_HEADER.pack_into(self._mmap_object, offset, pool_id, pool_size)
+            # end offset is moved after extent header is written, a torn append
+            # only loses an empty pool
+            if offset == self._end_offset:
+                self._end_offset += EXTENT_HEADER.size + pool_size
+                CONTAINER_HEADER.pack_into(
+                    self._mmap_object, 0, CONTAINER_MAGIC, self._end_offset
+                )
+            self._extents[pool_id] = (offset + EXTENT_HEADER.size, pool_size)
+            return offset + EXTENT_HEADER.size
+
+    def delete_extent(self, pool_id):
+        """mark extent of pool as free"""
+        with self._lock:
+            pool_offset, pool_size = self._extents.pop(pool_id)
+            EXTENT_HEADER.pack_into(
+                self._mmap_object,
+                pool_offset - EXTENT_HEADER.size,
+                FREE_EXTENT,
+                pool_size,
+            )
+
+    def _reserve(self, size):
+        """make sure file and mmap are at least `size` bytes, caller holds lock"""
+        if size <= len(self._mmap_object):
+            return
+        new_size = max(size, len(self._mmap_object) * 2)
+        fd = os.open(self._filepath, os.O_RDWR)
+        try:
+            os.ftruncate(fd, new_size)
+            try:
+                self._mmap_object.resize(new_size)
+            except (BufferError, SystemError):
+                # old mapping is freed once readers release their views
+                self._mmap_object = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        try:
+            self._mmap_object.close()
+        except BufferError:
+            # a value loaded out of band views mapping, it goes away with value
+            pass
+
+    def __str__(self):
+        return "filepath is: {}, pools: {}, end offset: {}".format(
+            self._filepath, len(self._extents), self._end_offset
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __getstate__(self):
+        # extents are read from file again
+        return {"_filepath": self._filepath}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._open()
@@ -0,0 +1,164 @@
+import pickle
+import struct
+
+# pickled values start with PROTO opcode, they carry no extra tag
+PICKLE_TAG = 0x80
+BYTES_TAG = 0x10
+BYTEARRAY_TAG = 0x11
+# pickle stream whose large buffers follow it out of band
+PICKLE_BUFFERS_TAG = 0x12
+INT_TAG = 0x20
+FLOAT_TAG = 0x21
+STR_TAG = 0x30
+# tags from here up to PICKLE_TAG are free for registered serializers
+REGISTERED_TAG_START = 0x40
+INT_FORMAT = struct.Struct("<q")
+FLOAT_FORMAT = struct.Struct("<d")
+# buffer count and pickle stream length, then length of every buffer
+PICKLE_BUFFERS_HEADER = struct.Struct("<IQ")
+PICKLE_BUFFER_LENGTH = struct.Struct("<Q")
+
+
+class Serializer(object):
+    """
+    Type tagged serialization of values
+
+    A serialized value starts with a tag byte of its serializer, types without a
+    serializer are pickled with protocol 5. Tags below 0x10 are reserved for value
+    codecs, tags from 0x40 to 0x7f are free for registered serializers. Serializers
+    are registered process wide, like `copyreg`, since a store should be read with
+    the serializers which wrote it.
+
+    Pickle buffers, like those of NumPy arrays or `PickleBuffer`, could be kept
+    out of band, they are written after pickle stream as they are and loaded as
+    read-only memoryviews of serialized data, so a value read from pool's mmap
+    views the mapping instead of a copy.
+    """
+
+    # value type -> (tag, dumps)
+    _type_serializers = {}
+    # tag -> loads
+    _tag_loaders = {}
+
+    @classmethod
+    def register(cls, tag, value_type, dumps, loads):
+        """
+        `dumps` turns a value of exactly `value_type` into bytes, or returns None to
+        pickle it instead, `loads` gets a memoryview which is valid only during call
+        """
+        assert 0x10 <= tag < PICKLE_TAG, "tag should be in [0x10, 0x80)"
+        assert cls._tag_loaders.get(tag, loads) is loads, "tag {} is taken".format(tag)
+        cls._type_serializers[value_type] = (tag, dumps)
+        cls._tag_loaders[tag] = loads
+
+    @classmethod
+    def dumps(cls, value):
+        return b"".join(cls.dump_parts(value))
+
+    @classmethod
+    def dump_parts(cls, value, buffer_threshold=0):
+        """
+        serialize value into a list of bytes-like parts, they are joined as a
+        serialized value, see `pickle_parts` for `buffer_threshold`
+        """
+        serializer = cls._type_serializers.get(type(value))
+        if serializer is not None:
+            tag, dumps = serializer
+            data = dumps(value)
+            if data is not None:
+                return [bytes((tag,)), data]
+        return cls.pickle_parts(value, buffer_threshold)
+
+    @staticmethod
+    def pickle_parts(value, buffer_threshold=0):
+        """
+        pickle value with protocol 5, contiguous pickle buffers of at least
+        `buffer_threshold` bytes are parts of their own instead of being copied
+        into pickle stream, 0 keeps all buffers in band
+        """
+        if not buffer_threshold:
+            return [pickle.dumps(value, protocol=5)]
+        buffers = []
+
+        def buffer_callback(buffer):
+            try:
+                raw_buffer = buffer.raw()
+            except BufferError:
+                # non contiguous buffer is copied in band
+                return True
+            if raw_buffer.nbytes < buffer_threshold:
+                return True
+            buffers.append(raw_buffer)
+            return False
+
+        data = pickle.dumps(value, protocol=5, buffer_callback=buffer_callback)
+        if not buffers:
+            return [data]
+        header = bytearray((PICKLE_BUFFERS_TAG,))
+        header += PICKLE_BUFFERS_HEADER.pack(len(buffers), len(data))
+        for buffer in buffers:
+            header += PICKLE_BUFFER_LENGTH.pack(buffer.nbytes)
+        return [bytes(header), data] + buffers
+
+    @classmethod
+    def loads(cls, data):
+        if data[0] == PICKLE_TAG:
+            return pickle.loads(data)
+        with memoryview(data)[1:] as payload:
+            return cls._tag_loaders[data[0]](payload)
+
+    @staticmethod
+    def _loads_pickle_buffers(data):
+        count, data_length = PICKLE_BUFFERS_HEADER.unpack_from(data)
+        offset = PICKLE_BUFFERS_HEADER.size + PICKLE_BUFFER_LENGTH.size * count
+        buffer_offset = offset + data_length
+        buffers = []
+        for position in range(count):
+            (length,) = PICKLE_BUFFER_LENGTH.unpack_from(
+                data, PICKLE_BUFFERS_HEADER.size + PICKLE_BUFFER_LENGTH.size * position
+            )
+            # slice views what `data` views, it outlives `data` being released
+            buffers.append(data[buffer_offset : buffer_offset + length].toreadonly())
+            buffer_offset += length
+        return pickle.loads(data[offset : offset + data_length], buffers=buffers)
+
+    @staticmethod
+    def _dumps_view(value):
+        return value.cast("B") if value.c_contiguous else value.tobytes()
+
+    @staticmethod
+    def _dumps_int(value):
+        # values out of 64 bits are pickled
+        if -(1 << 63) <= value < 1 << 63:
+            return INT_FORMAT.pack(value)
+        return None
+
+    @staticmethod
+    def _loads_int(data):
+        return INT_FORMAT.unpack(data)[0]
+
+    @staticmethod
+    def _loads_float(data):
+        return FLOAT_FORMAT.unpack(data)[0]
+
+    @staticmethod
+    def _dumps_str(value):
+        # lone surrogates are not utf-8, they are pickled
+        try:
+            return value.encode("utf-8")
+        except UnicodeEncodeError:
+            return None
+
+    @staticmethod
+    def _loads_str(data):
+        return str(data, "utf-8")
+
+
+Serializer.register(BYTES_TAG, bytes, bytes, bytes)
+Serializer.register(BYTEARRAY_TAG, bytearray, memoryview, bytearray)
+Serializer.register(BYTES_TAG, memoryview, Serializer._dumps_view, bytes)
+Serializer.register(INT_TAG, int, Serializer._dumps_int, Serializer._loads_int)
+Serializer.register(FLOAT_TAG, float, FLOAT_FORMAT.pack, Serializer._loads_float)
+Serializer.register(STR_TAG, str, Serializer._dumps_str, Serializer._loads_str)
+# not a registered serializer, pickle stream is the serialized type
+Serializer._tag_loaders[PICKLE_BUFFERS_TAG] = Serializer._loads_pickle_buffers
@@ -1,21 +1,18 @@
-from kv_index import KVIndex
+from kv_index import KVIndex, ValuePointer
+from value_record import ValueRecord
 import random
-import pickle
 
 
 class SkipListIndex(KVIndex):
     def __init__(self, memory_manager):
         self._memory_manager = memory_manager
         self._blocks = []
-        # value's length header, represents the byte array's length of value
-        self._value_header_length = (
-            int(
-                self._memory_manager.conf.get(
-                    "SKIPLIST_INDEX", "VALUE_HEADER_LENGTH", fallback=0
-                )
-            )
-            or 10
-        )
+        self._configure()
+        # dummy heads
+        self._heads = [SkipListNode(key=-1, value=-1)]
+
+    def _configure(self):
+        """read settings from conf"""
         # every time we need to allocate a new block, scale * target_memory would be allocated
         self._memory_allocate_scale = (
             int(
@@ -34,11 +31,25 @@ class SkipListIndex(KVIndex):
             )
             or 512
         )
-        # dummy heads
-        self._heads = [SkipListNode(key=-1, value=-1)]
+        # layout and compression of persisted values
+        self._value_record = ValueRecord(self._memory_manager, "SKIPLIST_INDEX")
 
     def set(self, key, value):
-        node_value = self._persist_value(value)
+        node_value = self._persist_value(key, value)
+        self._set_node_value(key, node_value)
+        return node_value
+
+    def restore(self, key, location):
+        if location is None:
+            self._remove_key(key)
+            return
+        block = self._memory_manager.block_dict[location[0]]
+        # block allocated after last checkpoint
+        if block not in self._blocks:
+            self.adopt_blocks([block])
+        self._set_node_value(key, SkipListNodeValue(*location))
+
+    def _set_node_value(self, key, node_value):
         predecessors = []
         current = self._heads[-1]
         while current:
@@ -83,6 +94,12 @@ class SkipListIndex(KVIndex):
         return default
 
     def remove(self, key):
+        result = self._remove_key(key)
+        if result and self._value_record.keyed:
+            self._write_marker(self._value_record.encode_tombstone(key))
+        return result
+
+    def _remove_key(self, key):
         current, predecessors, result = self._heads[-1], [], False
         while current:
             while current.right and current.right.key < key:
@@ -115,6 +132,32 @@ class SkipListIndex(KVIndex):
 
     def clear(self):
         self._heads = [SkipListNode(key=-1, value=-1)]
+        if self._value_record.keyed:
+            self._write_marker(self._value_record.encode_clear())
+
+    def entries(self):
+        current = self._heads[0]
+        while current.right:
+            yield current.right.key, current.right.value
+            current = current.right
+
+    def load_value(self, location):
+        return self._load_value(SkipListNodeValue(*location))
+
+    def live_values(self):
+        current, values = self._heads[0], []
+        while current.right:
+            values.append(
+                (current.right.value, self._record_length(current.right.value))
+            )
+            current = current.right
+        return values
+
+    def seal_blocks(self):
+        self._blocks = []
+
+    def adopt_blocks(self, blocks):
+        self._blocks.extend(blocks)
 
     def height(self):
         return len(self._heads)
@@ -137,17 +180,15 @@ class SkipListIndex(KVIndex):
         byte_array, offset = bytearray(), 0
         # rewind to start, then batch processing
         block.rewind(0)
+        # records are moved inside block, cached values of old addresses are stale
+        self._memory_manager.discard_values(block.block_id)
         for value in value_list:
-            header = block.read(value.address, self._value_header_length)
-            data_length = int(header)
+            record_length = self._value_record.record_length(block, value.address)
             # append header and data details
-            byte_array.extend(header)
-            byte_array.extend(
-                block.read(value.address + self._value_header_length, data_length)
-            )
+            byte_array.extend(block.read(value.address, record_length))
             # update memory node's address reference
             value.address = offset
-            offset += self._value_header_length + data_length
+            offset += record_length
             # spill data to disk
             if len(byte_array) > self._block_compact_buffer_length:
                 block.write(bytes(byte_array))
@@ -161,23 +202,21 @@ class SkipListIndex(KVIndex):
             level += 1
         return level
 
-    def _persist_value(self, value):
+    def _persist_value(self, key, value):
         """persist value to disk"""
-        string = pickle.dumps(value)
-        length = len(string)
-
-        byte_array = bytearray()
-        byte_array.extend(
-            ("%0{}d".format(self._value_header_length) % length).encode("utf-8")
+        return SkipListNodeValue(
+            *self._write_record(self._value_record.encode(key, value))
         )
-        byte_array.extend(string)
 
+    def _write_record(self, parts):
+        """write record parts into best fit block, return (block id, address)"""
+        record_length = self._value_record.length(parts)
         # find appropriate block, use linear algorithm here. since the total number of blocks
         # should not be too huge, that means this algorithm is okay in most cases
         closest_diff, index = -1, -1
         for ind, block in enumerate(self._blocks):
-            if block.free_memory >= len(byte_array):
-                remain = block.free_memory - len(byte_array)
+            if block.free_memory >= record_length:
+                remain = block.free_memory - record_length
                 if remain < closest_diff or closest_diff < 0:
                     closest_diff = remain
                     index = ind
@@ -187,25 +226,35 @@ class SkipListIndex(KVIndex):
         else:
             # if all blocks are full
             current_block = self._memory_manager.allocate_block(
-                len(byte_array) * self._memory_allocate_scale
+                record_length * self._memory_allocate_scale
             )
             self._blocks.append(current_block)
 
         block_id, address = (current_block.block_id, current_block.current_offset)
-        write_bytes = current_block.write(bytes(byte_array))
+        write_bytes = sum(map(current_block.write, parts))
 
-        assert write_bytes == len(byte_array)
+        assert write_bytes == record_length
 
-        return SkipListNodeValue(block_id, address)
+        return block_id, address
+
+    def _record_length(self, node_value):
+        block_id, address = node_value.location
+        block = self._memory_manager.block_dict[block_id]
+        return self._value_record.record_length(block, address)
 
     def _load_value(self, node_value):
         """load value from disk"""
         assert isinstance(node_value, SkipListNodeValue)
-        block = self._memory_manager.block_dict[node_value.block_id]
-        length = int(block.read(node_value.address, self._value_header_length))
-        data = block.read(node_value.address + self._value_header_length, length)
-        value = pickle.loads(data)
-        return value
+        block_id, address = node_value.location
+        block = self._memory_manager.block_dict[block_id]
+        return self._value_record.load(block, address)
+
+    def __setstate__(self, state):
+        # settings missing from indexes pickled by older versions are read from
+        # conf, pickled ones take precedence
+        self._memory_manager = state["_memory_manager"]
+        self._configure()
+        self.__dict__.update(state)
 
 
 class SkipListNode(object):
@@ -239,10 +288,6 @@ class SkipListNode(object):
         print(", ".join(result))
 
 
-class SkipListNodeValue(object):
-    def __init__(self, block_id, address):
-        self.block_id = block_id
-        self.address = address
-
+class SkipListNodeValue(ValuePointer):
     def __str__(self):
         return "({}, {})".format(self.block_id, self.address)
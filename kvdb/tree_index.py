@@ -1,7 +1,7 @@
 from collections import deque
-import pickle
 
-from kv_index import KVIndex
+from kv_index import KVIndex, ValuePointer
+from value_record import ValueRecord
 
 
 class TreeIndex(KVIndex):
@@ -9,14 +9,11 @@ class TreeIndex(KVIndex):
         self._memory_manager = memory_manager
         self._current_block = None
         self._root = None
-        self._value_header_length = (
-            int(
-                self._memory_manager.conf.get(
-                    "TREE_INDEX", "VALUE_HEADER_LENGTH", fallback=0
-                )
-            )
-            or 10
-        )
+        self._configure()
+        self._index_history = []
+
+    def _configure(self):
+        """read settings from conf"""
         self._memory_allocate_scale = (
             int(
                 self._memory_manager.conf.get(
@@ -25,7 +22,8 @@ class TreeIndex(KVIndex):
             )
             or 10
         )
-        self._index_history = []
+        # layout and compression of persisted values
+        self._value_record = ValueRecord(self._memory_manager, "TREE_INDEX")
 
     def set(self, key, value):
         node = self._set_traverse(self._root, key, value)
@@ -71,6 +69,12 @@ class TreeIndex(KVIndex):
         return default
 
     def remove(self, key):
+        result = self._remove_key(key)
+        if result and self._value_record.keyed:
+            self._write_marker(self._value_record.encode_tombstone(key))
+        return result
+
+    def _remove_key(self, key):
         node, result = self._remove_traverse(self._root, key)
         self._update_node(node)
         return result
@@ -141,7 +145,7 @@ class TreeIndex(KVIndex):
             node = queue.popleft()
             # if we need to persist current node's value, create a new tree node
             if not isinstance(node.value, TreeValue):
-                node.value = self._persist_value_to_disk(node.value)
+                node.value = self._persist_value_to_disk(node.key, node.value)
                 total += 1
             if node.left:
                 queue.append(node.left)
@@ -194,6 +198,19 @@ class TreeIndex(KVIndex):
                 node = node.left
         return pairs
 
+    def entries(self):
+        stack, node = [], self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.key, node.value
+            node = node.right
+
+    def load_value(self, location):
+        return self._load_value_from_disk(TreeValue(*location))
+
     def _checkout_version(self, version):
         assert version >= 0 and version < len(self._index_history)
         index = TreeIndex(self._memory_manager)
@@ -205,49 +222,81 @@ class TreeIndex(KVIndex):
 
     def clear(self):
         self._root = None
+        if self._value_record.keyed:
+            self._write_marker(self._value_record.encode_clear())
 
-    def _persist_value_to_disk(self, value):
-        """value -> TreeValue"""
-        value_string = pickle.dumps(value)
-        length = len(value_string)
+    def restore(self, key, location):
+        if location is None:
+            self._remove_key(key)
+        else:
+            self.set(key, TreeValue(*location))
 
-        byte_array = bytearray()
-        byte_array.extend(
-            ("%0{}d".format(self._value_header_length) % length).encode("utf-8")
-        )
-        byte_array.extend(value_string)
+    def live_values(self):
+        """persisted values reachable from current tree and all history versions"""
+        values, visited = {}, set()
+        stack = [self._root] + self._index_history
+        while stack:
+            node = stack.pop()
+            if node is None or id(node) in visited:
+                continue
+            visited.add(id(node))
+            if isinstance(node.value, TreeValue):
+                values[id(node.value)] = node.value
+            stack.append(node.left)
+            stack.append(node.right)
+        return [(value, self._record_length(value)) for value in values.values()]
 
+    def seal_blocks(self):
+        self._current_block = None
+
+    def _record_length(self, tree_value):
+        block_id, address = tree_value.location
+        block = self._memory_manager.block_dict[block_id]
+        return self._value_record.record_length(block, address)
+
+    def _persist_value_to_disk(self, key, value):
+        """value -> TreeValue"""
+        return TreeValue(*self._write_record(self._value_record.encode(key, value)))
+
+    def _write_record(self, parts):
+        """append record parts to current block, return (block id, address)"""
+        record_length = self._value_record.length(parts)
         # current block's capacity is not enough
         if (
             self._current_block is None
-            or len(byte_array) > self._current_block.free_memory
+            or record_length > self._current_block.free_memory
         ):
             self._current_block = self._memory_manager.allocate_block(
-                len(byte_array) * self._memory_allocate_scale
+                record_length * self._memory_allocate_scale
             )
 
         block_id, address = (
             self._current_block.block_id,
             self._current_block.current_offset,
         )
-        self._current_block.write(bytes(byte_array))
-        return TreeValue(block_id, address)
+        for part in parts:
+            self._current_block.write(part)
+        return block_id, address
 
     def _load_value_from_disk(self, tree_value):
         """tree_value -> original object"""
         assert isinstance(tree_value, TreeValue)
-        block = self._memory_manager.block_dict[tree_value.block_id]
-        # fetch object length first
-        length = int(block.read(tree_value.address, self._value_header_length))
-        # then fetch object directly
-        bytes = block.read(tree_value.address + self._value_header_length, length)
-        return pickle.loads(bytes)
+        block_id, address = tree_value.location
+        block = self._memory_manager.block_dict[block_id]
+        return self._value_record.load(block, address)
 
     def _update_node(self, node):
         if node != self._root:
             self._index_history.append(node)
             self._root = node
 
+    def __setstate__(self, state):
+        # settings missing from indexes pickled by older versions are read from
+        # conf, pickled ones take precedence
+        self._memory_manager = state["_memory_manager"]
+        self._configure()
+        self.__dict__.update(state)
+
 
 class TreeNode(object):
     def __init__(self, key, value, left=None, right=None):
@@ -265,11 +314,7 @@ class TreeNode(object):
         return self.__str__()
 
 
-class TreeValue(object):
-    def __init__(self, block_id, address):
-        self.block_id = block_id
-        self.address = address
-
+class TreeValue(ValuePointer):
     def __str__(self):
         return "block id: {}, address: {}".format(self.block_id, self.address)
 
@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+
+# returned by `get` when value is not cached, None could be a cached value
+CACHE_MISS = object()
+
+
+class ValueCache(object):
+    """
+    LRU of decoded values keyed by (block id, address) of their records, shared by
+    all indexes of a memory manager
+
+    Size of a value is the length of its serialized value, least recently used
+    values are evicted when cached size is above `limit`. Records are append only,
+    an overwritten value gets a new address, so an entry goes stale only when its
+    range is reused, the manager discards entries of released, freed or rewound
+    blocks. Cached values are shared by readers, like values kept in memory by an
+    index, they should not be mutated. A hit only moves entry to the end without
+    locking.
+    """
+
+    def __init__(self, limit):
+        assert limit > 0, "cache size should be positive"
+        self._limit = limit
+        # (block id, address) -> (value, size), least recently used first
+        self._entries = OrderedDict()
+        # block id -> addresses of its cached values
+        self._block_addresses = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        # a value loaded before a discard could be stale, it is not cached
+        self._epoch = 0
+        self._hit_count = 0
+        self._miss_count = 0
+        self._evicted_count = 0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def epoch(self):
+        """read before loading a value, then given to `put`"""
+        return self._epoch
+
+    @property
+    def hit_count(self):
+        return self._hit_count
+
+    @property
+    def miss_count(self):
+        return self._miss_count
+
+    @property
+    def evicted_count(self):
+        return self._evicted_count
+
+    def get(self, block_id, address):
+        """return cached value, or `CACHE_MISS`"""
+        key = (block_id, address)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._miss_count += 1
+            return CACHE_MISS
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            # evicted meanwhile, value is still valid
+            pass
+        self._hit_count += 1
+        return entry[0]
+
+    def put(self, block_id, address, value, size, epoch):
+        # values larger than cache would evict everything else
+        if size > self._limit:
+            return
+        key = (block_id, address)
+        with self._lock:
+            if epoch != self._epoch or key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self._block_addresses.setdefault(block_id, set()).add(address)
+            self._size += size
+            while self._size > self._limit:
+                (cold_block_id, cold_address), (_, cold_size) = self._entries.popitem(
+                    last=False
+                )
+                self._remove_address(cold_block_id, cold_address)
+                self._size -= cold_size
+                self._evicted_count += 1
+
+    def discard(self, block_id, start_offset=0, end_offset=None):
+        """drop values whose records start in [start offset, end offset) of block"""
+        with self._lock:
+            self._epoch += 1
+            for address in list(self._block_addresses.get(block_id, ())):
+                if address >= start_offset and (
+                    end_offset is None or address < end_offset
+                ):
+                    _, size = self._entries.pop((block_id, address))
+                    self._remove_address(block_id, address)
+                    self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._block_addresses.clear()
+            self._size = 0
+
+    def _remove_address(self, block_id, address):
+        addresses = self._block_addresses[block_id]
+        addresses.discard(address)
+        if not addresses:
+            del self._block_addresses[block_id]
+
+    def __str__(self):
+        return "cached values: {}, size: {}, limit: {}, hits: {}, misses: {}".format(
+            len(self._entries),
+            self._size,
+            self._limit,
+            self._hit_count,
+            self._miss_count,
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __getstate__(self):
+        # values are loaded again after unpickle
+        return {"_limit": self._limit}
+
+    def __setstate__(self, state):
+        self.__init__(state["_limit"])
@@ -0,0 +1,219 @@
+import bz2
+import lzma
+import pickle
+import struct
+import zlib
+
+from serializer import PICKLE_BUFFERS_TAG, Serializer
+from value_cache import CACHE_MISS
+
+KEYED_RECORD_MAGIC = b"KR"
+# keyed record header: magic, flags, sequence number, key length, value length,
+# crc32 of pickled key and value which follow it
+KEYED_RECORD_HEADER = struct.Struct("<2sBQIII")
+# key is removed, record has no value
+RECORD_TOMBSTONE = 1
+# all records with a smaller sequence number are removed, record has no key
+RECORD_CLEAR = 2
+# codec id -> (name, compress, decompress), a compressed value starts with its
+# codec id, a serialized value starts with a serializer tag or PROTO opcode 0x80,
+# which are never a codec id, so they are told apart
+VALUE_CODECS = {
+    1: ("zlib", zlib.compress, zlib.decompress),
+    2: ("lzma", lzma.compress, lzma.decompress),
+    3: ("bz2", bz2.compress, bz2.decompress),
+}
+
+
+class ValueRecord(object):
+    """
+    Layout of persisted values
+
+    A plain record is `[length header][pickle(value)]`, length header is decimal
+    digits. A keyed record is self describing, it carries key, sequence number and
+    flags, so an index could be rebuilt from blocks alone. Both are readable,
+    keyed record starts with a magic which is not a digit.
+
+    Values are pickled, or serialized by `Serializer` if `VALUE_SERIALIZER` is
+    `tagged`, which skips pickle for bytes, str, int and float. Serialized values
+    which are at least `VALUE_COMPRESSION_THRESHOLD` bytes are compressed by
+    `VALUE_COMPRESSION` codec in either layout, unless compressed value is not
+    smaller. Every value is readable whichever of them wrote it.
+
+    Pickle buffers of at least `VALUE_BUFFER_THRESHOLD` bytes are kept out of band
+    by `Serializer`, a record is encoded as a list of parts which are written into
+    block one by one, so such a buffer is copied only into pool. Those values are
+    not compressed, their buffers are loaded as read-only views of pool's mmap,
+    which stay valid while the record is live.
+
+    Loaded values are cached by memory manager's `ValueCache` if it has one.
+    """
+
+    def __init__(self, memory_manager, section):
+        # memory manager hands out sequence numbers
+        self._memory_manager = memory_manager
+        conf = memory_manager.conf
+        # value's length header, represents the byte array's length of value
+        self._value_header_length = (
+            int(conf.get(section, "VALUE_HEADER_LENGTH", fallback=0)) or 10
+        )
+        self._keyed = conf.get(section, "VALUE_RECORD", fallback="plain") == "keyed"
+        self._tagged = (
+            conf.get(section, "VALUE_SERIALIZER", fallback="pickle") == "tagged"
+        )
+        compression = conf.get(section, "VALUE_COMPRESSION", fallback="none")
+        codec_ids = {name: codec_id for codec_id, (name, _, _) in VALUE_CODECS.items()}
+        assert (
+            compression == "none" or compression in codec_ids
+        ), "unknown value compression {}".format(compression)
+        self._codec_id = codec_ids.get(compression)
+        self._compression_threshold = int(
+            conf.get(section, "VALUE_COMPRESSION_THRESHOLD", fallback=1024)
+        )
+        self._buffer_threshold = int(
+            conf.get(section, "VALUE_BUFFER_THRESHOLD", fallback=0)
+        )
+        self._header_read_length = max(
+            self._value_header_length, KEYED_RECORD_HEADER.size
+        )
+
+    @property
+    def keyed(self):
+        return self._keyed
+
+    @staticmethod
+    def length(parts):
+        return sum(map(len, parts))
+
+    def encode(self, key, value):
+        """return record as a list of bytes-like parts, see `length`"""
+        value_parts = self._encode_value(value)
+        if not self._keyed:
+            return [
+                (
+                    "%0{}d".format(self._value_header_length) % self.length(value_parts)
+                ).encode("utf-8")
+            ] + value_parts
+        return self._encode_keyed(0, pickle.dumps(key), value_parts)
+
+    def _encode_value(self, value):
+        if self._tagged:
+            value_parts = Serializer.dump_parts(value, self._buffer_threshold)
+        elif self._buffer_threshold:
+            value_parts = Serializer.pickle_parts(value, self._buffer_threshold)
+        else:
+            value_parts = [pickle.dumps(value)]
+        if (
+            self._codec_id is None
+            or self.length(value_parts) < self._compression_threshold
+            or value_parts[0][0] == PICKLE_BUFFERS_TAG
+        ):
+            return value_parts
+        value_string = b"".join(value_parts)
+        compressed_string = bytes([self._codec_id]) + VALUE_CODECS[self._codec_id][1](
+            value_string
+        )
+        return [
+            (
+                compressed_string
+                if len(compressed_string) < len(value_string)
+                else value_string
+            )
+        ]
+
+    def encode_tombstone(self, key):
+        """keyed record only, plain records need no tombstone"""
+        return self._encode_keyed(RECORD_TOMBSTONE, pickle.dumps(key), [])
+
+    def encode_clear(self):
+        """keyed record only, plain records need no clear record"""
+        return self._encode_keyed(RECORD_CLEAR, b"", [])
+
+    def _encode_keyed(self, flags, key_string, value_parts):
+        checksum = zlib.crc32(key_string)
+        for part in value_parts:
+            checksum = zlib.crc32(part, checksum)
+        return [
+            KEYED_RECORD_HEADER.pack(
+                KEYED_RECORD_MAGIC,
+                flags,
+                self._memory_manager.next_sequence(),
+                len(key_string),
+                self.length(value_parts),
+                checksum,
+            ),
+            key_string,
+        ] + value_parts
+
+    def locate(self, block, address):
+        """return (value address, value length, record length) of record"""
+        header = block.read(address, self._header_read_length)
+        if header[: len(KEYED_RECORD_MAGIC)] == KEYED_RECORD_MAGIC:
+            _, _, _, key_length, value_length, _ = KEYED_RECORD_HEADER.unpack_from(
+                header
+            )
+            value_address = address + KEYED_RECORD_HEADER.size + key_length
+            return (
+                value_address,
+                value_length,
+                KEYED_RECORD_HEADER.size + key_length + value_length,
+            )
+        value_length = int(header[: self._value_header_length])
+        return (
+            address + self._value_header_length,
+            value_length,
+            self._value_header_length + value_length,
+        )
+
+    def record_length(self, block, address):
+        return self.locate(block, address)[2]
+
+    def load(self, block, address):
+        value_cache = self._memory_manager.value_cache
+        if value_cache is None:
+            return self._load(block, address)[0]
+        value = value_cache.get(block.block_id, address)
+        if value is CACHE_MISS:
+            epoch = value_cache.epoch
+            value, value_length = self._load(block, address)
+            value_cache.put(block.block_id, address, value, value_length, epoch)
+        return value
+
+    def _load(self, block, address):
+        """return (value, value length) of record"""
+        value_address, value_length, _ = self.locate(block, address)
+        with block.read_view(value_address, value_length) as data:
+            if data[0] not in VALUE_CODECS:
+                return Serializer.loads(data), value_length
+            with data[1:] as compressed_data:
+                return (
+                    Serializer.loads(VALUE_CODECS[data[0]][2](compressed_data)),
+                    value_length,
+                )
+
+    @staticmethod
+    def scan(data):
+        """
+        yield (address, flags, sequence, key) of every valid keyed record in block
+        data, bytes which are not a keyed record are skipped until next magic
+        """
+        offset = data.find(KEYED_RECORD_MAGIC)
+        while 0 <= offset <= len(data) - KEYED_RECORD_HEADER.size:
+            _, flags, sequence, key_length, value_length, checksum = (
+                KEYED_RECORD_HEADER.unpack_from(data, offset)
+            )
+            key_offset = offset + KEYED_RECORD_HEADER.size
+            end_offset = key_offset + key_length + value_length
+            if end_offset <= len(data) and checksum == zlib.crc32(
+                data[key_offset + key_length : end_offset],
+                zlib.crc32(data[key_offset : key_offset + key_length]),
+            ):
+                key = (
+                    pickle.loads(data[key_offset : key_offset + key_length])
+                    if key_length
+                    else None
+                )
+                yield offset, flags, sequence, key
+                offset = data.find(KEYED_RECORD_MAGIC, end_offset)
+            else:
+                offset = data.find(KEYED_RECORD_MAGIC, offset + 1)
@@ -0,0 +1,167 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+WAL_MAGIC = b"KVWAL001"
+# record header: operation, payload length, crc32 of payload
+WAL_RECORD = struct.Struct("<BII")
+# payload is pickled (key, block id, address, end offset of value)
+WAL_SET = 1
+# payload is pickled (key, value), for values kept in memory by index
+WAL_SET_VALUE = 2
+# payload is pickled key
+WAL_REMOVE = 3
+# payload is empty
+WAL_CLEAR = 4
+# payload is pickled (key, block id, end offset of tombstone record), yielded as
+# `WAL_REMOVE`, so replay keeps tombstone from being overwritten
+WAL_REMOVE_RECORD = 5
+# payload is pickled (block id, end offset of clear record), yielded as `WAL_CLEAR`
+WAL_CLEAR_RECORD = 6
+
+
+class WriteAheadLog(object):
+    """
+    Append only log of index mutations
+
+    Records are written with one unbuffered `write`, so a process crash loses
+    nothing that is appended. A torn or corrupted tail is cut off when log is
+    opened, `sync` makes appended records durable.
+    """
+
+    def __init__(self, filepath):
+        self._filepath = filepath
+        self._lock = threading.Lock()
+        self._fd = os.open(filepath, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, WAL_MAGIC)
+        self._records, valid_size = self._scan()
+        # drop torn tail, following records are appended after last valid one
+        os.ftruncate(self._fd, valid_size)
+        os.lseek(self._fd, valid_size, os.SEEK_SET)
+        self._size = valid_size
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def size(self):
+        return self._size
+
+    def _scan(self):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        data = b""
+        while True:
+            chunk = os.read(self._fd, 1 << 20)
+            if not chunk:
+                break
+            data += chunk
+        assert data.startswith(WAL_MAGIC), "{} is not a write ahead log".format(
+            self._filepath
+        )
+        records, offset = [], len(WAL_MAGIC)
+        while offset + WAL_RECORD.size <= len(data):
+            operation, length, checksum = WAL_RECORD.unpack_from(data, offset)
+            payload = data[offset + WAL_RECORD.size : offset + WAL_RECORD.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            records.append((operation, payload))
+            offset += WAL_RECORD.size + length
+        return records, offset
+
+    def records(self):
+        """
+        yield records found when log is opened as (operation, key, argument),
+        argument is (block id, address, end offset) for `WAL_SET`, value for
+        `WAL_SET_VALUE`, and (block id, end offset) of tombstone or clear record,
+        or None, for `WAL_REMOVE` and `WAL_CLEAR`
+        """
+        for operation, payload in self._records:
+            if operation == WAL_SET:
+                key, block_id, address, end_offset = pickle.loads(payload)
+                yield operation, key, (block_id, address, end_offset)
+            elif operation == WAL_SET_VALUE:
+                key, value = pickle.loads(payload)
+                yield operation, key, value
+            elif operation == WAL_REMOVE:
+                yield operation, pickle.loads(payload), None
+            elif operation == WAL_REMOVE_RECORD:
+                key, block_id, end_offset = pickle.loads(payload)
+                yield WAL_REMOVE, key, (block_id, end_offset)
+            elif operation == WAL_CLEAR_RECORD:
+                yield WAL_CLEAR, None, pickle.loads(payload)
+            else:
+                yield operation, None, None
+
+    def append_set(self, key, block_id, address, end_offset):
+        self._append(WAL_SET, pickle.dumps((key, block_id, address, end_offset)))
+
+    def append_set_value(self, key, value):
+        self._append(WAL_SET_VALUE, pickle.dumps((key, value)))
+
+    def append_remove(self, key, record_end=None):
+        """`record_end` is (block id, end offset) of tombstone record, if written"""
+        if record_end is None:
+            self._append(WAL_REMOVE, pickle.dumps(key))
+        else:
+            self._append(WAL_REMOVE_RECORD, pickle.dumps((key,) + tuple(record_end)))
+
+    def append_clear(self, record_end=None):
+        """`record_end` is (block id, end offset) of clear record, if written"""
+        if record_end is None:
+            self._append(WAL_CLEAR, b"")
+        else:
+            self._append(WAL_CLEAR_RECORD, pickle.dumps(tuple(record_end)))
+
+    def _append(self, operation, payload):
+        record = WAL_RECORD.pack(operation, len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            os.write(self._fd, record)
+            self._size += len(record)
+
+    def sync(self):
+        # descriptor is replaced by `discard`, a duplicate stays valid while syncing
+        with self._lock:
+            fd = os.dup(self._fd)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def truncate(self):
+        """drop all records, they are covered by a checkpoint"""
+        with self._lock:
+            os.ftruncate(self._fd, len(WAL_MAGIC))
+            os.lseek(self._fd, len(WAL_MAGIC), os.SEEK_SET)
+            os.fsync(self._fd)
+            self._size = len(WAL_MAGIC)
+        self._records = []
+
+    def discard(self, offset):
+        """
+        drop records before `offset`, they are covered by a checkpoint, records
+        appended after it are moved into a new log which replaces this one
+        """
+        with self._lock:
+            tail = os.pread(self._fd, self._size - offset, offset)
+            tmp_filepath = self._filepath + ".tmp"
+            fd = os.open(tmp_filepath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.write(fd, WAL_MAGIC + tail)
+            os.fsync(fd)
+            os.replace(tmp_filepath, self._filepath)
+            os.close(self._fd)
+            self._fd = fd
+            self._size = len(WAL_MAGIC) + len(tail)
+        self._records = []
+
+    def close(self):
+        os.close(self._fd)
+
+    def __str__(self):
+        return "filepath is: {}, size: {}".format(self._filepath, self._size)
+
+    def __repr__(self):
+        return self.__str__()
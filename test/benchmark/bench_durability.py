@@ -0,0 +1,79 @@
+import sys
+import os
+import shutil
+import tempfile
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
+)
+
+from client import Client
+from btree_index import BTreeIndex
+
+
+def run(durability, writers, writes_per_writer, value_size):
+    """return (writes per second, p50 latency, p99 latency, writes per sync)"""
+    folder = tempfile.mkdtemp()
+    try:
+        client = Client(
+            index_type=BTreeIndex,
+            pool_folder=os.path.join(folder, "pools"),
+            block_file=os.path.join(folder, "block_file"),
+            durability=durability,
+        )
+        memory_manager = client.index.memory_manager
+        sync_count = memory_manager.sync_count
+        value = "x" * value_size
+
+        def write(writer):
+            latencies = []
+            for index in range(writes_per_writer):
+                start_time = time.perf_counter()
+                client.set((writer, index), value)
+                latencies.append(time.perf_counter() - start_time)
+            return latencies
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            latencies = sorted(
+                latency
+                for writer_latencies in executor.map(write, range(writers))
+                for latency in writer_latencies
+            )
+        elapsed_time = time.perf_counter() - start_time
+        syncs = memory_manager.sync_count - sync_count
+        client.close()
+    finally:
+        shutil.rmtree(folder)
+    return (
+        len(latencies) / elapsed_time,
+        latencies[len(latencies) // 2],
+        latencies[len(latencies) * 99 // 100],
+        len(latencies) / syncs if syncs else float("inf"),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="set latency per durability mode")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+
+    print(
+        "{:<14}{:>12}{:>12}{:>12}{:>16}".format(
+            "durability", "writes/s", "p50 (ms)", "p99 (ms)", "writes/sync"
+        )
+    )
+    for durability in ("none", "periodic", "group_commit"):
+        throughput, p50, p99, writes_per_sync = run(
+            durability, args.writers, args.writes, args.value_size
+        )
+        print(
+            "{:<14}{:>12.0f}{:>12.3f}{:>12.3f}{:>16.1f}".format(
+                durability, throughput, p50 * 1000, p99 * 1000, writes_per_sync
+            )
+        )
@@ -9,7 +9,7 @@ sys.path.append(
 )
 
 from btree_index import BTreeIndex
-from memory_manager import MemoryManager
+from memory_manager import MemoryManager, METADATA_COMPACT_SIZE
 
 package_root_path = os.path.abspath(
     os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
@@ -177,6 +177,62 @@ def test_btree_real_scenario():
     _clean_up()
 
 
+def test_btree_shared_value_log():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    index = BTreeIndex(manager)
+    for i in range(200):
+        index.set(i % 50, i)
+
+    # values are appended into shared blocks instead of one block per set
+    assert len(manager.blocks) < 10
+    assert list(index.key_value_pairs()) == [(i, i + 150) for i in range(50)]
+
+    _clean_up()
+
+
+def test_btree_reclaim_space():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    index = BTreeIndex(manager)
+    for i in range(2000):
+        index.set(i % 5, "value-{:010d}".format(i))
+    for key in range(5):
+        assert index.get(key) == "value-{:010d}".format(1995 + key)
+
+    # overwritten values are reused, store does not grow with every write
+    assert len(manager.pools) == 1
+    # blocks whose values are all overwritten are dropped, block table and free
+    # map are rewritten instead of growing with every write
+    assert len(manager.block_dict) <= 10
+    free_map_file = os.path.join(pool_folder, "free_map")
+    for metadata_file in (block_file, free_map_file):
+        assert os.path.getsize(metadata_file) < 2 * METADATA_COMPACT_SIZE
+
+    index.remove(3)
+    index.clear()
+    assert manager.free_list.free_bytes > 0
+
+    # rewritten block table and free map are loaded again
+    block_ids, free_bytes = sorted(manager.block_dict), manager.free_list.free_bytes
+    manager.close()
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert sorted(manager.block_dict) == block_ids
+    assert manager.free_list.free_bytes == free_bytes
+
+    _clean_up()
+
+
 def _get_test_case_package_path():
     check_name = None
     frame = inspect.currentframe()
@@ -1,14 +1,22 @@
 import sys
 import os
+import glob
+import pickle
 import shutil
 import inspect
 import random
+import threading
+import time
 
 sys.path.append(
     os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
 )
 
 from client import Client
+from tree_index import TreeIndex
+from skiplist_index import SkipListIndex
+from btree_index import BTreeIndex
+from mapped_index import MappedIndex
 
 package_root_path = os.path.abspath(
     os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
@@ -80,6 +88,20 @@ def test_load_index_from_file():
     client.load_index_from_file(temp_file)
     assert sorted(list(client.keys())) == [1, 2, 7]
 
+    # mapped index file is queried in place
+    client.dump_index_to_mapped_file(temp_file)
+    client = Client(
+        index_file=temp_file,
+        conf_path=conf_path,
+        pool_folder=pool_folder,
+        block_file=block_file,
+    )
+    assert isinstance(client.index, MappedIndex)
+    assert client.get(2) == 100
+    assert list(client.keys()) == [1, 2, 7]
+    client.set(3, 30)
+    assert sorted(client.key_value_pairs()) == [(1, 10), (2, 100), (3, 30), (7, 8)]
+
     _clean_up()
     os.remove(temp_file)
 
@@ -103,6 +125,390 @@ def test_load_index_from_string():
     _clean_up()
 
 
+def test_load_legacy_index_from_string():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        _clean_up()
+        client = Client(
+            index_type=index_type,
+            conf_path=conf_path,
+            pool_folder=pool_folder,
+            block_file=block_file,
+        )
+        for key in range(20):
+            client.set(key, "value {}".format(key))
+        if index_type is TreeIndex:
+            client.index.persist()
+        # index pickled by first version has no value record, btree has neither
+        # value log block nor allocate scale
+        legacy_index = index_type.__new__(index_type)
+        legacy_index.__dict__.update(client.index.__dict__)
+        del legacy_index._value_record
+        if index_type is BTreeIndex:
+            del legacy_index._current_block
+            del legacy_index._memory_allocate_scale
+        string = pickle.dumps(legacy_index)
+
+        client.load_index_from_pickle_string(string)
+        for key in range(20):
+            assert client.get(key) == "value {}".format(key)
+        for key in range(10, 30):
+            client.set(key, "new value {}".format(key))
+        client.remove(0)
+        assert client.get(0) is None
+        for key in range(1, 30):
+            expected = "value {}" if key < 10 else "new value {}"
+            assert client.get(key) == expected.format(key)
+        client.close()
+
+    _clean_up()
+
+
+def test_client_group_commit():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    client = Client(
+        conf_path=conf_path,
+        pool_folder=pool_folder,
+        block_file=block_file,
+        durability="group_commit",
+    )
+    memory_manager = client.index.memory_manager
+    sync_count = memory_manager.sync_count
+    client.set(1, 10)
+    client.set(2, 20)
+    assert client.remove(1) == True
+    # every write waits for its own sync without concurrent writers
+    assert memory_manager.sync_count == sync_count + 3
+    client.close()
+
+    client = Client(conf_path=conf_path, pool_folder=pool_folder, block_file=block_file)
+    assert client.index.memory_manager.durability == "none"
+    client.set(3, 30)
+    assert client.index.memory_manager.sync_count == 0
+    assert client.get(3) == 30
+
+    _clean_up()
+
+
+def test_write_ahead_log():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    wal_file = os.path.join(_get_test_case_package_path(), "wal")
+
+    def clean_up_wal():
+        _clean_up()
+        # log, checkpoint and its deltas
+        for path in glob.glob(wal_file + "*"):
+            os.remove(path)
+
+    def open_client(index_type):
+        return Client(
+            index_type=index_type,
+            conf_path=conf_path,
+            pool_folder=pool_folder,
+            block_file=block_file,
+            wal_file=wal_file,
+        )
+
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        clean_up_wal()
+        expected = {}
+        client = open_client(index_type)
+        for key in range(20):
+            client.set(key, "value {}".format(key))
+            expected[key] = "value {}".format(key)
+        client.remove(3)
+        del expected[3]
+        client.checkpoint()
+        assert os.path.getsize(wal_file) == 8
+
+        # writes after checkpoint are only in log, client is dropped without close
+        for key in range(15, 25):
+            client.set(key, "new value {}".format(key))
+            expected[key] = "new value {}".format(key)
+        client.remove(0)
+        del expected[0]
+
+        client = open_client(index_type)
+        assert isinstance(client.index, index_type)
+        assert sorted(client.key_value_pairs()) == sorted(expected.items())
+        # recovered write cursors never hand out space of logged values again
+        for key in range(25, 30):
+            client.set(key, "more value {}".format(key))
+            expected[key] = "more value {}".format(key)
+        assert sorted(client.key_value_pairs()) == sorted(expected.items())
+
+        # crash once compaction deletes pools retired by the one before, relocated
+        # values are already checkpointed, so log never points into deleted pools
+        client.compact()
+        memory_manager = client.index.memory_manager
+        retire_pools = memory_manager.retire_pools
+
+        def crash_after_retire(pool_ids):
+            retire_pools(pool_ids)
+            raise RuntimeError("crash")
+
+        memory_manager.retire_pools = crash_after_retire
+        try:
+            client.compact()
+            assert False, "compaction should crash"
+        except RuntimeError:
+            pass
+        client = open_client(index_type)
+        assert sorted(client.key_value_pairs()) == sorted(expected.items())
+        client.close()
+
+        client = open_client(index_type)
+        assert sorted(client.key_value_pairs()) == sorted(expected.items())
+        client.clear()
+        client.close()
+        client = open_client(index_type)
+        assert list(client.keys()) == []
+        client.close()
+
+    clean_up_wal()
+
+
+def test_write_ahead_log_keeps_tombstones():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    wal_file = os.path.join(_get_test_case_package_path(), "wal")
+
+    def clean_up_wal():
+        _clean_up()
+        for path in glob.glob(wal_file + "*"):
+            os.remove(path)
+
+    def open_client(index_type):
+        return Client(
+            index_type=index_type,
+            conf_path=conf_path,
+            pool_folder=pool_folder,
+            block_file=block_file,
+            wal_file=wal_file,
+        )
+
+    for index_type in (SkipListIndex, BTreeIndex):
+        clean_up_wal()
+        client = open_client(index_type)
+        for key in range(20):
+            client.set(key, "value {}".format(key))
+        client.checkpoint()
+        # tombstones lie past persisted block cursors, client is dropped without close
+        for key in range(5):
+            client.remove(key)
+
+        client = open_client(index_type)
+        assert sorted(client.keys()) == list(range(5, 20))
+        # replay moves cursors past logged tombstones, new values do not overwrite
+        # them, so rebuilt index does not bring removed keys back
+        for key in range(100, 110):
+            client.set(key, "new value {}".format(key))
+        client.rebuild_index()
+        assert sorted(client.keys()) == list(range(5, 20)) + list(range(100, 110))
+
+        # same for clear record
+        client.checkpoint()
+        client.clear()
+        client = open_client(index_type)
+        for key in range(200, 210):
+            client.set(key, "new value {}".format(key))
+        client.rebuild_index()
+        assert sorted(client.keys()) == list(range(200, 210))
+        client.close()
+
+    clean_up_wal()
+
+
+def test_write_ahead_log_delays_reuse():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    wal_file = os.path.join(_get_test_case_package_path(), "wal")
+
+    def clean_up_wal():
+        _clean_up()
+        for path in glob.glob(wal_file + "*"):
+            os.remove(path)
+
+    def open_client(durability):
+        return Client(
+            index_type=BTreeIndex,
+            conf_path=conf_path,
+            pool_folder=pool_folder,
+            block_file=block_file,
+            durability=durability,
+            wal_file=wal_file,
+        )
+
+    clean_up_wal()
+    client = open_client("periodic")
+    memory_manager = client.index.memory_manager
+    free_bytes_at_log_sync = []
+    # registered after log, so it sees what was reused when log became durable
+    memory_manager.register_sync(
+        lambda: free_bytes_at_log_sync.append(memory_manager.free_list.free_bytes)
+    )
+    for key in range(10):
+        client.set(key, "value {}".format(key))
+    client.set(3, "new value 3")
+    client.remove(4)
+    # overwritten and removed values stay until their log records are durable
+    assert memory_manager.free_list.free_bytes == 0
+    memory_manager.sync()
+    assert free_bytes_at_log_sync == [0]
+    assert memory_manager.free_list.free_bytes > 0
+    client.close()
+
+    # without durability a logged record survives a crash of the process
+    client = open_client("none")
+    memory_manager = client.index.memory_manager
+    free_bytes = memory_manager.free_list.free_bytes
+    client.set(5, "new value 5")
+    assert memory_manager.free_list.free_bytes > free_bytes
+    assert client.get(3) == "new value 3" and client.get(4) is None
+    client.close()
+
+    clean_up_wal()
+
+
+def test_compact_with_concurrent_writers():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    wal_file = os.path.join(_get_test_case_package_path(), "wal")
+
+    def clean_up_wal():
+        _clean_up()
+        for path in glob.glob(wal_file + "*"):
+            os.remove(path)
+
+    def open_client(index_type):
+        return Client(
+            index_type=index_type,
+            conf_path=conf_path,
+            pool_folder=pool_folder,
+            block_file=block_file,
+            wal_file=wal_file,
+        )
+
+    for index_type in (SkipListIndex, BTreeIndex):
+        clean_up_wal()
+        client, expected = open_client(index_type), {}
+        for key in range(40):
+            client.set(key, "value {:010d}".format(key))
+            expected[key] = "value {:010d}".format(key)
+
+        compact_thread = threading.Thread(
+            target=client.compact, kwargs={"bytes_per_second": 2000}
+        )
+        compact_thread.start()
+        # values are copied without writers' lock, so writes go on meanwhile
+        writes, max_latency = 0, 0
+        while compact_thread.is_alive():
+            key = writes % 60
+            start_time = time.monotonic()
+            if writes % 5 == 4:
+                client.remove(key)
+                expected.pop(key, None)
+            else:
+                client.set(key, "new value {:010d}".format(writes))
+                expected[key] = "new value {:010d}".format(writes)
+            max_latency = max(max_latency, time.monotonic() - start_time)
+            writes += 1
+            time.sleep(0.005)
+        compact_thread.join()
+        assert writes > 20 and max_latency < 0.2
+        # values written or removed while copying are caught up before swap
+        assert dict(client.key_value_pairs()) == expected
+        client.close()
+
+        client = open_client(index_type)
+        assert dict(client.key_value_pairs()) == expected
+        client.close()
+
+    clean_up_wal()
+
+
+def test_incremental_checkpoint():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    wal_file = os.path.join(_get_test_case_package_path(), "wal")
+    checkpoint_file = wal_file + ".checkpoint"
+
+    def clean_up_wal():
+        _clean_up()
+        for path in glob.glob(wal_file + "*"):
+            os.remove(path)
+
+    def open_client(index_type):
+        return Client(
+            index_type=index_type,
+            conf_path=conf_path,
+            pool_folder=pool_folder,
+            block_file=block_file,
+            wal_file=wal_file,
+        )
+
+    def delta_files():
+        return sorted(
+            glob.glob(checkpoint_file + ".delta.*"),
+            key=lambda path: int(path.rsplit(".", 1)[1]),
+        )
+
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        clean_up_wal()
+        expected = {}
+        client = open_client(index_type)
+        # log grows past its limit many times, checkpoints run in background
+        for key in range(300):
+            client.set(key, "value {}".format(key))
+            expected[key] = "value {}".format(key)
+        client.wait_checkpoint()
+        # log keeps only writes after the last checkpoint, all 300 writes take
+        # about 10KB, writes go on while a background checkpoint runs, so log
+        # could be past its limit for a while
+        assert os.path.getsize(wal_file) < 8192
+        assert 1 <= len(delta_files()) <= 2
+        assert not os.path.exists(checkpoint_file)
+
+        # compaction relocates values, so whole index is written
+        client.compact()
+        assert os.path.exists(checkpoint_file)
+        assert delta_files() == []
+        assert os.path.getsize(wal_file) == 8
+
+        # only changed keys are written
+        client.set(5, "new value 5")
+        client.remove(6)
+        expected[5] = "new value 5"
+        del expected[6]
+        client.checkpoint()
+        with open(delta_files()[-1], "rb") as delta_f:
+            cleared, entries = pickle.load(delta_f)
+        assert not cleared and sorted(entries) == [5, 6]
+        assert os.path.getsize(wal_file) == 8
+
+        client.set(7, "new value 7")
+        expected[7] = "new value 7"
+        client.checkpoint(background=True)
+        client.wait_checkpoint()
+        client.set(8, "new value 8")
+        expected[8] = "new value 8"
+
+        # client is dropped without close, index is rebuilt from snapshot, deltas
+        # and log
+        client = open_client(index_type)
+        assert sorted(client.key_value_pairs()) == sorted(expected.items())
+        client.clear()
+        client.checkpoint()
+        client.set(9, "new value 9")
+        expected = {9: "new value 9"}
+        client.close()
+
+        client = open_client(index_type)
+        assert sorted(client.key_value_pairs()) == sorted(expected.items())
+        client.close()
+
+    clean_up_wal()
+
+
 def _get_test_case_package_path():
     check_name = None
     frame = inspect.currentframe()
@@ -0,0 +1,123 @@
+import sys
+import os
+import shutil
+import inspect
+import time
+
+sys.path.append(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
+)
+
+from memory_manager import MemoryManager
+from tree_index import TreeIndex
+from skiplist_index import SkipListIndex
+from btree_index import BTreeIndex
+
+package_root_path = os.path.abspath(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
+)
+
+
+def test_compact_all_indexes():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    tree_index = TreeIndex(manager)
+    skiplist_index = SkipListIndex(manager)
+    btree_index = BTreeIndex(manager)
+    indexes = [tree_index, skiplist_index, btree_index]
+
+    for i in range(300):
+        for index in indexes:
+            index.set(i % 20, "value-{}".format(i))
+        tree_index.persist()
+    old_pool_paths = [pool.filepath for pool in manager.pools]
+    old_version = tree_index.checkout(version=10)
+    # a reader took a location before it is moved
+    stale_location = dict(btree_index.entries())[0].location
+
+    copied_bytes, retired_pools = manager.compact(indexes)
+    assert copied_bytes > 0 and retired_pools == len(old_pool_paths)
+    # retired pools are kept until next compaction, so old location is readable
+    assert all(os.path.exists(path) for path in old_pool_paths)
+    assert btree_index.load_value(stale_location) == "value-280"
+
+    expected = [(i, "value-{}".format(280 + i)) for i in range(20)]
+    for index in indexes:
+        assert sorted(index.key_value_pairs()) == expected
+    # values of history versions are live too
+    assert old_version.get(0) == "value-0"
+
+    # indexes keep working after compaction
+    for index in indexes:
+        index.set(100, "new")
+        assert index.get(100) == "new"
+
+    manager.compact(indexes)
+    assert not any(os.path.exists(path) for path in old_pool_paths)
+    assert len(manager.pools) < len(old_pool_paths)
+    for index in indexes:
+        assert index.get(100) == "new"
+
+    # freed blocks do not come back after restart, pools retired by last
+    # compaction are deleted on close
+    manager.close()
+    block_ids = sorted(manager.block_dict)
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert sorted(manager.block_dict) == block_ids
+
+    _clean_up()
+
+
+def test_compact_throughput_cap():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    index = SkipListIndex(manager)
+    for i in range(50):
+        index.set(i, "x" * 20)
+
+    start_time = time.monotonic()
+    copied_bytes, _ = manager.compact([index], bytes_per_second=10000)
+    assert time.monotonic() - start_time >= copied_bytes / 10000 * 0.9
+    assert index.get(49) == "x" * 20
+
+    _clean_up()
+
+
+def _get_common_file_paths():
+    check_name = None
+    frame = inspect.currentframe()
+    while frame:
+        if frame.f_code.co_name.startswith("test_"):
+            check_name = frame.f_code.co_name
+            break
+        frame = frame.f_back
+    assert check_name and check_name.startswith("test_")
+
+    pool_folder = os.path.abspath(
+        os.path.join(package_root_path, "compactor", check_name, "pools")
+    )
+    conf_path = os.path.abspath(
+        os.path.join(package_root_path, "compactor", check_name, "storage_conf.ini")
+    )
+    block_file = os.path.abspath(
+        os.path.join(package_root_path, "compactor", check_name, "block_file")
+    )
+    return pool_folder, conf_path, block_file
+
+
+def _clean_up():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    if os.path.exists(pool_folder):
+        shutil.rmtree(pool_folder)
+    if os.path.exists(block_file):
+        os.remove(block_file)
@@ -0,0 +1,175 @@
+import sys
+import os
+import shutil
+import inspect
+
+sys.path.append(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
+)
+
+from memory_manager import MemoryManager
+from tree_index import TreeIndex
+from skiplist_index import SkipListIndex
+from btree_index import BTreeIndex
+from client import Client
+
+package_root_path = os.path.abspath(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
+)
+
+
+def test_rebuild_index_from_records():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        _clean_up()
+        manager = MemoryManager(
+            pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+        )
+        index = index_type(manager)
+        for i in range(100):
+            index.set(i, "value-{}".format(i))
+        index.clear()
+        expected = {}
+        for i in range(200):
+            index.set(i % 50, "value-{}".format(i))
+            expected[i % 50] = "value-{}".format(i)
+        for i in range(0, 50, 7):
+            index.remove(i)
+            del expected[i]
+        if index_type is TreeIndex:
+            index.persist()
+        manager.close()
+
+        # index is lost, storage is opened again
+        manager = MemoryManager(
+            pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+        )
+        for processes in (1, 2):
+            rebuilt_index = manager.rebuild_index(index_type, processes)
+            assert type(rebuilt_index) is index_type
+            assert list(rebuilt_index.keys()) == sorted(expected)
+            assert dict(rebuilt_index.key_value_pairs()) == expected
+
+        # rebuilt index keeps working, values written after it are rebuilt too
+        rebuilt_index.set(1000, "new")
+        rebuilt_index.remove(1)
+        expected[1000] = "new"
+        del expected[1]
+        if index_type is TreeIndex:
+            rebuilt_index.persist()
+        assert dict(manager.rebuild_index(index_type).key_value_pairs()) == expected
+        manager.close()
+
+    _clean_up()
+
+
+def test_rebuild_index_after_crash():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        _clean_up()
+        manager = MemoryManager(
+            pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+        )
+        index = index_type(manager)
+        expected = {}
+        for i in range(10):
+            index.set(i, "value-{}".format(i))
+            expected[i] = "value-{}".format(i)
+        manager.sync()
+        # block cursors are not persisted again before crash
+        for i in range(10, 100):
+            index.set(i, "value-{}".format(i))
+            expected[i] = "value-{}".format(i)
+        if index_type is TreeIndex:
+            index.persist()
+        for i in range(0, 100, 9):
+            index.remove(i)
+            del expected[i]
+
+        # manager is dropped without close
+        manager = MemoryManager(
+            pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+        )
+        rebuilt_index = manager.rebuild_index(index_type)
+        assert dict(rebuilt_index.key_value_pairs()) == expected
+
+        # cursors are moved past recovered records, new values do not overwrite them
+        for i in range(100, 120):
+            rebuilt_index.set(i, "new-{}".format(i))
+            expected[i] = "new-{}".format(i)
+        if index_type is TreeIndex:
+            rebuilt_index.persist()
+        manager.close()
+        manager = MemoryManager(
+            pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+        )
+        assert dict(manager.rebuild_index(index_type).key_value_pairs()) == expected
+        manager.close()
+
+    _clean_up()
+
+
+def test_client_rebuild_index():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    client = Client(
+        index_type=BTreeIndex,
+        conf_path=conf_path,
+        pool_folder=pool_folder,
+        block_file=block_file,
+    )
+    for i in range(30):
+        client.set(i, i * 10)
+    client.remove(3)
+    client.close()
+
+    # stale index dump is replaced by rebuilt index
+    client = Client(
+        index_type=BTreeIndex,
+        conf_path=conf_path,
+        pool_folder=pool_folder,
+        block_file=block_file,
+    )
+    assert list(client.keys()) == []
+    client.rebuild_index()
+    assert isinstance(client.index, BTreeIndex)
+    expected = [(i, i * 10) for i in range(30) if i != 3]
+    assert sorted(client.key_value_pairs()) == expected
+    client.close()
+
+    _clean_up()
+
+
+def _get_common_file_paths():
+    check_name = None
+    frame = inspect.currentframe()
+    while frame:
+        if frame.f_code.co_name.startswith("test_"):
+            check_name = frame.f_code.co_name
+            break
+        frame = frame.f_back
+    assert check_name and check_name.startswith("test_")
+
+    pool_folder = os.path.abspath(
+        os.path.join(package_root_path, "index_rebuilder", check_name, "pools")
+    )
+    conf_path = os.path.abspath(
+        os.path.join(
+            package_root_path, "index_rebuilder", check_name, "storage_conf.ini"
+        )
+    )
+    block_file = os.path.abspath(
+        os.path.join(package_root_path, "index_rebuilder", check_name, "block_file")
+    )
+    return pool_folder, conf_path, block_file
+
+
+def _clean_up():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    if os.path.exists(pool_folder):
+        shutil.rmtree(pool_folder)
+    if os.path.exists(block_file):
+        os.remove(block_file)
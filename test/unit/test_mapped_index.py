@@ -0,0 +1,137 @@
+import sys
+import os
+import shutil
+import inspect
+import pickle
+import random
+
+sys.path.append(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
+)
+
+from memory_manager import MemoryManager
+from tree_index import TreeIndex
+from skiplist_index import SkipListIndex
+from btree_index import BTreeIndex
+from mapped_index import MappedIndex
+
+package_root_path = os.path.abspath(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
+)
+
+
+def test_mapped_index_query_in_place():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    index_file = os.path.join(os.path.dirname(conf_path), "index")
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        index = index_type(manager)
+        expected = {}
+        for i in range(200):
+            index.set(i * 2, "value-{}".format(i))
+            expected[i * 2] = "value-{}".format(i)
+        if index_type is TreeIndex:
+            # part of values are persisted, others are kept in index file
+            index.persist()
+            index.set(1, [1, 2])
+            expected[1] = [1, 2]
+        MappedIndex.dump(index, index_file)
+
+        mapped_index = MappedIndex(index_file, manager)
+        assert mapped_index.index_type is index_type
+        assert mapped_index.get(0) == "value-0"
+        assert mapped_index.get(398) == "value-199"
+        assert mapped_index.get(3) is None
+        assert mapped_index.get(-1, "default") == "default"
+        assert list(mapped_index.keys()) == sorted(expected)
+        assert list(mapped_index.key_value_pairs()) == sorted(expected.items())
+        assert not mapped_index.materialized
+
+        # first mutation builds index of dumped type
+        mapped_index.set(3, "new")
+        assert mapped_index.materialized
+        assert mapped_index.remove(0)
+        expected[3] = "new"
+        del expected[0]
+        assert sorted(mapped_index.key_value_pairs()) == sorted(expected.items())
+
+        # pickled as index of dumped type
+        loaded_index = pickle.loads(pickle.dumps(mapped_index))
+        assert type(loaded_index) is index_type
+        assert sorted(loaded_index.key_value_pairs()) == sorted(expected.items())
+
+    manager.close()
+    os.remove(index_file)
+    _clean_up()
+
+
+def test_mapped_index_with_dumped_manager():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    index_file = os.path.join(os.path.dirname(conf_path), "index")
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    index = TreeIndex(manager)
+    keys = list(range(3000))
+    random.Random(0).shuffle(keys)
+    for key in keys:
+        index.set(key, key)
+    index.persist()
+    MappedIndex.dump(index, index_file)
+
+    # keys are stored sorted, tree is not built from sorted inserts, otherwise it
+    # would be too deep to traverse recursively
+    mapped_index = MappedIndex(index_file)
+    assert mapped_index.memory_manager is not manager
+    assert mapped_index.get(2999) == 2999
+    # index specific operations are delegated after materialization
+    assert mapped_index.persist() == 0
+    assert mapped_index.materialized
+    mapped_index.set(3000, 3000)
+    assert mapped_index.get(3000) == 3000
+    assert len(list(mapped_index.keys())) == 3001
+
+    # a mapped index could be dumped again
+    MappedIndex.dump(MappedIndex(index_file, manager), index_file + ".copy")
+    assert list(MappedIndex(index_file + ".copy", manager).keys()) == list(range(3000))
+
+    manager.close()
+    os.remove(index_file)
+    os.remove(index_file + ".copy")
+    _clean_up()
+
+
+def _get_common_file_paths():
+    check_name = None
+    frame = inspect.currentframe()
+    while frame:
+        if frame.f_code.co_name.startswith("test_"):
+            check_name = frame.f_code.co_name
+            break
+        frame = frame.f_back
+    assert check_name and check_name.startswith("test_")
+
+    pool_folder = os.path.abspath(
+        os.path.join(package_root_path, "mapped_index", check_name, "pools")
+    )
+    conf_path = os.path.abspath(
+        os.path.join(package_root_path, "mapped_index", check_name, "storage_conf.ini")
+    )
+    block_file = os.path.abspath(
+        os.path.join(package_root_path, "mapped_index", check_name, "block_file")
+    )
+    return pool_folder, conf_path, block_file
+
+
+def _clean_up():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    if os.path.exists(pool_folder):
+        shutil.rmtree(pool_folder)
+    if os.path.exists(block_file):
+        os.remove(block_file)
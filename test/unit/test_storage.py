@@ -2,12 +2,20 @@ import sys
 import os
 import inspect
 import shutil
+import mmap
+import pickle
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(
     os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
 )
 
 from memory_manager import MemoryManager
+from memory_pool import MemoryPool
 
 package_root_path = os.path.abspath(
     os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
@@ -40,8 +48,8 @@ def test_memory_manager_allocate_block():
             assert bytes == target_content_string.encode("utf-8")
 
     # check content
-    check_content(os.path.join(pool_folder, "pool_0"), "0001000000")
-    check_content(os.path.join(pool_folder, "pool_1"), "0000800000")
+    check_content(os.path.join(pool_folder, "pool_0"), "00010\x00\x00\x00\x00\x00")
+    check_content(os.path.join(pool_folder, "pool_1"), "00008\x00\x00\x00\x00\x00")
 
     manager = MemoryManager(
         conf_path=conf_path, pool_folder=pool_folder, block_file=block_file
@@ -91,9 +99,9 @@ def test_memory_manager_allocate_multi_blocks():
     filepath2 = os.path.join(pool_folder, "pool_1")
     filepath3 = os.path.join(pool_folder, "pool_2")
 
-    check_content(filepath1, "0001000000")
-    check_content(filepath2, "0001000000")
-    check_content(filepath3, "0000700000")
+    check_content(filepath1, "00010\x00\x00\x00\x00\x00")
+    check_content(filepath2, "00010\x00\x00\x00\x00\x00")
+    check_content(filepath3, "00007\x00\x00\x00\x00\x00")
 
     # check second block which span three pools
     assert len(block2.memory_segments) == 3
@@ -150,7 +158,7 @@ def test_write_data_to_block():
     filepath1 = os.path.join(pool_folder, "pool_0")
     filepath2 = os.path.join(pool_folder, "pool_1")
     check_content(filepath1, "00010somet")
-    check_content(filepath2, "00009hing0")
+    check_content(filepath2, "00009hing\x00")
 
     assert block.used_memory == 9 and block.free_memory == 0 and block.block_size == 9
 
@@ -360,16 +368,870 @@ def test_read_write_multi_blocks():
     block2.write("hey")
 
     check_content(pool_file_1, "00010hello")
-    check_content(pool_file_2, "000100hey0")
+    check_content(pool_file_2, "00010\x00hey\x00")
 
     assert block1.read(1, 4) == "ello".encode("utf-8")
-    assert block2.read(2, 2) == "y0".encode("utf-8")
+    assert block2.read(2, 2) == "y\x00".encode("utf-8")
     assert block1.read(3, 2) == "lo".encode("utf-8")
     assert block2.read(0, 2) == "he".encode("utf-8")
 
     _clean_up()
 
 
+def test_block_table_cursor():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    block1 = manager.allocate_block(4)
+    block2 = manager.allocate_block(8)
+    block1.write("full")
+    block2.write("abc")
+    manager.close()
+
+    # magic + two fixed width records with one and three segments
+    assert os.path.getsize(block_file) == 8 + 28 * 2 + 24 * 4
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    block1, block2 = manager.blocks
+    assert block1.current_offset == 4 and block1.free_memory == 0
+    assert block2.current_offset == 3 and block2.free_memory == 5
+    assert block1.memory_segments[0].pool is manager.pool_dict[0]
+
+    block2.write("defgh")
+    assert block2.read(0, 8) == "abcdefgh".encode("utf-8")
+
+    _clean_up()
+
+
+def test_lazy_pool_bootstrap():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    for i in range(10):
+        manager.allocate_block(5).write("hey{:02d}".format(i))
+    manager.close()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert len(manager.pools) == 10
+    assert not any(pool.loaded for pool in manager.pools)
+
+    # only the pool touched by read is mapped, segments share pool instances
+    block = manager.block_dict[3]
+    assert block.read(0, 5) == "hey03".encode("utf-8")
+    assert [pool.pool_id for pool in manager.pools if pool.loaded] == [3]
+    assert block.memory_segments[0].pool is manager.pool_dict[3]
+
+    _clean_up()
+
+
+def test_block_read_view():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    block = manager.allocate_block(10)
+    block.write("helloworld")
+
+    # range in one segment is a slice of pool's mmap
+    with block.read_view(1, 3) as view:
+        assert isinstance(view.obj, mmap.mmap)
+        assert view == "ell".encode("utf-8")
+
+    # range across segments is gathered
+    with block.read_view(3, 4) as view:
+        assert not isinstance(view.obj, mmap.mmap)
+        assert view == "lowo".encode("utf-8")
+
+    buffer = bytearray(6)
+    assert block.read_into(buffer, 2) == 6
+    assert buffer == bytearray("llowor".encode("utf-8"))
+
+    # views are released, so pools could be closed
+    manager.close()
+
+    _clean_up()
+
+
+def test_concurrent_read_and_allocate():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+
+    def allocate_and_write(i):
+        block = manager.allocate_block(8)
+        block.write("{:08d}".format(i))
+        return block.block_id, i
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        written = list(executor.map(allocate_and_write, range(400)))
+
+    # allocated segments never overlap
+    ranges = sorted(
+        (segment.pool.pool_id, segment.start_offset, segment.end_offset)
+        for block in manager.blocks
+        for segment in block.memory_segments
+    )
+    for previous, current in zip(ranges, ranges[1:]):
+        assert previous[0] != current[0] or previous[2] <= current[1]
+
+    def read(pair):
+        block_id, i = pair
+        return manager.block_dict[block_id].read(0, 8) == "{:08d}".format(i).encode(
+            "utf-8"
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(read, written * 5))
+
+    _clean_up()
+
+
+def test_pool_provision_ahead():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    # spare pool of a live manager is kept, one of an exited process is removed
+    os.makedirs(pool_folder)
+    live_spare_path = os.path.join(pool_folder, ".pool_spare.{}.1".format(os.getpid()))
+    dead_spare_path = os.path.join(pool_folder, ".pool_spare.4194303.1")
+    for path in (live_spare_path, dead_spare_path):
+        open(path, "wb").close()
+
+    thread_count = threading.active_count()
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    # provisioner starts with first pool allocation
+    assert threading.active_count() == thread_count
+    blocks = []
+    for i in range(10):
+        block = manager.allocate_block(7)
+        block.write("hello{:02d}".format(i))
+        blocks.append(block)
+    for i, block in enumerate(blocks):
+        assert block.read(0, 7) == "hello{:02d}".format(i).encode("utf-8")
+    assert threading.active_count() == thread_count + 1
+    # unpickled manager does not start a provisioner either
+    pickle.loads(pickle.dumps(manager))
+    assert threading.active_count() == thread_count + 1
+    manager.close()
+    assert threading.active_count() == thread_count
+    assert os.path.exists(live_spare_path)
+    assert not os.path.exists(dead_spare_path)
+    os.remove(live_spare_path)
+
+    # spare pool is removed on close, all pools are preallocated to pool size
+    file_paths = sorted(os.listdir(pool_folder), key=lambda path: int(path[5:]))
+    assert file_paths == ["pool_{}".format(i) for i in range(14)]
+    for path in file_paths:
+        assert os.path.getsize(os.path.join(pool_folder, path)) == 10
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.blocks[9].read(0, 7) == "hello09".encode("utf-8")
+    manager.close()
+
+    _clean_up()
+
+
+def test_binary_pool_header_recovery():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    pool_path = os.path.join(pool_folder, "pool_0")
+
+    def read_header():
+        with open(pool_path, "rb") as f:
+            offset, checksum = struct.unpack("<QI", f.read(12))
+            assert checksum == zlib.crc32(struct.pack("<Q", offset))
+            return offset
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    manager.allocate_block(10).write("helloworld")
+    # header update is deferred until group commit
+    assert read_header() == 16
+    manager.flush()
+    assert read_header() == 26
+
+    # crash before next flush, header is reconciled with block table
+    manager.allocate_block(8).write("abcdefgh")
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.pools[0].pool_allocate_offset == 34
+    block = manager.allocate_block(4)
+    assert block.memory_segments[0].start_offset == 34
+    manager.close()
+    assert read_header() == 38
+
+    # header which fails checksum is rejected, data offsets of a pool created
+    # with another header layout are not guessed
+    with open(pool_path, "r+b") as f:
+        f.write(b"\xff" * 4)
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    try:
+        manager.blocks[1].read(0, 8)
+        assert False, "pool with broken header should be rejected"
+    except AssertionError as e:
+        assert "POOL_HEADER_FORMAT" in str(e)
+
+    _clean_up()
+
+
+def test_unpickle_pool_with_deferred_header():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    manager.allocate_block(10).write("helloworld")
+    manager.flush()
+    manager.allocate_block(8).write("abcdefgh")
+    # crash before next flush, header on disk is still 26, pickled allocate
+    # offset is kept as floor
+    other = pickle.loads(pickle.dumps(manager))
+    assert other.pools[0].pool_allocate_offset == 34
+    block = other.allocate_block(4)
+    assert block.memory_segments[0].start_offset == 34
+    block.write("wxyz")
+    assert other.blocks[1].read(0, 8) == b"abcdefgh"
+
+    # pool pickled by first version keeps these attributes only
+    state = other.pools[0].__getstate__()
+    legacy_state = {
+        name: state[name]
+        for name in (
+            "_MemoryPool__conf",
+            "_MemoryPool__pool_allocate_offset_header",
+            "_MemoryPool__pool_size",
+            "_MemoryPool__filepath",
+            "_MemoryPool__id",
+            "_MemoryPool__pool_allocate_offset",
+        )
+    }
+    other.close()
+    pool = MemoryPool.__new__(MemoryPool)
+    pool.__setstate__(legacy_state)
+    assert pool.pool_allocate_offset == 38
+    assert pool.read(0, 10) == b"helloworld"
+    assert pool.allocate(4).start_offset == 38
+    pool.close()
+
+    _clean_up()
+
+
+def test_release_and_free_block():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    block1 = manager.allocate_block(30)
+    block2 = manager.allocate_block(20)
+    block1.write("a" * 30)
+    block2.write("b" * 20)
+
+    # released ranges are coalesced and reused by next allocation
+    manager.release(block1.block_id, 10, 10)
+    manager.release(block1.block_id, 20, 10)
+    assert manager.free_list.extents() == [(0, 15, 35)]
+    block3 = manager.allocate_block(15)
+    assert len(block3.memory_segments) == 1
+    assert block3.memory_segments[0].start_offset == 15
+    assert manager.free_list.extents() == [(0, 30, 35)]
+
+    manager.free_block(block2.block_id)
+    assert manager.free_list.extents() == [(0, 30, 55)]
+    assert block2.block_id not in manager.block_dict
+
+    # freed block and free map survive restart
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert sorted(manager.block_dict) == [block1.block_id, block3.block_id]
+    assert manager.free_list.extents() == [(0, 30, 55)]
+    block4 = manager.allocate_block(20)
+    assert block4.block_id == 3
+    assert block4.memory_segments[0].start_offset == 30
+    assert manager.block_dict[0].read(0, 10) == ("a" * 10).encode("utf-8")
+
+    # released ranges are known after restart, they are not freed again with
+    # their block, even though newer blocks took them
+    manager.free_block(block1.block_id)
+    assert manager.free_list.extents() == [(0, 5, 15), (0, 50, 55)]
+    manager.release(block3.block_id, 0, 5)
+    assert manager.free_list.extents() == [(0, 5, 20), (0, 50, 55)]
+    # range released twice is rejected before anything changes
+    try:
+        manager.release(block3.block_id, 0, 10)
+        assert False, "range released twice should be rejected"
+    except AssertionError as e:
+        assert "released twice" in str(e)
+    assert manager.free_list.extents() == [(0, 5, 20), (0, 50, 55)]
+    manager.free_block(block3.block_id)
+    assert manager.free_list.extents() == [(0, 5, 30), (0, 50, 55)]
+    assert sorted(manager.block_dict) == [block4.block_id]
+
+    _clean_up()
+
+
+def test_legacy_block_file_migration():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    blocks = [manager.allocate_block(60), manager.allocate_block(60)]
+    blocks[0].write("a" * 60)
+    blocks[1].write("b" * 30)
+    manager.close()
+    # legacy block file keeps every block pickled after a length header
+    legacy_data = b"".join(
+        b"%010d" % len(block_string) + block_string
+        for block_string in map(pickle.dumps, blocks)
+    )
+    with open(block_file, "wb") as block_f:
+        block_f.write(legacy_data)
+    # stale pool header is raised to allocated ranges of migrated blocks
+    with open(os.path.join(pool_folder, "pool_1"), "r+b") as pool_f:
+        pool_f.write(b"00005")
+
+    # legacy file is left as it is when migration fails
+    os.rename(os.path.join(pool_folder, "pool_1"), os.path.join(pool_folder, "moved"))
+    try:
+        MemoryManager(
+            pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+        )
+        assert False, "block of a missing pool should not be migrated"
+    except KeyError:
+        pass
+    with open(block_file, "rb") as block_f:
+        assert block_f.read() == legacy_data
+    os.rename(os.path.join(pool_folder, "moved"), os.path.join(pool_folder, "pool_1"))
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert sorted(manager.block_dict) == [0, 1]
+    assert manager.block_dict[0].read(0, 60) == b"a" * 60
+    assert manager.block_dict[1].current_offset == 30
+    assert manager.pools[1].pool_allocate_offset == 30
+    manager.close()
+    with open(block_file, "rb") as block_f:
+        assert block_f.read(8) == b"KVBLKTB1"
+
+    _clean_up()
+
+
+def test_unpickle_legacy_memory_manager():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    block = manager.allocate_block(60)
+    block.write("a" * 60)
+    manager.close()
+    # manager pickled by first version keeps these attributes only
+    state = manager.__getstate__()
+    legacy_state = {
+        name: state[name]
+        for name in (
+            "_conf",
+            "_pool_folder",
+            "_block_file",
+            "_block_header_length",
+            "_pool_list",
+            "_pool_dict",
+            "_next_pool_id",
+            "_current_pool_index",
+            "_block_list",
+            "_block_dict",
+            "_next_block_id",
+        )
+    }
+    manager = MemoryManager.__new__(MemoryManager)
+    manager.__setstate__(legacy_state)
+    assert manager.block_dict[0].read(0, 60) == b"a" * 60
+    new_block = manager.allocate_block(60)
+    new_block.write("b" * 60)
+    manager.close()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert sorted(manager.block_dict) == [0, 1]
+    assert manager.block_dict[1].read(0, 60) == b"b" * 60
+    manager.close()
+
+    _clean_up()
+
+
+def test_contiguous_block_placement():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+
+    def placement(block):
+        return [
+            (segment.pool.pool_id, segment.start_offset, segment.end_offset)
+            for segment in block.memory_segments
+        ]
+
+    block1 = manager.allocate_block(10)
+    # block does not fit in tail of pool_0, tail gap is kept in free list
+    block2 = manager.allocate_block(10)
+    assert placement(block1) == [(0, 5, 15)]
+    assert placement(block2) == [(1, 5, 15)]
+    assert manager.free_list.extents() == [(0, 15, 20)]
+
+    # oversized block gets a dedicated pool, current pool stays the same
+    block3 = manager.allocate_block(40)
+    block3.write("x" * 40)
+    assert placement(block3) == [(2, 5, 45)]
+    assert manager.pool_dict[2].pool_size == 45
+
+    # small blocks reuse the tail gap, then the current pool
+    assert placement(manager.allocate_block(4)) == [(0, 15, 19)]
+    assert placement(manager.allocate_block(5)) == [(1, 15, 20)]
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.pool_dict[2].pool_size == 45
+    assert manager.block_dict[2].read(0, 40) == ("x" * 40).encode("utf-8")
+
+    _clean_up()
+
+
+def test_contiguous_tail_recovery():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    manager.allocate_block(10).write("a" * 10)
+    manager.flush()
+    # tail gap of pool_0 is taken into free list, its header is not flushed
+    manager.allocate_block(10).write("b" * 10)
+    assert manager.free_list.extents() == [(0, 15, 20)]
+
+    # crash before next flush, free map keeps tail above block table's floor
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.pool_dict[0].pool_allocate_offset == 20
+    block = manager.allocate_block(5)
+    assert block.memory_segments[0].pool.pool_id == 0
+    assert block.memory_segments[0].start_offset == 15
+    block.write("c" * 5)
+    assert block.read(0, 5) == b"c" * 5
+    manager.close()
+
+    _clean_up()
+
+
+def test_growable_pool():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+
+    def placement(block):
+        return [
+            (segment.pool.pool_id, segment.start_offset, segment.end_offset)
+            for segment in block.memory_segments
+        ]
+
+    pool_path = os.path.join(pool_folder, "pool_0")
+    block1 = manager.allocate_block(10)
+    block1.write("a" * 10)
+    assert os.path.getsize(pool_path) == 20
+
+    # pool grows in place, an exported view forces a remap of the file
+    view = block1.read_view(0, 10)
+    block2 = manager.allocate_block(20)
+    block2.write("b" * 20)
+    assert placement(block2) == [(0, 15, 35)]
+    assert manager.pool_dict[0].pool_size == 40
+    assert os.path.getsize(pool_path) == 40
+    assert bytes(view) == b"a" * 10
+    view.release()
+
+    # pool is filled up to max size before a new pool is allocated
+    block3 = manager.allocate_block(60)
+    block3.write("c" * 60)
+    assert placement(block3) == [(0, 35, 80), (1, 5, 20)]
+    assert manager.pool_dict[0].pool_size == 80
+    assert len(manager.pools) == 2
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.pool_dict[0].pool_size == 80
+    assert manager.block_dict[0].read(0, 10) == b"a" * 10
+    assert manager.block_dict[1].read(0, 20) == b"b" * 20
+    assert manager.block_dict[2].read(0, 60) == b"c" * 60
+
+    _clean_up()
+
+
+def test_pool_container():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+
+    def placement(block):
+        return [
+            (segment.pool.pool_id, segment.start_offset, segment.end_offset)
+            for segment in block.memory_segments
+        ]
+
+    block1 = manager.allocate_block(30)
+    block1.write("a" * 30)
+    assert placement(block1) == [(0, 5, 20), (1, 5, 20)]
+
+    # container is mapped again when it grows while a view is exported
+    view = block1.read_view(0, 15)
+    block2 = manager.allocate_block(30)
+    block2.write("b" * 30)
+    assert bytes(view) == b"a" * 15
+    view.release()
+    assert os.listdir(pool_folder) == ["pools"]
+
+    manager.close()
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert [pool.pool_id for pool in manager.pools] == [0, 1, 2, 3]
+    assert manager.block_dict[0].read(0, 30) == b"a" * 30
+    assert manager.block_dict[1].read(0, 30) == b"b" * 30
+
+    # extents of deleted pools are reused after reopen
+    manager.compact([])
+    container_size = os.path.getsize(os.path.join(pool_folder, "pools"))
+    manager.close()
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert [pool.pool_id for pool in manager.pools] == [4]
+    block3 = manager.allocate_block(30)
+    block3.write("c" * 30)
+    assert placement(block3) == [(4, 5, 20), (5, 5, 20)]
+    assert os.path.getsize(os.path.join(pool_folder, "pools")) == container_size
+    assert manager.block_dict[block3.block_id].read(0, 30) == b"c" * 30
+
+    _clean_up()
+
+
+def test_mapping_cache():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+
+    def mapped_pool_ids():
+        return [pool.pool_id for pool in manager.pools if pool.loaded]
+
+    data = "".join(str(index % 10) for index in range(60)).encode("utf-8")
+    block = manager.allocate_block(60)
+    block.write(data)
+    assert len(manager.pools) == 4
+    assert len(mapped_pool_ids()) <= 2
+    # deferred header is flushed when pool is unmapped
+    with open(os.path.join(pool_folder, "pool_0"), "rb") as pool_f:
+        assert pool_f.read(5) == b"00020"
+
+    # an unmapped pool keeps serving views given out before
+    view = block.read_view(0, 15)
+    assert block.read(30, 30) == data[30:]
+    assert mapped_pool_ids() == [2, 3]
+    assert bytes(view) == data[:15]
+    view.release()
+
+    assert block.read(0, 60) == data
+    assert len(mapped_pool_ids()) == 2
+    assert manager.mapping_cache.mapped_pool_ids() == [2, 3]
+    assert manager.mapping_cache.unmapped_count >= 4
+
+    _clean_up()
+
+
+def test_pool_striping():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    pool_folders = [
+        os.path.join(pool_folder, "disk_0"),
+        os.path.join(pool_folder, "disk_1"),
+    ]
+    manager = MemoryManager(
+        pool_folder=pool_folders, conf_path=conf_path, block_file=block_file
+    )
+
+    data = "".join(str(index % 10) for index in range(90)).encode("utf-8")
+    block = manager.allocate_block(90)
+    block.write(data)
+    manager.close()
+    # pools are striped by weight 2:1
+    assert sorted(os.listdir(pool_folders[0])) == [
+        "pool_0",
+        "pool_2",
+        "pool_3",
+        "pool_5",
+    ]
+    assert sorted(os.listdir(pool_folders[1])) == ["pool_1", "pool_4"]
+
+    # folders could be given as a comma separated string too
+    manager = MemoryManager(
+        pool_folder=",".join(pool_folders), conf_path=conf_path, block_file=block_file
+    )
+    assert [pool.pool_id for pool in manager.pools] == [0, 1, 2, 3, 4, 5]
+    assert manager.block_dict[0].read(0, 90) == data
+    manager.close()
+
+    _clean_up()
+
+
+def test_tiered_pools():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    hot_pool_folder = os.path.join(pool_folder, "hot")
+    cold_pool_folder = os.path.join(pool_folder, "cold")
+    manager = MemoryManager(
+        pool_folder=hot_pool_folder,
+        conf_path=conf_path,
+        block_file=block_file,
+        cold_pool_folder=cold_pool_folder,
+    )
+
+    # block1 lives in pool 0 and 1, block2 in pool 2 and 3
+    block1 = manager.allocate_block(30)
+    block1.write("a" * 30)
+    block2 = manager.allocate_block(20)
+    block2.write("b" * 5)
+    assert manager.migrate_cold_pools() == []
+
+    # pool 2 still has space to be written, pool 3 is current pool
+    time.sleep(0.3)
+    assert manager.migrate_cold_pools() == [0, 1]
+    assert sorted(os.listdir(hot_pool_folder)) == ["pool_2", "pool_3"]
+    assert sorted(os.listdir(cold_pool_folder)) == ["pool_0", "pool_1"]
+    access_count = manager.pool_dict[0].access_count
+    assert block1.read(0, 30) == b"a" * 30
+    assert manager.pool_dict[0].access_count > access_count
+    assert manager.pool_dict[0].filepath == os.path.join(cold_pool_folder, "pool_0")
+
+    # pool is copied without manager lock, a write meanwhile cancels the move
+    pool = manager.pool_dict[2]
+    token = pool.copy_to(os.path.join(cold_pool_folder, "pool_2"))
+    block2.write("c" * 5)
+    assert not pool.move_to(os.path.join(cold_pool_folder, "pool_2"), token)
+    assert sorted(os.listdir(cold_pool_folder)) == ["pool_0", "pool_1"]
+    assert pool.filepath == os.path.join(hot_pool_folder, "pool_2")
+    assert block2.read(0, 10) == b"b" * 5 + b"c" * 5
+    manager.close()
+
+    # hot copy left by an interrupted migration is dropped, both folders given
+    # as arguments are relative to caller
+    shutil.copyfile(
+        os.path.join(cold_pool_folder, "pool_0"),
+        os.path.join(hot_pool_folder, "pool_0"),
+    )
+    manager = MemoryManager(
+        pool_folder=os.path.relpath(hot_pool_folder),
+        conf_path=conf_path,
+        block_file=block_file,
+        cold_pool_folder=os.path.relpath(cold_pool_folder),
+    )
+    assert sorted(os.listdir(hot_pool_folder)) == ["pool_2", "pool_3"]
+    assert [pool.pool_id for pool in manager.pools] == [0, 1, 2, 3]
+    assert manager.block_dict[0].read(0, 30) == b"a" * 30
+    assert manager.block_dict[1].read(0, 10) == b"b" * 5 + b"c" * 5
+    manager.close()
+
+    _clean_up()
+
+
+def test_sync_dirty_pools_only():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    # every block fills a pool of its own
+    blocks = [manager.allocate_block(95) for _ in range(4)]
+    blocks[0].write("a" * 10)
+    manager.sync()
+
+    synced_pools, synced_blocks = [], []
+
+    def record_calls(method, calls, call_id):
+        def wrapper(*args):
+            calls.append(call_id(*args))
+            return method(*args)
+
+        return wrapper
+
+    for pool in manager.pools:
+        pool.sync = record_calls(
+            pool.sync, synced_pools, lambda pool_id=pool.pool_id: pool_id
+        )
+    manager.sync_block = record_calls(
+        manager.sync_block, synced_blocks, lambda block: block.block_id
+    )
+
+    # only pool and block which are written since last sync are touched
+    blocks[2].write("c" * 10)
+    manager.sync()
+    assert synced_pools == [2] and synced_blocks == [2]
+    manager.sync()
+    assert synced_pools == [2] and synced_blocks == [2]
+    manager.close()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.block_dict[0].current_offset == 10
+    assert manager.block_dict[2].read(0, 10) == b"c" * 10
+    manager.close()
+
+    _clean_up()
+
+
+def test_durability_modes():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    def persisted_cursor():
+        with open(block_file, "rb") as block_f:
+            # magic, then block id and block size of first block record
+            return struct.unpack_from("<Q", block_f.read(), 8 + 16)[0]
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    assert manager.durability == "periodic"
+    block = manager.allocate_block(10)
+    block.write("abc")
+    # background flush persists write cursor
+    deadline = time.monotonic() + 5
+    while persisted_cursor() != 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert persisted_cursor() == 3
+
+    # nothing is flushed in background with `none`
+    manager.set_durability("none")
+    block.write("de")
+    manager.commit()
+    time.sleep(0.1)
+    assert persisted_cursor() == 3
+
+    # commits arriving while a sync runs share the next sync
+    manager.set_durability("group_commit")
+    sync, sync_started, sync_released = (
+        manager.sync,
+        threading.Event(),
+        threading.Event(),
+    )
+
+    def slow_sync():
+        sync_started.set()
+        sync_released.wait()
+        sync()
+
+    manager.sync = slow_sync
+    sync_count = manager.sync_count
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        futures = [executor.submit(manager.commit)]
+        sync_started.wait()
+        futures += [executor.submit(manager.commit) for _ in range(63)]
+        time.sleep(0.2)
+        sync_released.set()
+        for future in futures:
+            future.result()
+    assert persisted_cursor() == 5
+    assert 2 <= manager.sync_count - sync_count <= 8
+    manager.close()
+
+    _clean_up()
+
+
+def test_pool_readahead():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    data = os.urandom(512 * 1024)
+    block = manager.allocate_block(len(data))
+    block.write(data)
+    pool = block.memory_segments[0].pool
+
+    # reads in reverse order are not a scan
+    for offset in range(len(data) - 4096, 0, -16384):
+        assert block.read(offset, 4096) == data[offset : offset + 4096]
+    assert pool.readahead_count == 0
+    # random gets read a record header, then its value, which is not a scan
+    for offset in range(len(data) - 4096, 0, -16384):
+        block.read(offset, 23)
+        assert block.read(offset + 10, 4086) == data[offset + 10 : offset + 4096]
+    assert pool.readahead_count == 0
+
+    # a scan is advised ahead, window grows up to readahead size
+    for offset in range(0, len(data), 4096):
+        assert block.read(offset, 4096) == data[offset : offset + 4096]
+    readahead_count = pool.readahead_count
+    assert 0 < readahead_count < len(data) // 65536 + 4
+    # a scan of records reads headers and values in a row
+    block.read(0, 23)
+    block.read(10, 4096)
+    assert pool.readahead_count == readahead_count
+    block.read(4106, 23)
+    assert pool.readahead_count == readahead_count + 1
+    manager.close()
+
+    _clean_up()
+
+
 def _get_common_file_paths():
     check_name = None
     frame = inspect.currentframe()
@@ -0,0 +1,289 @@
+import sys
+import os
+import shutil
+import inspect
+import mmap
+import pickle
+
+sys.path.append(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir), "kvdb")
+)
+
+from memory_manager import MemoryManager
+from tree_index import TreeIndex
+from skiplist_index import SkipListIndex
+from btree_index import BTreeIndex
+from client import Client
+
+package_root_path = os.path.abspath(
+    os.path.join(os.path.join(os.path.dirname(__file__), os.pardir), "unit-packages")
+)
+
+
+def test_value_compression():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    # zlib, lzma and bz2 are configured for tree, skiplist and btree index
+    large_value = {
+        "field-{}".format(i): "payload {} ".format(i) * 20 for i in range(50)
+    }
+    small_value = {"field": "payload"}
+    random_value = os.urandom(2048)
+    locations = {}
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        index = index_type(manager)
+        index.set("large", large_value)
+        index.set("small", small_value)
+        index.set("random", random_value)
+        if index_type is TreeIndex:
+            index.persist()
+        assert index.get("large") == large_value
+        assert index.get("small") == small_value
+        assert index.get("random") == random_value
+
+        record_lengths = sorted(length for _, length in index.live_values())
+        # small value is below threshold, random value does not compress
+        assert record_lengths[0] > len(pickle.dumps(small_value))
+        assert record_lengths[-1] > len(pickle.dumps(random_value))
+        assert record_lengths[1] * 5 < len(pickle.dumps(large_value))
+        locations[index_type] = [value.location for value, _ in index.live_values()]
+    manager.close()
+
+    # values are decompressed after restart
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    for index_type, index_locations in locations.items():
+        index = index_type(manager)
+        values = [index.load_value(location) for location in index_locations]
+        assert sorted(map(pickle.dumps, values)) == sorted(
+            map(pickle.dumps, [large_value, small_value, random_value])
+        )
+    manager.close()
+
+    _clean_up()
+
+
+def test_value_serializers():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    Client.register_serializer(
+        0x40, Point, lambda point: "{},{}".format(point.x, point.y).encode(), Point.load
+    )
+    # tags of built-in serializers and value codecs could not be taken
+    for tag in (0x05, 0x10, 0x30, 0x3F, 0x80):
+        try:
+            Client.register_serializer(tag, Point, bytes, Point.load)
+            assert False, "tag {:#x} should be rejected".format(tag)
+        except ValueError:
+            pass
+    values = [
+        b"raw bytes",
+        bytearray(b"raw bytearray"),
+        "utf-8 str \u00e9",
+        -123456789,
+        1 << 70,
+        True,
+        2.5,
+        None,
+        {"nested": [1, "two", b"three"]},
+        Point(3, 4),
+        # not utf-8, pickled
+        "lone surrogate \ud800",
+    ]
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        index = index_type(manager)
+        for key, value in enumerate(values):
+            index.set(key, value)
+        if index_type is TreeIndex:
+            index.persist()
+        for key, value in enumerate(values):
+            assert index.get(key) == value
+            assert type(index.get(key)) is type(value)
+        # raw bytes and ints are stored after a tag byte, so records of both have
+        # the same overhead
+        record_lengths = {
+            value.location: length for value, length in index.live_values()
+        }
+        pointers = dict(index.entries())
+        bytes_overhead = record_lengths[pointers[0].location] - len(values[0])
+        int_overhead = record_lengths[pointers[3].location] - 8
+        assert bytes_overhead == int_overhead
+    manager.close()
+
+    _clean_up()
+
+
+def test_value_out_of_band_buffers():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    payload = bytes(range(256)) * 32
+    locations = {}
+    for index_type in (TreeIndex, SkipListIndex, BTreeIndex):
+        index = index_type(manager)
+        index.set("large", Frame(bytearray(payload)))
+        index.set("small", Frame(bytearray(b"small frame")))
+        if index_type is TreeIndex:
+            index.persist()
+        # large buffer is a read-only view of pool's mmap, it is never compressed
+        large_frame = index.get("large")
+        assert large_frame.data == payload and large_frame.data.readonly
+        assert isinstance(large_frame.data.obj, mmap.mmap)
+        record_lengths = sorted(length for _, length in index.live_values())
+        assert len(payload) < record_lengths[-1] < len(payload) + 256
+        # small buffer is pickled in band
+        small_frame = index.get("small")
+        assert type(small_frame.data) is bytearray
+        assert small_frame.data == b"small frame"
+        locations[index_type] = dict(
+            (key, value.location) for key, value in index.entries()
+        )
+    # mapping outlives closed pool while a loaded value views it
+    manager.close()
+    assert large_frame.data == payload
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    for index_type, index_locations in locations.items():
+        index = index_type(manager)
+        assert index.load_value(index_locations["large"]).data == payload
+        assert index.load_value(index_locations["small"]).data == b"small frame"
+    manager.close()
+
+    _clean_up()
+
+
+def test_value_cache():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    _clean_up()
+
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=conf_path, block_file=block_file
+    )
+    value_cache = manager.value_cache
+    tree_index, skiplist_index, btree_index = (
+        TreeIndex(manager),
+        SkipListIndex(manager),
+        BTreeIndex(manager),
+    )
+    tree_index.set("tree", {"name": "tree"})
+    tree_index.persist()
+    skiplist_index.set("skiplist", {"name": "skiplist"})
+    btree_index.set("btree", {"name": "btree"})
+    # cache is shared, a hit returns the same decoded object
+    for index, key in ((tree_index, "tree"), (skiplist_index, "skiplist")):
+        first_value = index.get(key)
+        assert index.get(key) is first_value
+    btree_value = btree_index.get("btree")
+    assert btree_index.get("btree") is btree_value
+    assert (value_cache.hit_count, value_cache.miss_count) == (3, 3)
+
+    # overwritten value is released, its cached value is discarded
+    cached_size = value_cache.size
+    btree_index.set("btree", {"name": "new btree"})
+    assert value_cache.size < cached_size
+    assert btree_index.get("btree") == {"name": "new btree"}
+
+    # records are moved inside block by compaction, no stale value is returned
+    keys = ["key {}".format(i) for i in range(5)]
+    for key in keys:
+        skiplist_index.set(key, "value of {}".format(key))
+    assert [skiplist_index.get(key) for key in keys] == [
+        "value of {}".format(key) for key in keys
+    ]
+    skiplist_index.remove(keys[0])
+    skiplist_index.compact()
+    assert [skiplist_index.get(key) for key in keys[1:]] == [
+        "value of {}".format(key) for key in keys[1:]
+    ]
+
+    # cached size stays under limit
+    for i in range(20):
+        btree_index.set("key {}".format(i), os.urandom(512))
+        btree_index.get("key {}".format(i))
+    assert value_cache.size <= value_cache.limit
+    assert value_cache.evicted_count > 0
+    manager.close()
+
+    # shipped conf keeps cache off, loaded values could be mutated by callers
+    _clean_up()
+    shipped_conf_path = os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        os.pardir,
+        "kvdb",
+        "conf",
+        "storage_conf.ini",
+    )
+    manager = MemoryManager(
+        pool_folder=pool_folder, conf_path=shipped_conf_path, block_file=block_file
+    )
+    assert manager.value_cache is None
+    manager.close()
+
+    _clean_up()
+
+
+class Frame(object):
+    """buffer is pickled as `PickleBuffer`, like NumPy arrays do"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        return Frame, (pickle.PickleBuffer(self.data),)
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def __eq__(self, other):
+        return (self.x, self.y) == (other.x, other.y)
+
+    @staticmethod
+    def load(data):
+        return Point(*map(int, bytes(data).split(b",")))
+
+
+def _get_common_file_paths():
+    check_name = None
+    frame = inspect.currentframe()
+    while frame:
+        if frame.f_code.co_name.startswith("test_"):
+            check_name = frame.f_code.co_name
+            break
+        frame = frame.f_back
+    assert check_name and check_name.startswith("test_")
+
+    pool_folder = os.path.abspath(
+        os.path.join(package_root_path, "value_record", check_name, "pools")
+    )
+    conf_path = os.path.abspath(
+        os.path.join(package_root_path, "value_record", check_name, "storage_conf.ini")
+    )
+    block_file = os.path.abspath(
+        os.path.join(package_root_path, "value_record", check_name, "block_file")
+    )
+    return pool_folder, conf_path, block_file
+
+
+def _clean_up():
+    pool_folder, conf_path, block_file = _get_common_file_paths()
+    if os.path.exists(pool_folder):
+        shutil.rmtree(pool_folder)
+    if os.path.exists(block_file):
+        os.remove(block_file)